@@ -4,6 +4,10 @@ from backend.utils import windows_dpi_awareness
 
 if __name__ == '__main__':
     # --- Internal Settings ---
+    # Run the stimulation keepalive on a dedicated I/O thread so slow GUI work can't delay it
+    threaded_stimulation = False
+    # Time the end of the stimulation on a dedicated thread (if it's not threaded anyway) instead of the Tk event loop
+    stop_thread = True
 
     windows_dpi_awareness()
     logging.basicConfig(level=logging.DEBUG)
@@ -11,6 +15,6 @@ if __name__ == '__main__':
     # -------------------------
 
 
-    experimenter_window = ExperimenterWindow()
+    experimenter_window = ExperimenterWindow(threaded_stimulation, stop_thread)
 
     experimenter_window.mainloop()
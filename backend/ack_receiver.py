@@ -0,0 +1,206 @@
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+
+class AckTimeoutError(TimeoutError):
+    """Raised (through the Future) if the acknowledgement of a command doesn't arrive in time."""
+    pass
+
+
+@dataclass
+class ReceivedAck:
+    """An acknowledgement (response) of the device.
+
+    Attributes:
+        command_number: The command number of the acknowledgement (e.g. ``Smpt_Cmd_Ml_Get_Current_Data_Ack``).
+        packet_number: The packet number of the acknowledged command.
+        result: The result code of the acknowledgement.
+        payload: The command-specific acknowledgement structure (e.g. ``Smpt_ml_get_current_data_ack*``) if the
+        command has one, else None.
+        received_time: The ``time.perf_counter`` time at which the acknowledgement was read.
+    """
+    command_number: int
+    packet_number: int
+    result: int
+    payload: Any
+    received_time: float
+
+
+@dataclass
+class _PendingRequest:
+    future: Future
+    deadline: float
+
+
+class AckReceiver:
+    # How often a device which can't tell when acknowledgements arrive (the ScienceMode library) is polled while
+    # acknowledgements are outstanding
+    POLL_INTERVAL_S = 0.001
+    # Timeouts by the acknowledgement's command number. Commands without an entry use DEFAULT_TIMEOUT_S.
+    TIMEOUTS_S = {
+        'Smpt_Cmd_Get_Extended_Version_Ack': 1.0,
+        'Smpt_Cmd_Ml_Init_Ack': 0.5,
+        'Smpt_Cmd_Ml_Update_Ack': 0.5,
+        'Smpt_Cmd_Ml_Stop_Ack': 0.5,
+        'Smpt_Cmd_Ml_Get_Current_Data_Ack': 0.5,
+        'Smpt_Cmd_Ll_Init_Ack': 0.5,
+        'Smpt_Cmd_Ll_Stop_Ack': 0.5,
+    }
+    DEFAULT_TIMEOUT_S = 0.5
+
+    def __init__(self, backend, device, device_lock: threading.RLock):
+        """Reads all acknowledgements of a device on a background thread and routes them by command number and packet
+        number to the Futures of the commands waiting for them. The thread sleeps while no acknowledgements are
+        outstanding. If the backend tells when acknowledgements can be read (see ``SimulatedP24.notify_packets``), it
+        only wakes up then and when a request expires. The ScienceMode library can only be polled, so it's polled every
+        POLL_INTERVAL_S while acknowledgements are outstanding.
+        :param backend: The ScienceMode module (or a simulation of it).
+        :param device: The ``Smpt_device*`` to read from.
+        :param device_lock: The lock which serializes access to the device."""
+        self.sm, self.device, self._device_lock = backend, device, device_lock
+        self._ack = backend.ffi.new("Smpt_ack*")
+        # Acknowledgements with a payload: command number -> (structure type, getter)
+        self._payload_readers = {
+            backend.Smpt_Cmd_Get_Extended_Version_Ack: ("Smpt_get_extended_version_ack*",
+                                                        backend.smpt_get_get_extended_version_ack),
+            backend.Smpt_Cmd_Ml_Get_Current_Data_Ack: ("Smpt_ml_get_current_data_ack*",
+                                                       backend.smpt_get_ml_get_current_data_ack),
+            backend.Smpt_Cmd_Ll_Channel_Config_Ack: ("Smpt_ll_channel_config_ack*",
+                                                     backend.smpt_get_ll_channel_config_ack),
+        }
+        self._timeouts = {getattr(backend, name): timeout for name, timeout in self.TIMEOUTS_S.items()}
+
+        self._pending: dict[tuple[int, int], _PendingRequest] = {}  # (command number, packet number) -> request
+        self._condition = threading.Condition()
+        self._running = True
+        self._packet_times = []  # heap of the times from which the device said acknowledgements can be read
+        self._notify_packets = getattr(backend, 'notify_packets', None)
+        if self._notify_packets is not None:
+            self._notify_packets(device, self._on_packet)
+        self.lost_acks = 0  # The number of acknowledgements which didn't arrive in time
+        self.unexpected_acks = 0  # The number of acknowledgements nobody was waiting for
+
+        self._thread = threading.Thread(target=self._run, name='AckReceiver', daemon=True)
+        self._thread.start()
+
+    def expect(self, ack_command_number: int, packet_number: int, timeout_s: Optional[float] = None,
+               callback: Optional[Callable[[Future], None]] = None) -> Future:
+        """Register a command whose acknowledgement should be waited for. Must be called before sending the command.
+        :param ack_command_number: The command number of the acknowledgement (e.g. ``Smpt_Cmd_Ml_Init_Ack``).
+        :param packet_number: The packet number the command is sent with.
+        :param timeout_s: After this time, the Future fails with an AckTimeoutError. Defaults to the timeout of the
+        command in TIMEOUTS_S.
+        :param callback: Called with the Future when it's done. It's called on the receiver thread.
+        :return: A Future with the ReceivedAck."""
+        if timeout_s is None:
+            timeout_s = self._timeouts.get(ack_command_number, self.DEFAULT_TIMEOUT_S)
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        key = (ack_command_number, packet_number)
+        with self._condition:
+            replaced = self._pending.get(key)
+            self._pending[key] = _PendingRequest(future, time.perf_counter() + timeout_s)
+            self._condition.notify()
+        if replaced is not None:
+            # The packet number has wrapped around before the acknowledgement arrived
+            self._fail(replaced.future, key)
+        return future
+
+    def shutdown(self):
+        """Stop the receiver thread. Outstanding acknowledgements aren't waited for."""
+        if self._notify_packets is not None:
+            self._notify_packets(self.device, None)
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def _on_packet(self, ready_time: float):
+        """Called by the device when an acknowledgement can be read from ``ready_time`` on."""
+        with self._condition:
+            heapq.heappush(self._packet_times, ready_time)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._wait_for_packets():
+                    return
+            # noinspection PyBroadException
+            try:
+                self.poll()
+            except Exception:
+                logging.exception('Exception while receiving acknowledgements')
+
+    def _wait_for_packets(self) -> bool:
+        """Wait until acknowledgements may have arrived or a request expires. Must be called while holding the
+        condition.
+        :return: False if the receiver has been shut down."""
+        while self._running:
+            if not self._pending:
+                self._condition.wait()
+                continue
+            now = time.perf_counter()
+            wake_time = min(request.deadline for request in self._pending.values())
+            if self._notify_packets is None:
+                wake_time = min(wake_time, now + self.POLL_INTERVAL_S)
+            elif self._packet_times:
+                wake_time = min(wake_time, self._packet_times[0])
+            if wake_time <= now:
+                return True
+            self._condition.wait(wake_time - now)
+            if self._notify_packets is None:
+                return True
+        return False
+
+    def poll(self):
+        """Read all acknowledgements which have arrived, resolve the waiting Futures, and fail the expired ones."""
+        received = []
+        with self._device_lock:
+            read_time = time.perf_counter()  # Everything which could be read from this time on is read
+            while self.sm.smpt_new_packet_received(self.device):
+                self.sm.smpt_clear_ack(self._ack)
+                self.sm.smpt_last_ack(self.device, self._ack)
+                command_number = self._ack.command_number
+                payload = None
+                if command_number in self._payload_readers:
+                    c_type, getter = self._payload_readers[command_number]
+                    payload = self.sm.ffi.new(c_type)
+                    getter(self.device, payload)
+                received.append(ReceivedAck(command_number, self._ack.packet_number, self._ack.result, payload,
+                                            time.perf_counter()))
+
+        now = time.perf_counter()
+        resolved, expired = [], []
+        with self._condition:
+            while self._packet_times and self._packet_times[0] <= read_time:
+                heapq.heappop(self._packet_times)
+            for ack in received:
+                request = self._pending.pop((ack.command_number, ack.packet_number), None)
+                if request is None:
+                    self.unexpected_acks += 1
+                    logging.debug(f'Discarding unexpected acknowledgement (command number {ack.command_number}, '
+                                  f'packet number {ack.packet_number})')
+                else:
+                    resolved.append((request.future, ack))
+            for key in [key for key, request in self._pending.items() if request.deadline <= now]:
+                expired.append((self._pending.pop(key).future, key))
+
+        # Resolve outside the lock because the callbacks run now
+        for future, ack in resolved:
+            future.set_result(ack)
+        for future, key in expired:
+            self._fail(future, key)
+
+    def _fail(self, future: Future, key: tuple[int, int]):
+        self.lost_acks += 1
+        msg = f'The acknowledgement with command number {key[0]} and packet number {key[1]} was lost.'
+        logging.warning(msg)
+        future.set_exception(AckTimeoutError(msg))
@@ -0,0 +1,122 @@
+import logging
+import math
+import time
+from dataclasses import replace
+from datetime import datetime
+from typing import Callable, Optional
+
+from backend.stimulator import Stimulator, StimulationParameters
+
+
+class AmplitudeRamp:
+    STEP_MA = 0.5  # The amplitude resolution of the device
+    HOLD_AT_MAXIMUM_S = 2.0  # How long the maximum amplitude is stimulated before the ramp ends by itself
+
+    def __init__(self, master, stimulator: Stimulator, channel: int, stim_params: StimulationParameters,
+                 rate_ma_per_s: float, maximum_ma: float):
+        """Stimulates on one channel and raises the amplitude continuously with live ML updates, starting at the
+        amplitude of ``stim_params``. The amplitude is raised in steps of the device resolution at the given rate.
+        :param master: The widget whose event loop the amplitude steps are scheduled on.
+        :param stimulator: The stimulator. Its ML stimulation is used for the ramp.
+        :param channel: The channel number as depicted on the stimulator (1-8)
+        :param stim_params: The pulse parameters. Its amplitude is the start of the ramp.
+        :param rate_ma_per_s: How fast the amplitude is raised in mA/s
+        :param maximum_ma: The amplitude at which the ramp stops rising
+        """
+        if rate_ma_per_s <= 0:
+            raise ValueError(f'rate_ma_per_s must be positive but is {rate_ma_per_s}.')
+        self.master, self.stimulator, self.channel = master, stimulator, channel
+        self.stim_params = stim_params
+        self.rate_ma_per_s = rate_ma_per_s
+        self.start_ma = min(stim_params.amplitude_ma, maximum_ma)
+        self.maximum_ma = maximum_ma
+        self.amplitude_ma = self.start_ma  # The amplitude which was last sent to the device
+        self.start_time = None  # When the ramp started (time.perf_counter)
+        self.running = False
+        self._n_steps = math.floor((self.maximum_ma - self.start_ma) / self.STEP_MA + 1e-9)
+        self._step = 0  # The number of steps taken so far
+        self._step_callback = None  # The callback identifier of the next step
+
+    @classmethod
+    def comfortable_amplitude(cls, detection_ma: Optional[float], discomfort_ma: Optional[float],
+                              maximum_ma: float) -> Optional[float]:
+        """The highest amplitude of a ramp which the participant felt and which wasn't uncomfortable.
+        :param detection_ma: The amplitude when the participant felt the stimulation, or None if they didn't.
+        :param discomfort_ma: The amplitude when it became uncomfortable, or None if it didn't up to the maximum.
+        :param maximum_ma: The maximum of the ramp
+        :return: The amplitude, or None if the stimulation wasn't detected."""
+        if detection_ma is None:
+            return None
+        if discomfort_ma is None:
+            return maximum_ma
+        return max(discomfort_ma - cls.STEP_MA, detection_ma)
+
+    def duration_s(self) -> float:
+        """The stimulation duration of a ramp without any press: rising to the maximum and holding it."""
+        return self._n_steps * self.STEP_MA / self.rate_ma_per_s + self.HOLD_AT_MAXIMUM_S
+
+    def start(self, on_maximum: Callable[[], None], on_error: Callable[[int], None]) -> float:
+        """Start the stimulation at the start amplitude and begin raising it.
+        :param on_maximum: The function to call when the maximum was held and the stimulation ended by itself.
+        :param on_error: A function to be executed with the channel if the stimulator says there's an error.
+        :return: The start time of the ramp."""
+        self.amplitude_ma = self.start_ma
+        self._step = 0
+        self.stimulator.rectangular_pulse(self.channel, replace(self.stim_params, amplitude_ma=self.start_ma))
+
+        def on_termination():
+            self._cancel_step()
+            self.running = False
+            on_maximum()
+
+        def on_stimulation_error(channel: int):
+            self._cancel_step()
+            self.running = False
+            on_error(channel)
+
+        self.start_time = self.stimulator.stimulate_ml(self.duration_s(), on_termination, on_stimulation_error)
+        self.running = True
+        logging.info(f'Ramping amplitude from {self.start_ma} mA to {self.maximum_ma} mA at {self.rate_ma_per_s} mA/s')
+        self._schedule_step()
+        return self.start_time
+
+    def _schedule_step(self):
+        """Schedule the next step at its fixed time after the start, so the lateness of one doesn't add up."""
+        if self._step >= self._n_steps:
+            self._step_callback = None
+            return
+        due_time = self.start_time + (self._step + 1) * self.STEP_MA / self.rate_ma_per_s
+        delay_ms = max(0, int((due_time - time.perf_counter()) * 1000))
+        self._step_callback = self.master.after(delay_ms, self._take_step)
+
+    def _take_step(self):
+        self._step_callback = None
+        if not self.running:
+            return
+        self._step += 1
+        self.amplitude_ma = self.start_ma + self._step * self.STEP_MA
+        self.stimulator.rectangular_pulse(self.channel, replace(self.stim_params, amplitude_ma=self.amplitude_ma))
+        self.stimulator.update_ml()
+        self._schedule_step()
+
+    def _cancel_step(self):
+        if self._step_callback is not None:
+            self.master.after_cancel(self._step_callback)
+            self._step_callback = None
+
+    def mark(self) -> dict:
+        """Record the amplitude at this moment, e.g. when the participant presses a key. The ramp continues.
+        :return: The timestamp, the amplitude in mA, and the time since the start of the ramp in seconds."""
+        return {'timestamp': datetime.now().isoformat(), 'amplitude_ma': self.amplitude_ma,
+                'ramp_time_s': time.perf_counter() - self.start_time}
+
+    def stop(self) -> Optional[dict]:
+        """Stop the ramp and the stimulation.
+        :return: The mark (see mark()) at the moment of stopping, or None if the ramp isn't running."""
+        if not self.running:
+            return None
+        marked = self.mark()
+        self.running = False
+        self._cancel_step()
+        self.stimulator.stop_stimulation()
+        return marked
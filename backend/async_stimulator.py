@@ -0,0 +1,160 @@
+import asyncio
+import itertools
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from backend.ack_receiver import ReceivedAck
+from backend.io_scheduler import IOScheduler
+from backend.stimulator import Stimulator, StimulationParameters, StimulatorError
+
+
+class ChannelError(StimulatorError):
+    """Raised if the stimulator reports an error on a channel during stimulation."""
+
+    def __init__(self, channel: int):
+        super().__init__(f"The stimulator has reported an error on channel {channel}.")
+        self.channel = channel
+
+
+class _AsyncioMaster:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        """Provides the ``after``/``after_cancel`` interface of tkinter on an asyncio event loop, so the Stimulator can
+        be used without a Tk event loop. Must be created on the thread of the loop. Like tkinter, it can be called from
+        other threads (e.g. when the port is opened in a worker thread), and the functions still run on the loop."""
+        self.loop = loop
+        self._loop_thread = threading.current_thread()
+        self._handles = {}
+        self._counter = itertools.count()
+        # Identifiers scheduled from other threads which haven't reached the loop yet
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def after(self, ms: float, func: Callable, *args) -> str:
+        identifier = f'asyncio#{next(self._counter)}'
+
+        def run():
+            self._handles.pop(identifier, None)
+            func(*args)
+
+        if threading.current_thread() is self._loop_thread:
+            self._handles[identifier] = self.loop.call_later(ms / 1000, run)
+        else:
+            # call_later isn't thread-safe
+            with self._lock:
+                self._pending.add(identifier)
+            self.loop.call_soon_threadsafe(self._schedule, identifier, ms, run)
+        return identifier
+
+    def _schedule(self, identifier: str, ms: float, run: Callable):
+        with self._lock:
+            if identifier not in self._pending:
+                return  # It was cancelled in the meantime
+            self._pending.discard(identifier)
+        self._handles[identifier] = self.loop.call_later(ms / 1000, run)
+
+    def after_cancel(self, identifier: str):
+        if threading.current_thread() is not self._loop_thread:
+            self.loop.call_soon_threadsafe(self.after_cancel, identifier)
+            return
+        with self._lock:
+            self._pending.discard(identifier)
+        handle = self._handles.pop(identifier, None)
+        if handle is not None:
+            handle.cancel()
+
+
+class AsyncStimulator:
+    def __init__(self, backend=None, io_scheduler: Optional[IOScheduler] = None):
+        """An asyncio interface for the Stimulator. Must be created while the event loop is running.
+        Stimulation ends and channel errors are delivered as awaitables instead of callbacks:
+
+            stimulator = AsyncStimulator()
+            await stimulator.initialize('COM5')
+            try:
+                duration_s = await stimulator.stimulate([1, 8], params, duration_s=5)
+            except ChannelError as e:
+                ...
+
+        :param backend: The module used to communicate with the device. Defaults to the ScienceMode wrapper.
+        :param io_scheduler: If given, the keepalive runs on this I/O thread instead of the event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        self.stimulator = Stimulator(_AsyncioMaster(self._loop), backend=backend, io_scheduler=io_scheduler)
+        self._errors = asyncio.Queue()  # All channel errors, see errors()
+        self._stimulation: Optional[asyncio.Future] = None
+
+    async def initialize(self, port: str):
+        """Open the port and initialize the stimulator."""
+        # This blocks until the device has responded, so it's run in a worker thread.
+        await self._loop.run_in_executor(None, self.stimulator.initialize, port)
+
+    def start(self, channels: Iterable[int], params: StimulationParameters, duration_s: float) -> asyncio.Future:
+        """Start stimulating on the given channels without waiting for the end of the stimulation.
+        :param channels: The channels as depicted on the stimulator (1-8).
+        :param params: The pulse parameters for all channels.
+        :param duration_s: The stimulation duration in seconds.
+        :return: A Future with the stimulation duration in seconds. It fails with a ChannelError if the stimulator
+        reports an error. It's cancelled if the stimulation is stopped with stop()."""
+        if self.stimulating:
+            raise StimulatorError('A stimulation is already running.')
+        for channel in channels:
+            self.stimulator.rectangular_pulse(channel, params)
+        stimulation = self._loop.create_future()
+        self._stimulation = stimulation
+        start_time = self.stimulator.stimulate_ml(
+            duration_s,
+            on_termination=lambda: self._finish(stimulation, result=time.perf_counter() - start_time),
+            on_error=lambda channel: self._on_error(stimulation, channel))
+        return stimulation
+
+    async def stimulate(self, channels: Iterable[int], params: StimulationParameters, duration_s: float) -> float:
+        """Stimulate on the given channels and wait until the stimulation is over.
+        See start() for the parameters.
+        :return: The stimulation duration in seconds.
+        :raises ChannelError: If the stimulator reports an error on a channel.
+        :raises asyncio.CancelledError: If the stimulation is stopped with stop()."""
+        return await self.start(channels, params, duration_s)
+
+    @property
+    def stimulating(self) -> bool:
+        return self._stimulation is not None and not self._stimulation.done()
+
+    async def stop(self):
+        """Stop the stimulation. A pending stimulate() is cancelled."""
+        self.stimulator.stop_stimulation()
+        if self._stimulation is not None and not self._stimulation.done():
+            self._stimulation.cancel()
+
+    async def get_current_data(self) -> ReceivedAck:
+        """Request the current data from the device. This also keeps a stimulation going.
+        :return: The acknowledgement. Its payload is the ``Smpt_ml_get_current_data_ack*``."""
+        return await asyncio.wrap_future(self.stimulator.get_current_data())
+
+    async def errors(self):
+        """An async iterator over the channels (1-8) on which the stimulator reports errors, e.g.:
+
+            async for channel in stimulator.errors():
+                ...
+        """
+        while True:
+            yield await self._errors.get()
+
+    async def close(self):
+        """Stop any stimulation and close the port."""
+        if self.stimulating:
+            await self.stop()
+        self.stimulator.close_com_port()
+
+    def _on_error(self, stimulation: asyncio.Future, channel: int):
+        self._errors.put_nowait(channel)
+        self._finish(stimulation, exception=ChannelError(channel))
+
+    @staticmethod
+    def _finish(stimulation: asyncio.Future, result: Optional[float] = None, exception: Optional[Exception] = None):
+        if stimulation.done():
+            return
+        if exception is not None:
+            stimulation.set_exception(exception)
+        else:
+            stimulation.set_result(result)
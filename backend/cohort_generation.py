@@ -0,0 +1,232 @@
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from backend.channel_electrode_maps import CHANNEL_ELECTRODE_MAPS
+from backend.stimulation_order import StimulationOrder
+
+
+@dataclass(frozen=True)
+class OrderConstraints:
+    """The design of the stimulation orders of a cohort.
+
+    Attributes:
+        n_blocks: The number of blocks of each participant.
+        n_trials_per_block: The number of trials in each block.
+        channels: The channels which are stimulated.
+        n_channels_weights: The relative frequencies of the numbers of channels in a trial. In every block, the
+            numbers of trials with each number of channels are proportional to them (as far as they can be).
+        max_consecutive: A channel is stimulated in at most this many consecutive trials of a block.
+        map_ids: The channel-electrode-maps. Their order over the blocks is counterbalanced across participants
+            with a balanced Latin square.
+    """
+    n_blocks: int = 4
+    n_trials_per_block: int = 8
+    channels: tuple[int, ...] = StimulationOrder.CHANNELS
+    n_channels_weights: dict[int, float] = field(default_factory=lambda: dict(StimulationOrder.N_CHANNELS_WEIGHTS))
+    max_consecutive: int = 2
+    map_ids: tuple[str, ...] = tuple(CHANNEL_ELECTRODE_MAPS.keys())
+
+
+# How many times the trials of a block are drawn again when they can't satisfy the constraints
+MAX_ATTEMPTS = 1000
+# The file with the balance statistics of a cohort, in the cohort folder
+REPORT_FILE_NAME = 'balance_report.xlsx'
+
+
+def balanced_latin_square(n: int) -> list[list[int]]:
+    """The rows of a balanced Latin square (Williams design) of n conditions. Every condition is at every position
+    equally often, and every condition directly follows every other one equally often.
+    :return: n rows if n is even, else 2n rows."""
+    first_row = [0]
+    low, high = 1, n - 1
+    for position in range(1, n):
+        if position % 2:
+            first_row.append(low)
+            low += 1
+        else:
+            first_row.append(high)
+            high -= 1
+    rows = [[(condition + shift) % n for condition in first_row] for shift in range(n)]
+    if n % 2:
+        # For an odd n, the mirrored rows are needed for the carryover balance
+        rows += [row[::-1] for row in rows]
+    return rows
+
+
+def apportion(weights: dict[int, float], total: int) -> dict[int, int]:
+    """Split total into integer counts proportional to the weights, with the largest remainder method."""
+    keys = list(weights.keys())
+    values = np.array([weights[key] for key in keys], dtype=np.float64)
+    exact = total * values / values.sum()
+    counts = np.floor(exact).astype(np.int64)
+    for index in np.argsort(-(exact - counts), kind='stable')[:total - counts.sum()]:
+        counts[index] += 1
+    return dict(zip(keys, counts.tolist()))
+
+
+def block_map_ids(constraints: OrderConstraints, participant_index: int) -> list[str]:
+    """The channel-electrode-map ID of each block of a participant. The blocks cycle through the participant's row of
+    the balanced Latin square."""
+    rows = balanced_latin_square(len(constraints.map_ids))
+    row = rows[participant_index % len(rows)]
+    return [constraints.map_ids[row[block % len(row)]] for block in range(constraints.n_blocks)]
+
+
+def generate_block(constraints: OrderConstraints, rng: np.random.Generator) -> list[list[int]]:
+    """Draw the channels of the trials of one block. Every channel is stimulated equally often in the block (up to one
+    stimulation, if the number of stimulations isn't divisible by the number of channels), and no channel is
+    stimulated in more than max_consecutive consecutive trials.
+    :return: The channels of each trial.
+    :raises ValueError: If no block satisfying the constraints was found within MAX_ATTEMPTS."""
+    channels = np.array(constraints.channels)
+    n_channels_counts = apportion(constraints.n_channels_weights, constraints.n_trials_per_block)
+    if max(n for n, count in n_channels_counts.items() if count) > channels.size:
+        raise ValueError(f'A trial can have at most {channels.size} channels.')
+    n_stimulations = sum(n * count for n, count in n_channels_counts.items())
+
+    for _attempt in range(MAX_ATTEMPTS):
+        n_channels = rng.permutation([n for n, count in n_channels_counts.items() for _ in range(count)])
+        # How often each channel still has to be stimulated. The channels with one extra stimulation are random.
+        remaining = np.full(channels.size, n_stimulations // channels.size)
+        remaining[rng.permutation(channels.size)[:n_stimulations % channels.size]] += 1
+        run_lengths = np.zeros(channels.size, dtype=np.int64)  # In how many trials in a row each channel was used
+
+        trials = []
+        for n in n_channels.tolist():
+            candidates = (remaining > 0) & (run_lengths < constraints.max_consecutive)
+            if candidates.sum() < n:
+                break
+            # Favour the channels which still have to be stimulated most often, so none is left over at the end
+            p = np.where(candidates, remaining, 0) / remaining[candidates].sum()
+            chosen = rng.choice(channels.size, size=n, replace=False, p=p)
+            remaining[chosen] -= 1
+            used = np.zeros(channels.size, dtype=bool)
+            used[chosen] = True
+            run_lengths = np.where(used, run_lengths + 1, 0)
+            trials.append(channels[np.sort(chosen)].tolist())
+        else:
+            return trials
+    raise ValueError(f'Could not generate a block satisfying the constraints in {MAX_ATTEMPTS} attempts.')
+
+
+def generate_order(constraints: OrderConstraints, participant_index: int,
+                   seed: Optional[np.random.SeedSequence | int] = None) -> StimulationOrder:
+    """Generate the stimulation order of one participant of a cohort.
+    :param constraints: The design of the orders.
+    :param participant_index: The position of the participant in the cohort, which selects the map order.
+    :param seed: The seed of the random generator."""
+    rng = np.random.default_rng(seed)
+    channels = [trial for _ in range(constraints.n_blocks) for trial in generate_block(constraints, rng)]
+    return StimulationOrder.from_channels(channels, block_map_ids(constraints, participant_index),
+                                          constraints.n_trials_per_block)
+
+
+def balance_statistics(stim_order: StimulationOrder, channels: Sequence[int]) -> dict:
+    """The achieved balance of a stimulation order.
+    :param stim_order: The stimulation order.
+    :param channels: The channels which should be stimulated.
+    :return: The map order, the largest difference between the stimulation counts of two channels within a block, the
+    longest run of consecutive trials of a channel within a block, and the stimulation count of each channel."""
+    order = stim_order.stim_order
+    counts = np.zeros((stim_order.n_blocks(), len(channels)), dtype=np.int64)
+    longest_run = 0
+    for block_index, (_block, block_order) in enumerate(order.groupby('block', sort=True)):
+        runs = dict.fromkeys(channels, 0)
+        for trial_channels in block_order['channels']:
+            for column, channel in enumerate(channels):
+                counts[block_index, column] += channel in trial_channels
+            runs = {channel: runs[channel] + 1 if channel in trial_channels else 0 for channel in channels}
+            longest_run = max(longest_run, *runs.values())
+    map_order = order.groupby('block', sort=True)['channel_electrode_map_id'].first().tolist()
+    return {'map order': ', '.join(map_order),
+            'max channel count difference in a block': int((counts.max(axis=1) - counts.min(axis=1)).max()),
+            'longest channel run': longest_run,
+            **{f'channel {channel} count': int(count) for channel, count in zip(channels, counts.sum(axis=0))}}
+
+
+def _generate_participant(constraints: OrderConstraints, participant_index: int, seed: np.random.SeedSequence,
+                          path: str) -> dict:
+    """Generate and save the order of one participant. Runs in a worker process."""
+    stim_order = generate_order(constraints, participant_index, seed)
+    stim_order.save_as_excel(path)
+    return balance_statistics(stim_order, constraints.channels)
+
+
+def generate_cohort(folder: str, participant_ids: Sequence[str], constraints: OrderConstraints = OrderConstraints(),
+                    seed: Optional[int] = None, max_workers: Optional[int] = None,
+                    overwrite: bool = False) -> pd.DataFrame:
+    """Generate the stimulation orders of a cohort in a process pool. Each participant's order is saved as
+    stimulation_order.xlsx in the subfolder named after them, and the balance statistics are saved in
+    REPORT_FILE_NAME in the folder.
+    :param folder: The folder containing the participant folders. Missing participant folders are created.
+    :param participant_ids: The participants in the order of the cohort, which assigns the map orders.
+    :param constraints: The design of the orders.
+    :param seed: The seed of the random generators. The same seed generates the same cohort, no matter how many
+    workers are used.
+    :param max_workers: The number of processes. Defaults to the number of CPUs.
+    :param overwrite: Whether to replace existing stimulation orders.
+    :return: The balance statistics of each participant.
+    :raises FileExistsError: If a participant already has a stimulation order and overwrite is False."""
+    paths = [os.path.join(folder, participant_id, 'stimulation_order.xlsx') for participant_id in participant_ids]
+    if not overwrite:
+        existing = [path for path in paths if os.path.exists(path)]
+        if existing:
+            raise FileExistsError(f'Stimulation orders already exist: {existing}')
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Independent random streams per participant
+    seeds = np.random.SeedSequence(seed).spawn(len(participant_ids))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        statistics = list(executor.map(_generate_participant, [constraints] * len(paths), range(len(paths)), seeds,
+                                       paths))
+    logging.info(f'Generated the stimulation orders of {len(paths)} participants in {folder}')
+
+    report = pd.DataFrame(statistics, index=pd.Index(participant_ids, name='participant'))
+    save_report(os.path.join(folder, REPORT_FILE_NAME), report)
+    return report
+
+
+def save_report(path: str, report: pd.DataFrame):
+    """Save the balance statistics of each participant and the counterbalancing of the maps over the cohort: how many
+    participants have each map in each block, and how often each map directly follows each other one."""
+    map_orders = report['map order'].str.split(', ')
+    maps_per_block = pd.DataFrame(map_orders.tolist(), index=report.index).apply(pd.Series.value_counts).fillna(0)
+    maps_per_block = maps_per_block.astype(int).rename(columns=lambda block: f'block {block + 1}')
+    maps_per_block.index.name = 'map'
+    transitions = pd.Series([(first, second) for blocks in map_orders for first, second in zip(blocks, blocks[1:])],
+                            dtype=object)
+    map_sequences = transitions.value_counts().rename('count')
+    map_sequences.index = pd.Index([f'{first} -> {second}' for first, second in map_sequences.index],
+                                   name='sequence')
+
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        report.to_excel(writer, sheet_name='Participants')
+        maps_per_block.to_excel(writer, sheet_name='Maps per block')
+        map_sequences.to_frame().to_excel(writer, sheet_name='Map sequences')
+
+
+# Example usage: python -m backend.cohort_generation data/cohort 24 --seed 1
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the stimulation orders of a cohort.')
+    parser.add_argument('folder', help='The folder containing the participant folders.')
+    parser.add_argument('n_participants', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--n-blocks', type=int, default=OrderConstraints.n_blocks)
+    parser.add_argument('--n-trials-per-block', type=int, default=OrderConstraints.n_trials_per_block)
+    parser.add_argument('--max-consecutive', type=int, default=OrderConstraints.max_consecutive)
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    print(generate_cohort(args.folder, [f'participant_{i + 1:02d}' for i in range(args.n_participants)],
+                          OrderConstraints(n_blocks=args.n_blocks, n_trials_per_block=args.n_trials_per_block,
+                                           max_consecutive=args.max_consecutive),
+                          seed=args.seed, overwrite=args.overwrite).to_string())
@@ -0,0 +1,152 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+
+class DataWriter:
+    MAX_PENDING = 256  # Further writes without a key are dropped while this many writes are pending
+    INITIAL_BACKOFF_S = 0.1  # The wait before the first retry of a failed write. It doubles with every retry.
+    MAX_BACKOFF_S = 5.0
+
+    def __init__(self, on_status: Optional[Callable[[Optional[str]], None]] = None, max_pending: int = MAX_PENDING,
+                 name: str = 'DataWriter'):
+        """A thread which writes files in the background, so slow storage doesn't stall the Tk thread.
+        Writes are done in the order they were submitted. Failed writes are retried with exponential backoff until
+        they succeed, and the following writes wait for them.
+        :param on_status: Called on the writer thread with an error message when a write fails, and with None when
+        writing works again.
+        :param max_pending: The bound of the queue of pending writes.
+        :param name: The name of the thread."""
+        self.on_status = on_status
+        self.max_pending = max_pending
+        self.coalesced_writes = 0  # The number of writes which were replaced by a later one with the same key
+        self.dropped_writes = 0  # The number of writes which were dropped because the queue was full
+        self.error: Optional[str] = None  # The message of the current failure, or None if writing works
+        self._pending: OrderedDict[Hashable, Callable[[], None]] = OrderedDict()
+        self._counter = itertools.count()
+        self._busy = False  # Whether the thread is executing a write
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, write: Callable[[], None], key: Optional[Hashable] = None):
+        """Queue a write. Never blocks, so it can be called from the Tk thread.
+        If the queue is full, e.g. because the storage has been failing for a while, a write without a key is dropped
+        and reported through on_status. Writes with a key are always queued, as they're bounded by the number of keys.
+        :param write: The function which writes. It's retried if it raises an exception.
+        :param key: Writes with a key replace a pending write with the same key, e.g. the snapshots of one file.
+        Only the latest one is then written."""
+        with self._condition:
+            if key is not None and key in self._pending:
+                self._pending[key] = write
+                self.coalesced_writes += 1
+                return
+            if key is not None or len(self._pending) < self.max_pending:
+                self._pending[key if key is not None else ('write', next(self._counter))] = write
+                self._condition.notify_all()
+                return
+            self.dropped_writes += 1
+            dropped_writes = self.dropped_writes
+        logging.error(f'{self._thread.name} dropped a write because {self.max_pending} writes are pending')
+        self._set_error(f'Error saving the participant data: {dropped_writes} updates could not be queued. '
+                        f'They are saved with the next complete snapshot.')
+
+    def when_written(self, callback: Callable[[], None]):
+        """Call the callback on the writer thread once the writes submitted so far have been written.
+        It doesn't block, unlike flush(). The callback isn't called if the writer is shut down before.
+        :param callback: Called without arguments. Check the error to see whether writing works."""
+        def notify():
+            # noinspection PyBroadException
+            try:
+                callback()
+            except Exception:
+                logging.exception('Error in the callback after writing')
+
+        with self._condition:
+            # Not bounded, so the callback can't be dropped
+            self._pending[('callback', next(self._counter))] = notify
+            self._condition.notify_all()
+
+    def is_idle(self) -> bool:
+        """Whether all submitted writes have been written."""
+        with self._condition:
+            return not self._pending and not self._busy
+
+    def flush(self, timeout_s: Optional[float] = None) -> bool:
+        """Wait until all pending writes have been written.
+        :return: Whether they were written within the timeout."""
+        deadline = None if timeout_s is None else time.perf_counter() + timeout_s
+        with self._condition:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def shutdown(self, timeout_s: Optional[float] = None) -> bool:
+        """Write the pending writes and stop the thread. Writes which are still pending after the timeout are discarded.
+        :return: Whether all writes were written."""
+        flushed = self.flush(timeout_s)
+        if not flushed:
+            logging.error(f'Discarding the pending writes of {self._thread.name}')
+        self.stop()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        return flushed
+
+    def stop(self):
+        """Stop the thread after the current write without waiting for it. Pending writes are discarded.
+        Unlike shutdown(), it can be called on the writer thread, e.g. in a callback of when_written()."""
+        with self._condition:
+            self._running = False
+            self._pending.clear()
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                key, write = self._pending.popitem(last=False)
+                self._busy = True
+                self._condition.notify_all()  # There's space in the queue again
+            self._write(key, write)
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def _write(self, key: Hashable, write: Callable[[], None]):
+        """Write and retry with backoff until it succeeds or the writer is shut down."""
+        backoff_s = self.INITIAL_BACKOFF_S
+        while True:
+            # noinspection PyBroadException
+            try:
+                write()
+                break
+            except Exception as e:
+                logging.exception(f'Error writing data. Retrying in {backoff_s} s')
+                self._set_error(f'Error saving the participant data: {e}')
+            with self._condition:
+                self._condition.wait_for(lambda: not self._running, backoff_s)
+                if not self._running:
+                    return
+                # A newer write with the same key replaces the failed one
+                if key in self._pending:
+                    write = self._pending.pop(key)
+                    self.coalesced_writes += 1
+            backoff_s = min(backoff_s * 2, self.MAX_BACKOFF_S)
+        if self.error is not None:
+            logging.info('Writing data works again')
+            self._set_error(None)
+
+    def _set_error(self, error: Optional[str]):
+        self.error = error
+        if self.on_status is not None:
+            self.on_status(error)
@@ -0,0 +1,96 @@
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Optional
+
+from PIL import Image
+
+
+class ImageCache:
+    IMAGES_DIR = Path(__file__).parent.parent / 'images'
+    CACHE_DIR = IMAGES_DIR / 'cache'  # The resized images are saved here
+    REFERENCE_DPI = 96  # The screen resolution at which the widths are in pixels
+
+    def __init__(self, images_dir: Path = IMAGES_DIR, cache_dir: Optional[Path] = CACHE_DIR):
+        """Decodes and resizes each image only once per width and screen scaling. The resized images are kept in memory and saved as PNGs
+        in the cache_dir, so later runs of the app don't have to resize them again. It's thread-safe, so the cache can
+        be filled on a background thread.
+        :param images_dir: The folder of the images.
+        :param cache_dir: The folder of the resized images. None disables saving them."""
+        self.images_dir = images_dir
+        self.cache_dir = cache_dir
+        self._images: dict[tuple[str, int, float], Image.Image] = {}  # {(image name, width, scaling): image}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def screen_scaling(cls, widget) -> float:
+        """The resolution of the screen of a Tk widget relative to the REFERENCE_DPI, e.g. 1.5 at 144 DPI.
+        It's rounded, so it can be used in the key of an image."""
+        return round(widget.winfo_fpixels('1i') / cls.REFERENCE_DPI, 2)
+
+    def scaled_image(self, image_name: str, width: int, scaling: float = 1.0) -> Image.Image:
+        """The image scaled to the width, keeping its aspect ratio. The returned image is shared, so it mustn't be
+        changed.
+        :param image_name: The file name of the image in the images_dir.
+        :param width: The width in pixels at the REFERENCE_DPI.
+        :param scaling: The scaling of the screen (see screen_scaling). The image is width * scaling pixels wide."""
+        key = (image_name, width, scaling)
+        # Hold the lock while loading, so an image which is being loaded on another thread isn't loaded twice
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                image = self._load(image_name, round(width * scaling))
+                self._images[key] = image
+            return image
+
+    def _load(self, image_name: str, width: int) -> Image.Image:
+        """Load the image resized to the width in pixels."""
+        source_path = self.images_dir / image_name
+        cache_path = None if self.cache_dir is None else self.cache_dir / f'{Path(image_name).stem}_{width}.png'
+        # A resized image is only used if it's newer than the original
+        if cache_path is not None and cache_path.exists() and \
+                cache_path.stat().st_mtime_ns >= source_path.stat().st_mtime_ns:
+            try:
+                cached = Image.open(cache_path)
+                cached.load()  # Reads the image and closes the file
+                return cached
+            except OSError as e:
+                logging.warning(f'Could not read the cached image {cache_path}: {e}')
+
+        with Image.open(source_path) as image:
+            scaled_height = round(width / image.width * image.height)
+            scaled = image.resize((width, scaled_height), Image.Resampling.LANCZOS)
+        logging.debug(f'Resized {image_name} to {width} px')
+
+        if cache_path is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # Write to a temporary file first, so a cached image is never incomplete
+                temporary_path = cache_path.with_suffix('.tmp.png')
+                scaled.save(temporary_path)
+                os.replace(temporary_path, cache_path)
+            except OSError as e:
+                logging.warning(f'Could not cache the image {cache_path}: {e}')
+        return scaled
+
+    def warm_up(self, image_names: Iterable[str], width: int, scaling: float = 1.0) -> threading.Thread:
+        """Load the images in the background, e.g. at startup, so they're ready when they're first shown.
+        :param scaling: See scaled_image()
+        :return: The thread which loads them."""
+        image_names = list(image_names)
+
+        def load_all():
+            for image_name in image_names:
+                try:
+                    self.scaled_image(image_name, width, scaling)
+                except OSError:
+                    logging.exception(f'Could not load the image {image_name}')
+
+        thread = threading.Thread(target=load_all, name='ImageCacheWarmUp', daemon=True)
+        thread.start()
+        return thread
+
+
+# The cache shared by the whole app
+image_cache = ImageCache()
@@ -0,0 +1,182 @@
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+import tkinter as tk
+from typing import Callable
+
+
+class IOScheduler:
+    # Waiting on a condition can be late by up to a timer tick (~15.6 ms on Windows). For the last part of the wait,
+    # the thread yields in a loop instead.
+    SPIN_S = 0.002
+
+    def __init__(self, name: str = 'StimulationIO'):
+        """A dedicated thread which runs functions at ``time.perf_counter`` deadlines.
+        It offers the same ``after``/``after_cancel`` interface as tkinter, so it can replace the Tk event loop for
+        time-critical device I/O. This way, slow GUI work can't delay the keepalive of a running stimulation.
+        :param name: The name of the thread."""
+        self._callbacks = []  # heap of (deadline, sequence, identifier)
+        self._functions = {}  # identifier -> (func, args) of the scheduled callbacks which haven't been cancelled
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def thread(self) -> threading.Thread:
+        return self._thread
+
+    def after(self, ms: float, func: Callable, *args) -> str:
+        """Call ``func(*args)`` on the I/O thread after ``ms`` milliseconds.
+        :return: An identifier which can be passed to after_cancel."""
+        return self.call_at(time.perf_counter() + ms / 1000, func, *args)
+
+    def call_at(self, deadline: float, func: Callable, *args) -> str:
+        """Call ``func(*args)`` on the I/O thread at the given ``time.perf_counter`` deadline.
+        :return: An identifier which can be passed to after_cancel."""
+        sequence = next(self._counter)
+        identifier = f'io#{sequence}'
+        with self._condition:
+            self._functions[identifier] = (func, args)
+            heapq.heappush(self._callbacks, (deadline, sequence, identifier))
+            self._condition.notify()
+        return identifier
+
+    def after_cancel(self, identifier: str):
+        with self._condition:
+            self._functions.pop(identifier, None)
+
+    def shutdown(self):
+        """Stop the thread. Pending callbacks are discarded."""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                func, args = self._wait_for_next()
+                if func is None:
+                    return
+            # noinspection PyBroadException
+            try:
+                func(*args)
+            except Exception:
+                logging.exception(f'Exception in a callback of {self._thread.name}')
+
+    def _wait_for_next(self):
+        """Wait until the next callback is due and return it. Must be called while holding the condition."""
+        while self._running:
+            # Discard cancelled callbacks
+            while self._callbacks and self._callbacks[0][2] not in self._functions:
+                heapq.heappop(self._callbacks)
+            if not self._callbacks:
+                self._condition.wait()
+                continue
+
+            deadline, _, identifier = self._callbacks[0]
+            remaining = deadline - time.perf_counter()
+            if remaining > self.SPIN_S:
+                self._condition.wait(remaining - self.SPIN_S)
+            elif remaining > 0:
+                # Release the condition so other threads can still schedule and cancel
+                self._condition.release()
+                time.sleep(0)
+                self._condition.acquire()
+            else:
+                heapq.heappop(self._callbacks)
+                return self._functions.pop(identifier)
+        return None, ()
+
+
+class MainThreadDispatcher:
+    def __init__(self, master: tk.Misc):
+        """Runs functions submitted from other threads on the Tk thread. Must be created on the Tk thread.
+        The functions are put in a queue, and the Tk event loop is only asked to run them when there are any. Tk lets
+        other threads call ``after`` and waits until its thread has handled the call. A thread holding a lock which the
+        Tk thread waits for would deadlock then, so a helper thread without locks asks the Tk event loop instead."""
+        self.master = master
+        self._tk_thread = threading.current_thread()
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._scheduled = False  # Whether running the queued functions has been or is about to be scheduled
+        self._callback = None  # The identifier of the scheduled run
+        self._running = True
+        self._in_after = False  # Whether the helper thread is waiting for the Tk thread to handle its ``after``
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run_waker, name='MainThreadDispatcher', daemon=True)
+        self._thread.start()
+
+    def call(self, func: Callable, *args):
+        """Call ``func(*args)`` on the Tk thread. Can be called from any thread."""
+        self._queue.put((func, args))
+        with self._lock:
+            if self._scheduled or not self._running:
+                return
+            self._scheduled = True
+        if threading.current_thread() is self._tk_thread:
+            self._callback = self.master.after(0, self._run_queued)
+        else:
+            self._wake.set()
+
+    def shutdown(self):
+        """Stop running functions. Functions which haven't been called yet are discarded. Must be called on the Tk
+        thread."""
+        with self._lock:
+            self._running = False
+            in_after = self._in_after
+        self._wake.set()
+        # Waiting for a helper thread which waits for the Tk thread would deadlock. It ends once Tk handled its call.
+        if not in_after:
+            self._thread.join()
+        if self._callback is not None:
+            self.master.after_cancel(self._callback)
+            self._callback = None
+
+    def _run_waker(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                if not self._running:
+                    return
+                self._in_after = True
+            try:
+                self._callback = self.master.after(0, self._run_queued)
+            except (RuntimeError, tk.TclError) as e:
+                # E.g. the window has been destroyed. The functions are tried again with the next call.
+                logging.warning(f'Could not schedule functions on the Tk thread: {e}')
+                with self._lock:
+                    self._scheduled = False
+            finally:
+                with self._lock:
+                    self._in_after = False
+
+    def _run_queued(self):
+        with self._lock:
+            if not self._running:
+                return
+            # Functions submitted from now on need another run
+            self._scheduled = False
+            self._callback = None
+        try:
+            while True:
+                try:
+                    func, args = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                func(*args)
+        finally:
+            # If a function raised, the remaining ones still run
+            if not self._queue.empty():
+                with self._lock:
+                    schedule = self._running and not self._scheduled
+                    self._scheduled = self._scheduled or schedule
+                if schedule:
+                    self._callback = self.master.after(0, self._run_queued)
@@ -0,0 +1,60 @@
+import json
+import logging
+import os
+
+
+class Journal:
+    def __init__(self, path: str, new: bool = False):
+        """An append-only JSON Lines file. Every record is written as one compact line, flushed, and synced to disk,
+        so appending costs the same no matter how long the journal is.
+        :param path: The path of the journal.
+        :param new: Whether to start a new journal instead of appending to an existing one.
+        """
+        self.path = path
+        if not new and os.path.exists(path):
+            # Remove a last line which was only partially written (e.g. because of a crash)
+            _records, valid_size = self.read(path)
+            if valid_size < os.path.getsize(path):
+                logging.warning(f'Removing the incomplete last line of the journal {path}')
+                with open(path, 'r+b') as file:
+                    file.truncate(valid_size)
+        self._file = open(path, 'wb' if new else 'ab')
+
+    def append(self, record: dict):
+        """Write a record and wait until it's on disk. If that fails, the journal is left as it was before, so
+        the record can be appended again."""
+        position = self._file.tell()
+        try:
+            self._file.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError:
+            self._file.seek(position)
+            self._file.truncate()
+            raise
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def read(path: str) -> tuple[list[dict], int]:
+        """Read the records of a journal. An incomplete last line is ignored.
+        :return: The records and the size in bytes of the complete lines.
+        :raises ValueError: If a line other than the last one is invalid."""
+        with open(path, 'rb') as file:
+            lines = file.read().split(b'\n')
+        # Every complete line ends with a newline, so the last element is empty unless the last line is incomplete
+        records, valid_size = [], 0
+        for line_number, line in enumerate(lines[:-1], start=1):
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                if line_number == len(lines) - 1 and not lines[-1]:
+                    # A crash can also leave a garbled last line
+                    logging.warning(f'Ignoring the invalid last line of the journal {path}')
+                    break
+                raise ValueError(f'Invalid line {line_number} in the journal {path}: {e}')
+            valid_size += len(line) + 1
+        if lines[-1]:
+            logging.warning(f'Ignoring the incomplete last line of the journal {path}')
+        return records, valid_size
@@ -0,0 +1,111 @@
+import json
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+
+class RingBuffer:
+    def __init__(self, capacity: int):
+        """A fixed-size buffer of the most recent float samples. Recording a sample doesn't allocate.
+        :param capacity: The number of samples to keep. Older samples are overwritten."""
+        self._values = np.empty(capacity, dtype=np.float64)
+        self.count = 0  # The number of samples recorded in total, including the overwritten ones
+
+    @property
+    def capacity(self) -> int:
+        return self._values.size
+
+    def append(self, value: float):
+        self._values[self.count % self.capacity] = value
+        self.count += 1
+
+    def values(self) -> np.ndarray:
+        """The kept samples from oldest to newest."""
+        if self.count <= self.capacity:
+            return self._values[:self.count].copy()
+        start = self.count % self.capacity
+        return np.concatenate((self._values[start:], self._values[:start]))
+
+    def summary(self) -> dict:
+        """Statistics of the kept samples."""
+        values = self.values()
+        if values.size == 0:
+            return {'count': self.count}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {'count': self.count, 'mean': float(values.mean()), 'std': float(values.std()),
+                'min': float(values.min()), 'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+                'max': float(values.max())}
+
+
+class LatencyMetrics:
+    CAPACITY = 4096  # The number of samples kept per metric
+
+    # The metrics recorded by the Stimulator. All of them are in seconds.
+    # The send-to-acknowledgement round trips of the commands
+    RTT_ML_INIT = 'rtt_ml_init'
+    RTT_ML_UPDATE = 'rtt_ml_update'
+    RTT_ML_GET_CURRENT_DATA = 'rtt_ml_get_current_data'
+    RTT_ML_STOP = 'rtt_ml_stop'
+    KEEPALIVE_INTERVAL = 'keepalive_interval'  # The time between two keepalives
+    KEEPALIVE_LATENESS = 'keepalive_lateness'  # How much later than scheduled a keepalive was sent
+    STIMULATION_DURATION = 'stimulation_duration'  # From sending ml_update until sending ml_stop
+    DURATION_ERROR = 'duration_error'  # The actual minus the requested duration of stimulations which ran out
+    STOP_LATENCY = 'stop_latency'  # From the stop being requested (or due) until the device acknowledged it
+    # Recorded by the phases: from sending the stop until the participant's query screen is interactive
+    QUERY_LATENCY = 'query_latency'
+    QUERY_BUILD = 'query_build'  # Recorded by the phases: how long building (or resetting) the query screen took
+
+    def __init__(self, capacity: int = CAPACITY):
+        """Timing measurements of the Stimulator. Each metric is kept in a RingBuffer.
+        Samples can be recorded from any thread.
+        :param capacity: The number of samples kept per metric."""
+        self.capacity = capacity
+        self._buffers: dict[str, RingBuffer] = {}
+        self._lock = threading.Lock()
+
+    def record(self, metric: str, value: float):
+        with self._lock:
+            buffer = self._buffers.get(metric)
+            if buffer is None:
+                buffer = self._buffers[metric] = RingBuffer(self.capacity)
+            buffer.append(value)
+
+    def record_response(self, metric: str, response: Future, start_time: float):
+        """Record the time from ``start_time`` until the acknowledgement of ``response`` was received.
+        Nothing is recorded if the acknowledgement is lost."""
+
+        def on_done(future: Future):
+            if future.exception() is None:
+                self.record(metric, future.result().received_time - start_time)
+
+        response.add_done_callback(on_done)
+
+    def values(self, metric: str) -> np.ndarray:
+        """The kept samples of a metric from oldest to newest."""
+        with self._lock:
+            buffer = self._buffers.get(metric)
+            return buffer.values() if buffer is not None else np.empty(0)
+
+    def summary(self, metric: Optional[str] = None) -> dict:
+        """The statistics of one metric, or of all metrics by their name."""
+        with self._lock:
+            if metric is not None:
+                buffer = self._buffers.get(metric)
+                return buffer.summary() if buffer is not None else {'count': 0}
+            return {name: buffer.summary() for name, buffer in self._buffers.items()}
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+
+    def dump(self, path: str):
+        """Save the statistics and the kept samples of all metrics as JSON."""
+        with self._lock:
+            data = {'timestamp': datetime.now().isoformat(),
+                    'metrics': {name: {'summary': buffer.summary(), 'samples_s': buffer.values().tolist()}
+                                for name, buffer in self._buffers.items()}}
+        with open(path, 'w') as file:
+            json.dump(data, file, indent=4)
@@ -0,0 +1,235 @@
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+import numpy as np
+
+from backend.ack_receiver import AckReceiver, AckTimeoutError
+
+
+@dataclass
+class LowLevelStreamStats:
+    """Statistics of a low-level stimulation.
+
+    Attributes:
+        requested_pulses: The number of pulses which should have been stimulated.
+        sent_pulses: The number of pulses sent to the device.
+        acknowledged_pulses: The number of pulses the device acknowledged as stimulated.
+        rejected_pulses: The number of pulses the device didn't accept (e.g. because its buffer was full).
+        lost_acks: The number of pulses whose acknowledgement didn't arrive.
+        underruns: How often the device's buffer ran empty while there were still pulses to send.
+        ack_times: The ``time.perf_counter`` times at which the pulses were acknowledged.
+    """
+    requested_pulses: int = 0
+    sent_pulses: int = 0
+    acknowledged_pulses: int = 0
+    rejected_pulses: int = 0
+    lost_acks: int = 0
+    underruns: int = 0
+    ack_times: list[float] = field(default_factory=list)
+
+    def pulse_intervals_s(self) -> np.ndarray:
+        """The intervals between consecutive acknowledged pulses as seen by the host."""
+        return np.diff(np.asarray(self.ack_times))
+
+    def achieved_rate_hz(self) -> float:
+        """The achieved pulse rate (over all channels) as seen by the host."""
+        intervals = self.pulse_intervals_s()
+        return float(1 / intervals.mean()) if intervals.size > 0 else 0.0
+
+    def summary(self) -> str:
+        intervals_ms = self.pulse_intervals_s() * 1000
+        timing = ''
+        if intervals_ms.size > 0:
+            timing = (f', interval {intervals_ms.mean():.3f} ± {intervals_ms.std():.3f} ms '
+                      f'(max {intervals_ms.max():.3f} ms), rate {self.achieved_rate_hz():.1f} Hz')
+        return (f'{self.acknowledged_pulses}/{self.requested_pulses} pulses acknowledged, '
+                f'{self.rejected_pulses} rejected, {self.lost_acks} lost, {self.underruns} underruns{timing}')
+
+
+class LowLevelStreamer:
+    # The P24 buffers up to 10 ll_channel_config commands
+    BUFFER_SIZE = 10
+    MAX_POINT_TIME_US = 4095  # The maximum duration of a point
+    MAX_POINTS = 16  # The maximum number of points of a pulse
+    # Time added to the acknowledgement timeout on top of the time the buffered pulses take
+    ACK_TIMEOUT_MARGIN_S = 0.5
+
+    def __init__(self, backend, device, device_lock: threading.RLock, ack_receiver: AckReceiver, timer,
+                 call_in_master: Callable, channels: Iterable[int], amplitude_ma: float, phase_duration: int,
+                 interpulse_interval: int, period_ms: float, stim_duration_s: float,
+                 on_termination: Callable[[], None], on_error: Callable[[int], None]):
+        """Streams low-level (LL) pulses to the device with credit-based flow control.
+        Every pulse is padded with zero-current points to the length of the period (divided by the number of
+        channels), so the device times the buffered pulses back to back. A credit is used for every pulse sent and
+        returned when the device acknowledges it, which keeps the device's buffer full without overrunning it.
+        If the period is too long to be padded, each pulse is sent at its deadline instead.
+        Use Stimulator.stimulate_ll() rather than creating this directly.
+
+        :param backend: The ScienceMode module (or a simulation of it).
+        :param device: The ``Smpt_device*``.
+        :param device_lock: The lock which serializes access to the device.
+        :param ack_receiver: The AckReceiver of the device.
+        :param timer: An object with ``after``/``after_cancel`` used for host-timed pulses.
+        :param call_in_master: Calls a function on the Tk thread. Can be called from any thread.
+        :param channels: The channels as depicted on the stimulator (1-8). Their pulses are interleaved.
+        :param on_termination: Called on the Tk thread when all pulses have been stimulated.
+        :param on_error: Called on the Tk thread with the channel if the device reports an electrode error.
+        """
+        self.sm, self.device, self._device_lock, self._ack_receiver = backend, device, device_lock, ack_receiver
+        self._timer, self._call_in_master = timer, call_in_master
+        self.on_termination, self.on_error = on_termination, on_error
+        self.channels = list(channels)
+        self.period_s = period_ms / 1000
+
+        n_groups = max(1, round(stim_duration_s / self.period_s))
+        self.stats = LowLevelStreamStats(requested_pulses=n_groups * len(self.channels))
+        self._configs = self._compile_configs(amplitude_ma, phase_duration, interpulse_interval)
+        # Whether the device times the pulses (the padding fills the period) or the host does
+        self.device_timed = self._slot_us() <= self._max_pulse_us()
+
+        self._credits = self.BUFFER_SIZE
+        self._outstanding = 0  # Sent pulses which haven't been acknowledged
+        self._next_pulse = 0  # The index of the next pulse to send
+        # When the device will be done with the buffered pulses. Sending later than this means the buffer ran empty.
+        self._buffer_end = None
+        self._pulse_s = min(self._slot_us(), self._max_pulse_us()) / 1e6
+        self._start_time = None
+        self._send_callback = None
+        self.running = False
+        # Enough time for all buffered pulses to be stimulated
+        self._ack_timeout_s = self.BUFFER_SIZE * self.period_s + self.ACK_TIMEOUT_MARGIN_S
+
+    def _slot_us(self) -> int:
+        """The time of a pulse including its padding in microseconds."""
+        return int(self.period_s * 1e6 / len(self.channels))
+
+    def _max_pulse_us(self) -> int:
+        return self.MAX_POINTS * self.MAX_POINT_TIME_US
+
+    def _compile_configs(self, amplitude_ma: float, phase_duration: int, interpulse_interval: int) -> list:
+        """Precompute the ``Smpt_ll_channel_config`` of each channel. Only the packet number changes per pulse."""
+        pulse_us = 2 * phase_duration + interpulse_interval
+        slot_us = self._slot_us()
+        if pulse_us > slot_us:
+            raise ValueError(f'A pulse takes {pulse_us} µs, but only {slot_us} µs are available per pulse at this '
+                             f'period and number of channels.')
+        if phase_duration > self.MAX_POINT_TIME_US or interpulse_interval > self.MAX_POINT_TIME_US:
+            raise ValueError(f'The phase duration and interpulse interval can be at most {self.MAX_POINT_TIME_US} µs.')
+
+        # Pad to the length of the slot with as few points as possible
+        padding_us = min(slot_us, self._max_pulse_us()) - pulse_us
+        n_padding_points = math.ceil(padding_us / self.MAX_POINT_TIME_US)
+        if 3 + n_padding_points > self.MAX_POINTS:
+            n_padding_points = self.MAX_POINTS - 3
+            padding_us = n_padding_points * self.MAX_POINT_TIME_US
+
+        configs = []
+        for channel in self.channels:
+            config = self.sm.ffi.new("Smpt_ll_channel_config*")
+            config.enable_stimulation = True
+            config.connector, config.channel = divmod(channel - 1, 4)
+            points = [(amplitude_ma, phase_duration), (0, interpulse_interval), (-amplitude_ma, phase_duration)]
+            for i in range(n_padding_points):
+                points.append((0, min(self.MAX_POINT_TIME_US, padding_us - i * self.MAX_POINT_TIME_US)))
+            config.number_of_points = len(points)
+            for point, (current, time_us) in zip(config.points, points):
+                point.current, point.time = current, time_us
+            configs.append(config)
+        return configs
+
+    def start(self):
+        """Initialize low-level stimulation and fill the device's buffer."""
+        with self._device_lock:
+            ll_init = self.sm.ffi.new("Smpt_ll_init*")
+            ll_init.high_voltage_level = self.sm.Smpt_High_Voltage_Default
+            ll_init.packet_number = self.sm.smpt_packet_number_generator_next(self.device)
+            self._ack_receiver.expect(self.sm.Smpt_Cmd_Ll_Init_Ack, ll_init.packet_number)
+            self.sm.smpt_send_ll_init(self.device, ll_init)
+
+            self.running = True
+            self._start_time = time.perf_counter()
+            logging.info(f'Low-level stimulation started on channels {self.channels} '
+                         f'({"device" if self.device_timed else "host"} timed).')
+            self._send_available()
+
+    def stop(self):
+        """Stop the stimulation and discard the pulses which haven't been sent."""
+        with self._device_lock:
+            if not self.running:
+                return
+            self.running = False
+            if self._send_callback is not None:
+                self._timer.after_cancel(self._send_callback)
+                self._send_callback = None
+            packet_number = self.sm.smpt_packet_number_generator_next(self.device)
+            self._ack_receiver.expect(self.sm.Smpt_Cmd_Ll_Stop_Ack, packet_number)
+            self.sm.smpt_send_ll_stop(self.device, packet_number)
+            logging.info(f'Low-level stimulation stopped: {self.stats.summary()}')
+
+    def _send_available(self):
+        """Send pulses while there are credits (and, if host timed, while they are due).
+        Must be called while holding the device lock."""
+        self._send_callback = None
+        while self.running and self._credits > 0 and self._next_pulse < self.stats.requested_pulses:
+            if not self.device_timed:
+                deadline = self._start_time + (self._next_pulse // len(self.channels)) * self.period_s
+                remaining_s = deadline - time.perf_counter()
+                if remaining_s > 0:
+                    self._send_callback = self._timer.after(math.ceil(remaining_s * 1000), self._send_due)
+                    return
+            self._send_pulse()
+
+    def _send_due(self):
+        with self._device_lock:
+            self._send_available()
+
+    def _send_pulse(self):
+        if self.device_timed:
+            now = time.perf_counter()
+            if self._buffer_end is not None and now > self._buffer_end:
+                self.stats.underruns += 1
+            self._buffer_end = max(now, self._buffer_end or now) + self._pulse_s
+        config = self._configs[self._next_pulse % len(self._configs)]
+        config.packet_number = self.sm.smpt_packet_number_generator_next(self.device)
+        self._ack_receiver.expect(self.sm.Smpt_Cmd_Ll_Channel_Config_Ack, config.packet_number,
+                                  timeout_s=self._ack_timeout_s, callback=self._on_ack)
+        self.sm.smpt_send_ll_channel_config(self.device, config)
+        self._credits -= 1
+        self._outstanding += 1
+        self._next_pulse += 1
+        self.stats.sent_pulses += 1
+
+    def _on_ack(self, response: Future):
+        """Called on the ack receiver thread for every pulse. Returns the credit and refills the buffer."""
+        with self._device_lock:
+            if not self.running:
+                return
+            self._credits += 1
+            self._outstanding -= 1
+            try:
+                ack = response.result()
+            except AckTimeoutError:
+                self.stats.lost_acks += 1
+            else:
+                if ack.result == self.sm.Smpt_Result_Successful:
+                    self.stats.acknowledged_pulses += 1
+                    self.stats.ack_times.append(ack.received_time)
+                elif ack.result == self.sm.Smpt_Result_Electrode_Error:
+                    channel = ack.payload.connector * 4 + ack.payload.channel + 1
+                    logging.error(f"There's an error on channel {channel}. Stopping stimulation.")
+                    self.stop()
+                    self._call_in_master(self.on_error, channel)
+                    return
+                else:
+                    self.stats.rejected_pulses += 1
+
+            if self._next_pulse < self.stats.requested_pulses:
+                self._send_available()
+            elif self._outstanding == 0:
+                self.stop()
+                self._call_in_master(self.on_termination)
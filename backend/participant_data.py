@@ -1,53 +1,193 @@
+import functools
 import logging
 import json
+import os
 from datetime import datetime
-from tkinter import messagebox
+from typing import Callable, Optional
+from backend.data_writer import DataWriter
+from backend.journal import Journal
 from backend.settings import Settings
 from backend.stimulation_order import TrialInfo
 
 
 class ParticipantData:
-    def __init__(self, ):
-        """Handles the participant data, such as block and trial information, and inputted sensory data."""
+    # The types of the journal records
+    CALIBRATION = 'calibration'
+    SENSATION = 'sensation'
+    CALIBRATED = 'calibrated'  # The amplitude at the end of the calibration
+    COMPLETED = 'completed'  # All trials have been recorded
+
+    def __init__(self, journal_path: Optional[str] = None, writer: Optional[DataWriter] = None):
+        """Handles the participant data, such as block and trial information, and inputted sensory data.
+        Every update is appended to a journal. The JSON files with the whole data are only written by compact().
+        All files are written in the background by a DataWriter.
+        :param journal_path: The path of the journal, which is started when the first update is saved.
+        Defaults to the one in the participant folder.
+        :param writer: The DataWriter. If not given, the participant data creates (and shuts down) its own."""
         self.calibration_data = []
         self.sensation_data = {}
+        self.calibrated_amplitude_ma: Optional[float] = None  # The amplitude at the end of the calibration
+        self.completed = False  # Whether all trials have been recorded
+        self.journal_path = journal_path
+        self._journal: Optional[Journal] = None  # Only used on the writer thread
+        self._owns_writer = writer is None
+        self.writer = DataWriter() if writer is None else writer
 
-    def update_calibration_data(self, amplitude_ma: float, intensity: str):
-        self.calibration_data.append({'timestamp': datetime.now().isoformat(), 'amplitude_ma': amplitude_ma,
-                                      'intensity': intensity})
-        self.save_calibration_data()
+    @staticmethod
+    def journal_exists(path: str) -> bool:
+        """Whether a journal with data exists at the path, e.g. of a session which was interrupted."""
+        return os.path.isfile(path) and os.path.getsize(path) > 0
+
+    @staticmethod
+    def has_legacy_data(journal_path: str, calibration_path: str, sensation_path: str) -> bool:
+        """Whether the JSON files of a session exist without a journal, i.e. they were written by a version which
+        didn't keep one."""
+        return not os.path.exists(journal_path) and (os.path.isfile(calibration_path) or os.path.isfile(sensation_path))
+
+    @classmethod
+    def session_completed(cls, path: str) -> bool:
+        """Whether the journal marks its session as complete.
+        :raises ValueError: If the journal is invalid."""
+        records, _valid_size = Journal.read(path)
+        return any(record['type'] == cls.COMPLETED for record in records)
+
+    @classmethod
+    def from_journal(cls, path: str, writer: Optional[DataWriter] = None):
+        """Reconstruct the participant data from a journal. Further updates are appended to it.
+        :param path: File path
+        :param writer: See __init__"""
+        participant_data = cls(path, writer)
+        records, _valid_size = Journal.read(path)
+        for record in records:
+            if record['type'] == cls.CALIBRATION:
+                participant_data.calibration_data.append(record['entry'])
+            elif record['type'] == cls.SENSATION:
+                participant_data.sensation_data[record['overall_trial']] = record['entry']
+            elif record['type'] == cls.CALIBRATED:
+                participant_data.calibrated_amplitude_ma = record['amplitude_ma']
+            elif record['type'] == cls.COMPLETED:
+                participant_data.completed = True
+            else:
+                raise ValueError(f"Unknown record type '{record['type']}' in the journal {path}")
+        participant_data._journal = Journal(path)
+        return participant_data
+
+    @classmethod
+    def from_legacy_files(cls, journal_path: str, calibration_path: str, sensation_path: str,
+                          writer: Optional[DataWriter] = None):
+        """Convert the JSON files of a session without a journal (see has_legacy_data). A new journal with their
+        data is written in the background, so the session can be resumed like any other.
+        :param journal_path: The path of the new journal
+        :param calibration_path: The path of the calibration data. It may not exist.
+        :param sensation_path: The path of the sensation data. It may not exist.
+        :param writer: See __init__
+        :raises ValueError: If a file is invalid."""
+        participant_data = cls(journal_path, writer)
+        if os.path.isfile(calibration_path):
+            with open(calibration_path) as file:
+                for entry in json.load(file):
+                    participant_data.calibration_data.append(entry)
+                    participant_data._append_to_journal({'type': cls.CALIBRATION, 'entry': entry})
+        if os.path.isfile(sensation_path):
+            with open(sensation_path) as file:
+                for overall_trial, entry in json.load(file).items():
+                    # JSON keys are strings
+                    participant_data.sensation_data[int(overall_trial)] = entry
+                    participant_data._append_to_journal(
+                        {'type': cls.SENSATION, 'overall_trial': int(overall_trial), 'entry': entry})
+        logging.info(f'Converted the data of {calibration_path} and {sensation_path} to the journal {journal_path}')
+        return participant_data
+
+    def update_calibration_data(self, amplitude_ma: float, intensity: str, ramp_time_s: Optional[float] = None,
+                                timestamp: Optional[str] = None):
+        """Update and save the calibration data.
+        :param amplitude_ma: The stimulation amplitude.
+        :param intensity: The intensity reported by the participant.
+        :param ramp_time_s: In the ramp calibration, the time since the start of the ramp.
+        :param timestamp: When the intensity was reported. Defaults to now."""
+        entry = {'timestamp': timestamp or datetime.now().isoformat(), 'amplitude_ma': amplitude_ma,
+                 'intensity': intensity}
+        if ramp_time_s is not None:
+            entry['ramp_time_s'] = ramp_time_s
+        self.calibration_data.append(entry)
+        self._append_to_journal({'type': self.CALIBRATION, 'entry': entry})
+
+    def update_calibrated_amplitude(self, amplitude_ma: float):
+        """Save the amplitude at the end of the calibration, so it can be reused if the session is resumed."""
+        self.calibrated_amplitude_ma = amplitude_ma
+        self._append_to_journal({'type': self.CALIBRATED, 'amplitude_ma': amplitude_ma})
 
-    def update_sensation_data(self, trial_info: TrialInfo, sensations: list[dict]):
+    def update_sensation_data(self, trial_info: TrialInfo, sensations: list[dict],
+                              stimulation_duration_s: Optional[float] = None):
         """Update and save the sensation data for a trial.
         :param trial_info: The information for this trial.
-        :param sensations: A list of the different sensations for this trial"""
-        self.sensation_data[trial_info.overall_trial] = {'timestamp': datetime.now().isoformat(),
-                                                         'sensations': sensations,
-                                                         # Use the correct attributes in trial_info
-                                                         **{key: getattr(trial_info, key) for key in
-                                                            ['block', 'trial', 'channels', 'electrodes']}}
+        :param sensations: A list of the different sensations for this trial
+        :param stimulation_duration_s: The achieved stimulation duration of this trial"""
+        entry = {'timestamp': datetime.now().isoformat(),
+                 'sensations': sensations,
+                 'stimulation_duration_s': stimulation_duration_s,
+                 # Use the correct attributes in trial_info
+                 **{key: getattr(trial_info, key) for key in ['block', 'trial', 'channels', 'electrodes']}}
+        self.sensation_data[trial_info.overall_trial] = entry
+        self._append_to_journal({'type': self.SENSATION, 'overall_trial': trial_info.overall_trial, 'entry': entry})
+
+    def mark_completed(self):
+        """Save that all trials have been recorded, so the session isn't offered to be resumed."""
+        self.completed = True
+        self._append_to_journal({'type': self.COMPLETED})
+
+    def _append_to_journal(self, record: dict):
+        """Append a record to the journal in the background."""
+        if self.journal_path is None:
+            self.journal_path = Settings().get_journal_path()
+        self.writer.submit(functools.partial(self._write_record, self.journal_path, record))
+
+    def _write_record(self, path: str, record: dict):
+        if self._journal is None:
+            self._journal = Journal(path, new=True)
+        self._journal.append(record)
+
+    def compact(self):
+        """Save the whole calibration and sensation data as JSON files in the background, e.g. at the end of a block.
+        If the previous compaction hasn't been written yet, only the latest one is."""
+        self.save_calibration_data()
         self.save_sensation_data()
 
+    def when_written(self, callback: Callable[[], None]):
+        """Call the callback on the writer thread once all data saved so far has been written. Doesn't block."""
+        self.writer.when_written(callback)
+
+    def close(self, on_closed: Optional[Callable[[], None]] = None):
+        """Compact the data and close the journal in the background. Doesn't block.
+        :param on_closed: Called on the writer thread once everything has been written."""
+        self.compact()
+        self.writer.submit(self._close_journal)
+        if on_closed is not None:
+            self.writer.when_written(on_closed)
+        if self._owns_writer:
+            self.writer.when_written(self.writer.stop)
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
     def save_calibration_data(self):
-        self._save_data(Settings().get_calibration_data_path(), self.calibration_data)
+        self._save_data(Settings().get_calibration_data_path(), list(self.calibration_data))
 
     def save_sensation_data(self):
-        self._save_data(Settings().get_sensation_data_path(), self.sensation_data)
+        self._save_data(Settings().get_sensation_data_path(), dict(self.sensation_data))
 
-    @staticmethod
-    def _save_data(path: str, data):
-        """Save the data to the given path and retry until it has been successfully saved"""
-        while True:
-            try:
-                with open(path, 'w') as file:
-                    json.dump(data, file, indent=4)
-                logging.info(f'Successfully saved data to {path}')
-                break
-            except Exception as e:
-                logging.error(f"Error saving dictionary to {path}: {str(e)}")
-                messagebox.showerror(
-                    'Error storing data',
-                    'There was an error saving the participant data. '
-                    'Please fix the issue (e.g., close the file or resolve permissions) and try again.'
-                )
+    def _save_data(self, path: str, data):
+        """Save the data to the given path in the background. The entries aren't changed once they're added,
+        so a shallow copy of the data is a consistent snapshot."""
+        self.writer.submit(functools.partial(self._write_json, path, data), key=path)
 
+    @staticmethod
+    def _write_json(path: str, data):
+        """Write the data to a temporary file and replace the file with it, so the file is always complete."""
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(data, file, indent=4)
+        os.replace(temporary_path, path)
+        logging.info(f'Successfully saved data to {path}')
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+
+@dataclass(slots=True)
+class SensationEntry:
+    """The inputs of one sensation. Unset inputs are -1 (type), 0 (intensity), and an empty bitmask (locations)."""
+    type_index: int = -1  # The index in SensationForm.SENSATION_TYPES
+    intensity: int = 0
+    locations: int = 0  # Bit i is set if SensationForm.LOCATIONS[i] is selected
+
+    @property
+    def complete(self) -> bool:
+        return self.type_index >= 0 and self.intensity > 0 and self.locations != 0
+
+
+class SensationForm:
+    SENSATION_TYPES = ('Touch', 'Pulse', 'Tingling', 'Vibration', 'Cramp', 'Pain', 'Heat', 'Cold', 'Other')
+    INTENSITY_OPTIONS = tuple(range(1, 11))
+    LOCATIONS = ('D1', 'D2', 'D3', 'D4', 'S1', 'S2', 'S3', 'S4', 'S5', 'Calf', 'Shin')
+
+    _TYPE_INDICES = {sensation_type: index for index, sensation_type in enumerate(SENSATION_TYPES)}
+    _LOCATION_BITS = {location: 1 << index for index, location in enumerate(LOCATIONS)}
+
+    def __init__(self, on_complete_change: Optional[Callable[[bool], None]] = None):
+        """The sensations a participant enters after a trial, without any widgets. It counts the incomplete entries
+        while they're changed, so whether the form is complete is known without checking every input.
+        :param on_complete_change: Called with the new value of ``complete`` when it changes."""
+        self.on_complete_change = on_complete_change
+        self.entries: list[SensationEntry] = []
+        self.n_incomplete = 0
+
+    @property
+    def complete(self) -> bool:
+        """Whether all inputs of all sensations have been entered. An empty form is complete."""
+        return self.n_incomplete == 0
+
+    def add(self) -> SensationEntry:
+        """Add an empty sensation.
+        :return: Its entry, which identifies it in the other methods."""
+        entry = SensationEntry()
+        self.entries.append(entry)
+        self._count(True, False)
+        return entry
+
+    def remove(self, entry: SensationEntry):
+        self.entries.remove(entry)
+        # A removed entry no longer counts as incomplete
+        self._count(entry.complete, True)
+
+    def set_type(self, entry: SensationEntry, sensation_type: str):
+        """:param sensation_type: One of SENSATION_TYPES, or an empty string to unset it."""
+        was_complete = entry.complete
+        entry.type_index = self._TYPE_INDICES.get(sensation_type, -1)
+        self._count(was_complete, entry.complete)
+
+    def set_intensity(self, entry: SensationEntry, intensity: int):
+        """:param intensity: One of INTENSITY_OPTIONS, or 0 to unset it."""
+        was_complete = entry.complete
+        entry.intensity = intensity if intensity in self.INTENSITY_OPTIONS else 0
+        self._count(was_complete, entry.complete)
+
+    def set_location(self, entry: SensationEntry, location: str, selected: bool):
+        """:param location: One of LOCATIONS."""
+        was_complete = entry.complete
+        if selected:
+            entry.locations |= self._LOCATION_BITS[location]
+        else:
+            entry.locations &= ~self._LOCATION_BITS[location]
+        self._count(was_complete, entry.complete)
+
+    def _count(self, was_complete: bool, is_complete: bool):
+        """Update the number of incomplete entries after an entry changed, and report if the form's completeness
+        changed."""
+        form_was_complete = self.complete
+        self.n_incomplete += int(was_complete) - int(is_complete)
+        if self.complete != form_was_complete and self.on_complete_change is not None:
+            self.on_complete_change(self.complete)
+
+    def entry_data(self, entry: SensationEntry) -> dict[str, Any]:
+        """The data of a sensation, as it's saved.
+        :returns: A dict with the entries 'type', 'intensity', and 'locations'."""
+        return {'type': self.SENSATION_TYPES[entry.type_index] if entry.type_index >= 0 else '',
+                'intensity': entry.intensity,
+                'locations': [location for location, bit in self._LOCATION_BITS.items() if entry.locations & bit]}
+
+    def data(self) -> list[dict[str, Any]]:
+        """The data of all sensations, in the order they were added."""
+        return [self.entry_data(entry) for entry in self.entries]
@@ -27,6 +27,13 @@ class Settings:
 
     BREAK_AFTER_BLOCK_DURATION_SEC = 60 * 5
 
+    # 'staircase': stimulate, query the intensity, and adjust the amplitude until it's very strong.
+    # 'psi': like 'staircase', but the amplitudes are chosen adaptively by Bayesian threshold estimation.
+    # 'ramp': raise the amplitude continuously while the participant presses a key at detection and discomfort.
+    CALIBRATION_MODE = 'staircase'
+    # How fast the amplitude rises in the ramp calibration
+    CALIBRATION_RAMP_RATE_MA_PER_S = 1.0
+
     PARAMETER_OPTIONS = OrderedDict(
         {
             'channel': {'label': 'Channel (testing and calibration)', 'unit': '',
@@ -96,3 +103,11 @@ class Settings:
     def get_calibration_data_path(self) -> str:
         """The path for the file storing what happened during calibration"""
         return os.path.join(self.participant_folder_var.get(), 'calibration_data.json')
+
+    def get_journal_path(self) -> str:
+        """The path for the journal to which every calibration step and trial is appended"""
+        return os.path.join(self.participant_folder_var.get(), 'participant_data.jsonl')
+
+    def get_stimulator_timing_path(self) -> str:
+        """The path for the file storing the timing measurements of the stimulator during the session"""
+        return os.path.join(self.participant_folder_var.get(), 'stimulator_timing.json')
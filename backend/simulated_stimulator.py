@@ -0,0 +1,542 @@
+# An in-process simulation of the Hasomed P24 Science Stimulator.
+# It mimics the parts of the ScienceMode python wrapper (``sciencemode.sciencemode``) that the Stimulator uses, so it
+# can be passed as the backend of a Stimulator to exercise and benchmark the stimulation paths without a device:
+#     stimulator = Stimulator(master, backend=SimulatedP24(SimulationConfig(ack_latency_s=0.005)))
+import heapq
+from collections import deque
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+N_CHANNELS = 8  # The P24 has 8 channels
+N_POINTS = 16  # The maximum number of points of a pulse
+
+
+@dataclass
+class SimulationConfig:
+    """The behaviour of the simulated device.
+
+    Attributes:
+        ack_latency_s: The mean time between sending a command and the acknowledgement being available.
+        ack_jitter_s: Each ack latency is drawn uniformly from ``ack_latency_s ± ack_jitter_s``.
+        drop_probability: The probability that the acknowledgement of a command is lost.
+        keepalive_timeout_s: The device stops stimulating and de-initializes ML if it doesn't receive a command within
+        this time.
+        port_available: What ``smpt_check_serial_port`` returns.
+        seed: The seed for the random number generator (latency jitter and dropped packets).
+        clock: The clock of the device in seconds. Can be replaced with a virtual clock for deterministic tests.
+        send_duration_s: How long sending a command blocks, like writing to the serial port does. Only use it with
+        the real clock.
+    """
+    ack_latency_s: float = 0.002
+    ack_jitter_s: float = 0.0
+    drop_probability: float = 0.0
+    keepalive_timeout_s: float = 2.0
+    port_available: bool = True
+    seed: Optional[int] = None
+    clock: Callable[[], float] = time.perf_counter
+    send_duration_s: float = 0.0
+
+
+# --- Stand-ins for the cffi structures ---
+class _Point:
+    __slots__ = ('current', 'time', 'interpolation_mode')
+
+    def __init__(self):
+        self.current, self.time, self.interpolation_mode = 0.0, 0, 0
+
+
+class _MlChannelConfig:
+    __slots__ = ('period', 'number_of_points', 'ramp', 'points')
+
+    def __init__(self):
+        self.period, self.number_of_points, self.ramp = 0.0, 0, 0
+        self.points = [_Point() for _ in range(N_POINTS)]
+
+    def copy(self) -> '_MlChannelConfig':
+        new = _MlChannelConfig()
+        new.period, new.number_of_points, new.ramp = self.period, self.number_of_points, self.ramp
+        for source, target in zip(self.points, new.points):
+            target.current, target.time, target.interpolation_mode = (source.current, source.time,
+                                                                      source.interpolation_mode)
+        return new
+
+    def __getitem__(self, index: int) -> '_MlChannelConfig':
+        # Dereferencing the pointer: ``config[0]``
+        if index != 0:
+            raise IndexError(index)
+        return self
+
+
+class _StructArray(list):
+    """An array of structures. Like in cffi, assigning a structure to an item copies it."""
+
+    def __setitem__(self, index: int, value):
+        super().__setitem__(index, value.copy())
+
+
+class _MlUpdate:
+    def __init__(self):
+        self.packet_number = 0
+        self.enable_channel = [False] * N_CHANNELS
+        self.channel_config = _StructArray(_MlChannelConfig() for _ in range(N_CHANNELS))
+
+
+class _MlInit:
+    def __init__(self):
+        self.packet_number = 0
+        self.stop_all_channels_on_error = False
+
+
+class _MlGetCurrentData:
+    def __init__(self):
+        self.packet_number = 0
+        self.data_selection = 0
+
+
+class _MlChannelData:
+    def __init__(self):
+        self.channel_state = [0] * N_CHANNELS
+        self.channel_current = [0.0] * N_CHANNELS
+
+
+class _MlGetCurrentDataAck:
+    def __init__(self):
+        self.packet_number = 0
+        self.result = 0
+        self.data_selection = 0
+        self.channel_data = _MlChannelData()
+
+
+class _LlInit:
+    def __init__(self):
+        self.packet_number = 0
+        self.high_voltage_level = 0
+
+
+class _LlChannelConfig:
+    def __init__(self):
+        self.packet_number = 0
+        self.enable_stimulation = False
+        self.channel = 0
+        self.connector = 0
+        self.number_of_points = 0
+        self.points = [_Point() for _ in range(N_POINTS)]
+
+
+class _LlChannelConfigAck:
+    def __init__(self):
+        self.packet_number = 0
+        self.result = 0
+        self.electrode_error = False
+        self.channel = 0
+        self.connector = 0
+
+
+class _Ack:
+    def __init__(self):
+        self.packet_number = 0
+        self.command_number = 0
+        self.result = 0
+
+
+class _Version:
+    def __init__(self, major=0, minor=0, revision=0):
+        self.major, self.minor, self.revision = major, minor, revision
+
+
+class _UcVersion:
+    def __init__(self):
+        self.fw_version = _Version(4, 0, 0)
+        self.smpt_version = _Version(4, 0, 0)
+
+
+class _ExtendedVersionAck:
+    def __init__(self):
+        self.packet_number = 0
+        self.result = 0
+        self.fw_hash = 0
+        self.uc_version = _UcVersion()
+
+
+@dataclass(order=True)
+class _PendingAck:
+    due_time: float
+    sequence: int
+    command_number: int = field(compare=False)
+    packet_number: int = field(compare=False)
+    result: int = field(compare=False, default=0)
+    payload: Any = field(compare=False, default=None)
+
+
+class SimulatedDevice:
+    """The state of one simulated P24. Created by ``ffi.new("Smpt_device*")`` of a SimulatedP24."""
+
+    def __init__(self, simulator: 'SimulatedP24'):
+        self._sim = simulator
+        self._lock = threading.RLock()
+        self.port: Optional[str] = None
+        self._packet_number = -1
+        self._pending_acks = []  # heap of _PendingAck
+        self._sequence = 0
+        self._last_ack: Optional[_PendingAck] = None
+        self._packet_listener: Optional[Callable[[float], None]] = None  # See SimulatedP24.notify_packets
+
+        # ML stimulation state
+        self.ml_initialized = False
+        self.stimulating = False
+        self.enabled_channels = [False] * N_CHANNELS
+        self.channel_configs = [_MlChannelConfig() for _ in range(N_CHANNELS)]
+        self.last_command_time: Optional[float] = None
+        self._injected_errors = {}  # channel index -> (time from which the error is reported, state)
+        self._stimulation_start: Optional[float] = None
+
+        # LL stimulation state
+        self.ll_initialized = False
+        self._ll_busy_until: Optional[float] = None  # When the last buffered pulse is done
+        self._ll_pulse_ends = deque()  # The end times of the buffered pulses
+
+        # Records for benchmarks and tests
+        self.sent_commands = []  # (time, command number, packet number)
+        self.stimulation_intervals = []  # (start time, end time) of each stimulation
+        self.keepalive_timeouts = 0
+        self.dropped_acks = 0
+        self.ll_pulses = []  # (start time, channel) of each low-level pulse
+        self.ll_underruns = 0  # How often the low-level buffer ran empty during streaming
+        self.ll_overflows = 0  # How many low-level pulses were rejected because the buffer was full
+
+    # --- Fault injection ---
+    def inject_channel_error(self, channel: int, after_s: float = 0.0, state: Optional[int] = None):
+        """Report an error on a channel in every ml_get_current_data acknowledgement from now on.
+        :param channel: The channel number as depicted on the stimulator (1-8)
+        :param after_s: The error is only reported after this many seconds.
+        :param state: The reported channel state. Defaults to an electrode error."""
+        if state is None:
+            state = SimulatedP24.Smpt_Ml_Channel_State_Electrode_Error
+        with self._lock:
+            self._injected_errors[channel - 1] = (self._sim.clock() + after_s, state)
+
+    def clear_channel_errors(self):
+        with self._lock:
+            self._injected_errors.clear()
+
+    # --- Internals ---
+    def _next_packet_number(self) -> int:
+        # The packet number is 6 bits wide on the device
+        self._packet_number = (self._packet_number + 1) % 64
+        return self._packet_number
+
+    def _check_keepalive(self, now: float):
+        """Stop the stimulation and de-initialize ML like the device does if it hasn't received a command in time."""
+        if self.last_command_time is None or now - self.last_command_time <= self._sim.config.keepalive_timeout_s:
+            return
+        if self.ml_initialized:
+            logging.info(f'Simulated P24: no command within {self._sim.config.keepalive_timeout_s} s. '
+                         f'ML de-initialized by the device.')
+            self.ml_initialized = False
+        if self.stimulating:
+            self.keepalive_timeouts += 1
+            logging.warning(f'Simulated P24: no command within {self._sim.config.keepalive_timeout_s} s. '
+                            f'Stimulation stopped by the device.')
+            self._end_stimulation(self.last_command_time + self._sim.config.keepalive_timeout_s)
+            for channel, enabled in enumerate(self.enabled_channels):
+                if enabled:
+                    self._injected_errors.setdefault(
+                        channel, (now, SimulatedP24.Smpt_Ml_Channel_State_Timeout_Error))
+
+    def _end_stimulation(self, end_time: float):
+        if self.stimulating:
+            self.stimulation_intervals.append((self._stimulation_start, end_time))
+        self.stimulating = False
+
+    def _receive_command(self, command_number: int, packet_number: int, payload: Any = None,
+                         result: int = 0, processed_time: Optional[float] = None) -> float:
+        """Register a received command and queue its acknowledgement.
+        :param processed_time: When the device has processed the command and sends the acknowledgement.
+        Defaults to the time of reception.
+        :return: The time at which the command was received."""
+        if self._sim.config.send_duration_s > 0:
+            time.sleep(self._sim.config.send_duration_s)
+        now = self._sim.clock()
+        self._check_keepalive(now)
+        self.sent_commands.append((now, command_number, packet_number))
+        self.last_command_time = now
+
+        if self._sim.rng.random() < self._sim.config.drop_probability:
+            self.dropped_acks += 1
+        else:
+            config = self._sim.config
+            latency = config.ack_latency_s + self._sim.rng.uniform(-config.ack_jitter_s, config.ack_jitter_s)
+            self._sequence += 1
+            ack_time = (now if processed_time is None else processed_time) + max(latency, 0.0)
+            heapq.heappush(self._pending_acks, _PendingAck(ack_time, self._sequence, command_number + 1,
+                                                           packet_number, result, payload))
+            if self._packet_listener is not None:
+                self._packet_listener(ack_time)
+        return now
+
+    def _receive_ll_channel_config(self, ll_config: '_LlChannelConfig') -> None:
+        """The device executes the buffered low-level pulses back to back and acknowledges each one when it's done."""
+        now = self._sim.clock()
+        while self._ll_pulse_ends and self._ll_pulse_ends[0] <= now:
+            self._ll_pulse_ends.popleft()
+        channel = ll_config.connector * 4 + ll_config.channel
+
+        if not self.ll_initialized:
+            result, processed_time = SimulatedP24.Smpt_Result_Not_Initialized_Error, None
+        elif len(self._ll_pulse_ends) >= SimulatedP24.LL_BUFFER_SIZE:
+            self.ll_overflows += 1
+            result, processed_time = SimulatedP24.Smpt_Result_Busy, None
+        else:
+            if self._ll_busy_until is not None and now > self._ll_busy_until:
+                self.ll_underruns += 1  # The buffer ran empty
+            start = now if self._ll_busy_until is None else max(now, self._ll_busy_until)
+            duration_s = sum(point.time for point in ll_config.points[:ll_config.number_of_points]) / 1e6
+            self._ll_busy_until = start + duration_s
+            self._ll_pulse_ends.append(self._ll_busy_until)
+            self.ll_pulses.append((start, channel + 1))
+            error = self._channel_states(start)[channel] != SimulatedP24.Smpt_Ml_Channel_State_Ok
+            result = SimulatedP24.Smpt_Result_Electrode_Error if error else SimulatedP24.Smpt_Result_Successful
+            processed_time = self._ll_busy_until
+        self._receive_command(SimulatedP24.Smpt_Cmd_Ll_Channel_Config, ll_config.packet_number,
+                              payload=(channel, result), result=result, processed_time=processed_time)
+
+    def _channel_states(self, now: float) -> list[int]:
+        states = [SimulatedP24.Smpt_Ml_Channel_State_Ok] * N_CHANNELS
+        for channel, (from_time, state) in self._injected_errors.items():
+            if now >= from_time:
+                states[channel] = state
+        return states
+
+
+class _SimulatedFFI:
+    """Allocates stand-ins for the cffi structures used by the Stimulator."""
+
+    def __init__(self, simulator: 'SimulatedP24'):
+        self._sim = simulator
+        self._factories = {
+            'Smpt_device*': lambda: SimulatedDevice(self._sim),
+            'Smpt_ack*': _Ack,
+            'Smpt_get_extended_version_ack*': _ExtendedVersionAck,
+            'Smpt_ml_init*': _MlInit,
+            'Smpt_ml_update*': _MlUpdate,
+            'Smpt_ml_channel_config*': _MlChannelConfig,
+            'Smpt_ml_get_current_data*': _MlGetCurrentData,
+            'Smpt_ml_get_current_data_ack*': _MlGetCurrentDataAck,
+            'Smpt_ll_init*': _LlInit,
+            'Smpt_ll_channel_config*': _LlChannelConfig,
+            'Smpt_ll_channel_config_ack*': _LlChannelConfigAck,
+        }
+
+    def new(self, c_type: str, init=None):
+        if c_type == 'char[]':
+            return bytes(init)
+        try:
+            return self._factories[c_type]()
+        except KeyError:
+            raise NotImplementedError(f'The simulated P24 does not support the type {c_type}')
+
+
+class SimulatedP24:
+    """A drop-in replacement for the ``sciencemode.sciencemode`` module that simulates a P24 in-process.
+
+    The command numbers only need to be consistent within the simulation. As on the device, an acknowledgement has the
+    command number of its command + 1."""
+    # Command numbers
+    Smpt_Cmd_Get_Extended_Version = 50
+    Smpt_Cmd_Get_Extended_Version_Ack = 51
+    Smpt_Cmd_Ml_Init = 30
+    Smpt_Cmd_Ml_Init_Ack = 31
+    Smpt_Cmd_Ml_Update = 32
+    Smpt_Cmd_Ml_Update_Ack = 33
+    Smpt_Cmd_Ml_Stop = 34
+    Smpt_Cmd_Ml_Stop_Ack = 35
+    Smpt_Cmd_Ml_Get_Current_Data = 36
+    Smpt_Cmd_Ml_Get_Current_Data_Ack = 37
+    Smpt_Cmd_Ll_Init = 0
+    Smpt_Cmd_Ll_Init_Ack = 1
+    Smpt_Cmd_Ll_Channel_Config = 2
+    Smpt_Cmd_Ll_Channel_Config_Ack = 3
+    Smpt_Cmd_Ll_Stop = 4
+    Smpt_Cmd_Ll_Stop_Ack = 5
+
+    Smpt_Ml_Data_Channels = 1
+    Smpt_High_Voltage_Default = 0
+
+    # The device buffers up to this many low-level pulses
+    LL_BUFFER_SIZE = 10
+
+    # Results and channel states
+    Smpt_Result_Successful = 0
+    Smpt_Result_Not_Initialized_Error = 7
+    Smpt_Result_Electrode_Error = 10
+    Smpt_Result_Busy = 21
+    Smpt_Ml_Channel_State_Ok = 0
+    Smpt_Ml_Channel_State_Electrode_Error = 1
+    Smpt_Ml_Channel_State_Timeout_Error = 2
+    Smpt_Ml_Channel_State_Low_Voltage_Error = 3
+
+    def __init__(self, config: SimulationConfig = None):
+        self.config = config if config is not None else SimulationConfig()
+        self.clock = self.config.clock
+        self.rng = random.Random(self.config.seed)
+        self.ffi = _SimulatedFFI(self)
+
+    # --- Serial port ---
+    def smpt_check_serial_port(self, com: bytes) -> bool:
+        return self.config.port_available
+
+    @staticmethod
+    def smpt_open_serial_port(device: SimulatedDevice, com: bytes) -> bool:
+        with device._lock:
+            device.port = com.decode('ascii')
+        return True
+
+    @staticmethod
+    def smpt_close_serial_port(device: SimulatedDevice) -> bool:
+        with device._lock:
+            device._end_stimulation(device._sim.clock())
+            device.port = None
+        return True
+
+    @staticmethod
+    def smpt_packet_number_generator_next(device: SimulatedDevice) -> int:
+        with device._lock:
+            return device._next_packet_number()
+
+    # --- Acknowledgements ---
+    @staticmethod
+    def notify_packets(device: SimulatedDevice, listener: Optional[Callable[[float], None]]):
+        """Call ``listener`` with the time from which each acknowledgement can be read, so the device doesn't have to
+        be polled. This isn't part of the ScienceMode library, which can only be polled. The time is of the clock of
+        the simulation, so the listener must use the same clock.
+        :param listener: The function to call, or None to stop calling it."""
+        with device._lock:
+            device._packet_listener = listener
+
+    def smpt_new_packet_received(self, device: SimulatedDevice) -> bool:
+        with device._lock:
+            now = self.clock()
+            device._check_keepalive(now)
+            return len(device._pending_acks) > 0 and device._pending_acks[0].due_time <= now
+
+    def smpt_last_ack(self, device: SimulatedDevice, ack: _Ack) -> bool:
+        """Pops the next due acknowledgement. Its payload can then be read with the smpt_get_*_ack functions."""
+        with device._lock:
+            if not self.smpt_new_packet_received(device):
+                return False
+            device._last_ack = heapq.heappop(device._pending_acks)
+            ack.command_number = device._last_ack.command_number
+            ack.packet_number = device._last_ack.packet_number
+            ack.result = device._last_ack.result
+        return True
+
+    @staticmethod
+    def smpt_clear_ack(ack: _Ack):
+        ack.packet_number, ack.command_number, ack.result = 0, 0, 0
+
+    @staticmethod
+    def _last_ack_of(device: SimulatedDevice, command_number: int) -> Optional[_PendingAck]:
+        last_ack = device._last_ack
+        if last_ack is None or last_ack.command_number != command_number:
+            return None
+        return last_ack
+
+    def smpt_get_get_extended_version_ack(self, device: SimulatedDevice, version_ack: _ExtendedVersionAck) -> bool:
+        last_ack = self._last_ack_of(device, self.Smpt_Cmd_Get_Extended_Version_Ack)
+        if last_ack is None:
+            return False
+        version_ack.packet_number, version_ack.result = last_ack.packet_number, last_ack.result
+        return True
+
+    def smpt_get_ml_get_current_data_ack(self, device: SimulatedDevice, data_ack: _MlGetCurrentDataAck) -> bool:
+        last_ack = self._last_ack_of(device, self.Smpt_Cmd_Ml_Get_Current_Data_Ack)
+        if last_ack is None:
+            return False
+        data_ack.packet_number, data_ack.result = last_ack.packet_number, last_ack.result
+        data_ack.channel_data.channel_state[:] = last_ack.payload
+        return True
+
+    # --- Commands ---
+    def smpt_send_get_extended_version(self, device: SimulatedDevice, packet_number: int) -> bool:
+        with device._lock:
+            device._receive_command(self.Smpt_Cmd_Get_Extended_Version, packet_number)
+        return True
+
+    def smpt_send_ml_init(self, device: SimulatedDevice, ml_init: _MlInit) -> bool:
+        with device._lock:
+            device._receive_command(self.Smpt_Cmd_Ml_Init, ml_init.packet_number)
+            device.ml_initialized = True
+            # A timeout of the previous stimulation is not reported anymore
+            device._injected_errors = {channel: error for channel, error in device._injected_errors.items()
+                                       if error[1] != self.Smpt_Ml_Channel_State_Timeout_Error}
+        return True
+
+    def smpt_send_ml_update(self, device: SimulatedDevice, ml_update: _MlUpdate) -> bool:
+        with device._lock:
+            device._check_keepalive(self.clock())
+            if not device.ml_initialized:
+                # The device rejects the update in its acknowledgement
+                device._receive_command(self.Smpt_Cmd_Ml_Update, ml_update.packet_number,
+                                        result=self.Smpt_Result_Not_Initialized_Error)
+                return True
+            now = device._receive_command(self.Smpt_Cmd_Ml_Update, ml_update.packet_number)
+            device.enabled_channels = [bool(enabled) for enabled in ml_update.enable_channel]
+            device.channel_configs = [config.copy() for config in ml_update.channel_config]
+            if any(device.enabled_channels) and not device.stimulating:
+                device.stimulating = True
+                device._stimulation_start = now
+            elif not any(device.enabled_channels):
+                device._end_stimulation(now)
+        return True
+
+    def smpt_send_ml_get_current_data(self, device: SimulatedDevice, ml_get_current_data: _MlGetCurrentData) -> bool:
+        with device._lock:
+            now = self.clock()
+            # The channel states are taken when the command arrives, which is before the keepalive is registered
+            device._check_keepalive(now)
+            device._receive_command(self.Smpt_Cmd_Ml_Get_Current_Data, ml_get_current_data.packet_number,
+                                    payload=device._channel_states(now))
+        return True
+
+    def smpt_send_ml_stop(self, device: SimulatedDevice, packet_number: int) -> bool:
+        with device._lock:
+            now = device._receive_command(self.Smpt_Cmd_Ml_Stop, packet_number)
+            device._end_stimulation(now)
+            device.ml_initialized = False
+        return True
+
+    def smpt_send_ll_init(self, device: SimulatedDevice, ll_init: _LlInit) -> bool:
+        with device._lock:
+            device._receive_command(self.Smpt_Cmd_Ll_Init, ll_init.packet_number)
+            device.ll_initialized = True
+            device._ll_busy_until = None
+            device._ll_pulse_ends.clear()
+        return True
+
+    @staticmethod
+    def smpt_send_ll_channel_config(device: SimulatedDevice, ll_config: _LlChannelConfig) -> bool:
+        with device._lock:
+            device._receive_ll_channel_config(ll_config)
+        return True
+
+    def smpt_get_ll_channel_config_ack(self, device: SimulatedDevice, config_ack: _LlChannelConfigAck) -> bool:
+        last_ack = self._last_ack_of(device, self.Smpt_Cmd_Ll_Channel_Config_Ack)
+        if last_ack is None:
+            return False
+        channel, result = last_ack.payload
+        config_ack.packet_number, config_ack.result = last_ack.packet_number, result
+        config_ack.connector, config_ack.channel = divmod(channel, 4)
+        config_ack.electrode_error = result == self.Smpt_Result_Electrode_Error
+        return True
+
+    def smpt_send_ll_stop(self, device: SimulatedDevice, packet_number: int) -> bool:
+        with device._lock:
+            device._receive_command(self.Smpt_Cmd_Ll_Stop, packet_number)
+            device.ll_initialized = False
+            device._ll_busy_until = None
+            device._ll_pulse_ends.clear()
+        return True
@@ -1,14 +1,15 @@
 import ast
 import logging
-import random
-from itertools import cycle
+import os
 from dataclasses import dataclass
+from typing import Container, Optional
 import pandas as pd
 import numpy as np
+import xlsxwriter
 from backend.channel_electrode_maps import CHANNEL_ELECTRODE_MAPS
 
 
-@dataclass
+@dataclass(slots=True)
 class TrialInfo:
     """Contains overall_trial, block, trial, channels, and electrodes."""
     overall_trial: int
@@ -22,15 +23,79 @@ class TrialInfo:
 class StimulationOrder:
     def __init__(self, stim_order: pd.DataFrame):
         """This class takes care of creating and storing the order of stimulation regarding blocks, trials, channels,
-        and electrode pairs."""
+        and electrode pairs. The columns are converted to arrays once, so navigating through the trials doesn't need
+        pandas and takes constant time."""
         # The nested list with the order. The levels are blocks > trials > channels.
+        # It's only used for exporting.
         self.stim_order: pd.DataFrame = stim_order
 
-        # The index for the overall trial (compared to the trial within a block)
-        self.overall_trial: int = 1
+        # The columns. Positions are 0-indexed rows of the order.
+        self._overall_trials = stim_order.index.to_numpy(dtype=np.int64)
+        self._blocks = stim_order['block'].to_numpy(dtype=np.int64)
+        self._trials = stim_order['trial'].to_numpy(dtype=np.int64)
+        self._channels: list[list[int]] = stim_order['channels'].tolist()
+        self._map_ids: list[str] = stim_order['channel_electrode_map_id'].tolist()
+        self._electrodes: list[list[tuple[int]]] = stim_order['electrodes'].tolist()
+        # Bit c - 1 is set if channel c is stimulated in the trial
+        self.channel_masks = np.array([sum(1 << (channel - 1) for channel in channels) for channels in self._channels],
+                                      dtype=np.uint8)
+        self._positions = {int(overall_trial): position for position, overall_trial in enumerate(self._overall_trials)}
+
+        # The number of trials in the block of each trial (the highest trial number in the block)
+        block_ids, block_indices = np.unique(self._blocks, return_inverse=True)
+        self._n_blocks = int(block_ids.size)
+        max_trials = np.zeros(block_ids.size, dtype=np.int64)
+        np.maximum.at(max_trials, block_indices, self._trials)
+        self._trials_in_block = max_trials[block_indices]
+
+        # The TrialInfos are built when a trial is first visited and then reused
+        self._trial_infos: list[Optional[TrialInfo]] = [None] * len(self._overall_trials)
+
+        # The position of the current trial
+        self._position = 0
+
+    @property
+    def overall_trial(self) -> int:
+        """The index for the overall trial (compared to the trial within a block)"""
+        return int(self._overall_trials[self._position])
+
+    @overall_trial.setter
+    def overall_trial(self, overall_trial: int):
+        self._position = self._positions[overall_trial]
+
+    def __len__(self) -> int:
+        return len(self._overall_trials)
+
+    @classmethod
+    def from_file(cls, path: str, use_cache: bool = True):
+        """Create a StimulationOrder instance from an Excel (xlsx) or NumPy (npz) file.
+        The Excel file stays the source of truth, but its parsed order is cached next to it (see CACHE_SUFFIX). If the
+        Excel file hasn't changed since, the cache is read instead, which is much faster.
+        :param path: File path
+        :param use_cache: Whether to read and write the cache of an Excel file."""
+        if path.endswith('.npz'):
+            return cls.from_npz(path)
+
+        cache_path = path + cls.CACHE_SUFFIX
+        source_key = cls._source_key(path)
+        if use_cache:
+            try:
+                return cls.from_npz(cache_path, source_key)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError) as e:
+                logging.info(f'Not using the cached stimulation order {cache_path}: {e}')
+
+        stim_order = cls.from_excel(path)
+        if use_cache:
+            try:
+                stim_order.save_as_npz(cache_path, source_key)
+            except (OSError, ValueError) as e:
+                logging.warning(f'Could not cache the stimulation order at {cache_path}: {e}')
+        return stim_order
 
     @classmethod
-    def from_file(cls, path: str):
+    def from_excel(cls, path: str):
         """Create a StimulationOrder instance from an Excel (xlsx) file.
         :param path: File path"""
         # read the stimulation order
@@ -42,60 +107,142 @@ class StimulationOrder:
 
         return cls(order)
 
+    # The parsed order of an Excel file is cached at its path with this suffix
+    CACHE_SUFFIX = '.cache.npz'
+    # Incremented when the layout of the npz files changes, so old caches aren't used
+    NPZ_VERSION = 1
+
+    @staticmethod
+    def _source_key(path: str) -> np.ndarray:
+        """Identifies the version of a file by its modification time and size."""
+        stat = os.stat(path)
+        return np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+    @classmethod
+    def from_npz(cls, path: str, source_key: Optional[np.ndarray] = None):
+        """Create a StimulationOrder instance from a NumPy (npz) file written by save_as_npz().
+        :param path: File path
+        :param source_key: If given, the file must have been saved with this source key.
+        :raises ValueError: If the file has another version or source key."""
+        with np.load(path, allow_pickle=False) as npz:
+            if int(npz['version']) != cls.NPZ_VERSION:
+                raise ValueError(f"version {int(npz['version'])} instead of {cls.NPZ_VERSION}")
+            if source_key is not None and not np.array_equal(npz['source_key'], source_key):
+                raise ValueError('the source file has changed')
+            channels = np.split(npz['channels'], npz['channel_offsets'][1:-1])
+            electrodes = np.split(npz['electrodes'], npz['electrode_offsets'][1:-1])
+            order = pd.DataFrame({'block': npz['block'],
+                                  'trial': npz['trial'],
+                                  'channels': [trial_channels.tolist() for trial_channels in channels],
+                                  'channel_electrode_map_id': npz['map_ids'][npz['map_indices']].tolist(),
+                                  'electrodes': [list(map(tuple, pairs.tolist())) for pairs in electrodes]},
+                                 index=pd.Index(npz['overall_trial'], name='overall trial'))
+        return cls(order)
+
+    def save_as_npz(self, path: str, source_key: Optional[np.ndarray] = None):
+        """Save the stimulation order as typed columns in a NumPy (npz) file.
+        :param path: File path
+        :param source_key: Identifies the file the order was read from, if it's a cache.
+        :raises ValueError: If an electrode entry isn't a pair."""
+        if any(len(pair) != 2 for trial_electrodes in self._electrodes for pair in trial_electrodes):
+            raise ValueError('Only electrode pairs can be saved as npz.')
+        map_ids, map_indices = np.unique(np.array(self._map_ids, dtype=str), return_inverse=True)
+        columns = {
+            'version': np.array(self.NPZ_VERSION),
+            'source_key': np.zeros(2, dtype=np.int64) if source_key is None else source_key,
+            'overall_trial': self._overall_trials,
+            'block': self._blocks,
+            'trial': self._trials,
+            # The channels and electrodes of all trials concatenated, and where each trial starts
+            'channels': np.array([c for trial_channels in self._channels for c in trial_channels], dtype=np.int8),
+            'channel_offsets': np.cumsum([0] + [len(trial_channels) for trial_channels in self._channels]),
+            'electrodes': np.array([pair for trial_electrodes in self._electrodes for pair in trial_electrodes],
+                                   dtype=np.int8).reshape(-1, 2),
+            'electrode_offsets': np.cumsum([0] + [len(trial_electrodes) for trial_electrodes in self._electrodes]),
+            'map_ids': map_ids,
+            'map_indices': map_indices,
+        }
+        # Write to a temporary file first, so a cache is never incomplete
+        temporary_path = path + '.tmp.npz'
+        np.savez(temporary_path, **columns)
+        os.replace(temporary_path, path)
+
+    # The channels which are stimulated in generated orders
+    # CHANNELS = tuple(range(1, 9))
+    CHANNELS = (1, 8)
+    # The relative frequencies of the numbers of channels in a trial. Favor lower numbers.
+    # N_CHANNELS_WEIGHTS = {1: 8, 2: 7, 3: 6, 4: 5, 5: 4, 6: 3, 7: 2, 8: 1}
+    N_CHANNELS_WEIGHTS = {1: 4, 2: 1}
+
+    @classmethod
+    def generate_new(cls, n_blocks: int = 4, n_trials_per_block: int = 8, seed: Optional[int] = None):
+        """Create a StimulationOrder instance by generating a new stimulation order.
+        The numbers of channels and the channels of all trials are drawn at once.
+        :param n_blocks: The number of blocks. The channel-electrode-maps are cycled through per block.
+        :param n_trials_per_block: The number of trials in each block.
+        :param seed: The seed of the random generator. The same seed generates the same order."""
+        rng = np.random.default_rng(seed)
+        n_trials = n_blocks * n_trials_per_block
+
+        # Randomly select the number of channels in each trial
+        counts = np.array(list(cls.N_CHANNELS_WEIGHTS.keys()))
+        weights = np.array(list(cls.N_CHANNELS_WEIGHTS.values()), dtype=np.float64)
+        n_channels = rng.choice(counts, size=n_trials, p=weights / weights.sum())
+        # A random permutation of the channels for each trial. The first n_channels are stimulated.
+        permutations = np.array(cls.CHANNELS)[rng.random((n_trials, len(cls.CHANNELS))).argsort(axis=1)]
+        channels = [permutation[:n] for permutation, n in zip(permutations.tolist(), n_channels.tolist())]
+
+        # Cyclically iterate through the channel-electrode-maps
+        map_ids = list(CHANNEL_ELECTRODE_MAPS.keys())
+        return cls.from_channels(channels, [map_ids[block % len(map_ids)] for block in range(n_blocks)],
+                                 n_trials_per_block)
+
     @classmethod
-    def generate_new(cls, n_blocks: int = 4, n_trials_per_block: int = 8):
-        """Create a StimulationOrder instance by generating a new stimulation order."""
-
-        order = pd.DataFrame(columns=['block', 'trial', 'channels', 'channel_electrode_map_id', 'electrodes'])
-        order.index.name = 'overall trial'
-
-        map_cycle = cycle(CHANNEL_ELECTRODE_MAPS.keys())
-        overall_trial = 1
-        for block in range(1, n_blocks + 1):
-            # Cyclically iterate through the channel-electrode-maps
-            map_id = next(map_cycle)
-            channel_electrode_map = CHANNEL_ELECTRODE_MAPS[map_id]
-            for trial in range(1, n_trials_per_block + 1):
-                # Randomly select the number of channels in this trial. Favor lower numbers.
-                # n_channels_in_trial = random.choices(range(1, 9), weights=[8, 7, 6, 5, 4, 3, 2, 1])[0]
-                n_channels_in_trial = random.choices(range(1, 3), weights=[4, 1])[0]
-                # channels = random.sample(range(1, 9), n_channels_in_trial)
-                channels = random.sample([1, 8], n_channels_in_trial)
-                electrodes = [channel_electrode_map[channel] for channel in channels]
-                # Set the values
-                order.loc[overall_trial] = {'block': block, 'trial': trial, 'channels': channels,
-                                            'channel_electrode_map_id': map_id, 'electrodes': electrodes}
-                overall_trial += 1
+    def from_channels(cls, channels: list[list[int]], block_map_ids: list[str], n_trials_per_block: int):
+        """Create a StimulationOrder instance from the channels of each trial. The electrodes are looked up in the
+        channel-electrode-maps.
+        :param channels: The channels of each trial, in the order of the trials.
+        :param block_map_ids: The channel-electrode-map ID of each block.
+        :param n_trials_per_block: The number of trials in each block."""
+        n_trials = len(channels)
+        trial_map_ids = [map_id for map_id in block_map_ids for _ in range(n_trials_per_block)]
+        electrodes = [[CHANNEL_ELECTRODE_MAPS[map_id][channel] for channel in trial_channels]
+                      for map_id, trial_channels in zip(trial_map_ids, channels)]
 
+        positions = np.arange(n_trials)
+        order = pd.DataFrame({'block': positions // n_trials_per_block + 1,
+                              'trial': positions % n_trials_per_block + 1,
+                              'channels': channels,
+                              'channel_electrode_map_id': trial_map_ids,
+                              'electrodes': electrodes},
+                             index=pd.RangeIndex(1, n_trials + 1, name='overall trial'))
         return cls(order)
 
     def n_trials_in_current_block(self) -> int:
         """Provides the number of trials in the current block."""
-        block_order = self.stim_order.where(self.stim_order['block'] == self.current_trial().block)
-        return int(block_order['trial'].max())
+        return int(self._trials_in_block[self._position])
 
     def n_blocks(self) -> int:
         """Provides the number of blocks in the stimulation order."""
-        return self.stim_order['block'].unique().size
+        return self._n_blocks
 
-    # for some reason it says that trial['block'] and trial['trial'] are invalid, so we turn off inspection
-    # noinspection PyTypeChecker
-    def current_trial(self):
+    def current_trial(self) -> TrialInfo:
         """Provides information on the current trial.
-        :return: A dict with the block and trial numbers, channels, and electrodes for the current trial."""
-        row = dict(self.stim_order.loc[self.overall_trial])
-        # convert block and trial from np.int64 to int
-        block = int(row['block'])
-        trial = int(row['trial'])
-
-        return TrialInfo(self.overall_trial, block, trial, row['channels'], row['channel_electrode_map_id'], row['electrodes'])
+        :return: A TrialInfo with the block and trial numbers, channels, and electrodes for the current trial."""
+        trial_info = self._trial_infos[self._position]
+        if trial_info is None:
+            position = self._position
+            trial_info = TrialInfo(self.overall_trial, int(self._blocks[position]), int(self._trials[position]),
+                                   self._channels[position], self._map_ids[position], self._electrodes[position])
+            self._trial_infos[position] = trial_info
+        return trial_info
 
-    def next_trial(self):
+    def next_trial(self) -> Optional[TrialInfo]:
         """Advance to the next trial.
-        :return: A dict with the block and trial numbers as well as the channels for the new trial if there is one, else None"""
+        :return: The TrialInfo of the new trial if there is one, else None"""
         # Go to the next trial unless this is the last one.
-        if self.overall_trial < len(self.stim_order):
-            self.overall_trial += 1
+        if self._position < len(self) - 1:
+            self._position += 1
             cur_trial = self.current_trial()
             logging.debug(f"New trial. Block: {cur_trial.block}, trial: {cur_trial.trial}")
             return cur_trial
@@ -103,47 +250,56 @@ class StimulationOrder:
             logging.debug("End of experiment.")
             return None
 
-    def reset_block(self):
+    def resume(self, recorded_trials: Container[int]) -> Optional[TrialInfo]:
+        """Go to the first trial which hasn't been recorded, e.g. to resume a session after a crash.
+        :param recorded_trials: The overall trial numbers which have been recorded.
+        :return: The information of that trial, or None if all trials have been recorded."""
+        for position, overall_trial in enumerate(self._overall_trials.tolist()):
+            if overall_trial not in recorded_trials:
+                self._position = position
+                return self.current_trial()
+        return None
+
+    def reset_block(self) -> TrialInfo:
         """Reset to the first trial of the current block.
-        :return: A dict with the block and trial numbers as well as the channels for the new trial."""
+        :return: The TrialInfo of the new trial."""
         # The index of the trial within the block is subtracted from the overall trial index to reset the block.
-        trial_in_block = self.stim_order.loc[self.overall_trial, 'trial']
-        self.overall_trial = self.overall_trial - trial_in_block + 1
+        self._position -= int(self._trials[self._position]) - 1
         return self.current_trial()
 
-    def save_as_excel(self, path: str):
-        """Saves the stimulation order to .csv file."""
-        # A deep copy is made because I'm not sure how making changes such as the color might affect the DataFrame
-        order_copy = self.stim_order.copy(deep=True)
-
-        # Alternate the background color of the blocks for readability
-        style = self._color_blocks(order_copy)
-        order_copy = style.data
-
-        # Auto-adjust column width and save
-        writer = pd.ExcelWriter(path, engine='xlsxwriter')
-        sheet_name = 'StimulationOrder'
-        style.to_excel(writer, sheet_name=sheet_name)
-        worksheet = writer.sheets[sheet_name]
-        for idx, col in enumerate(order_copy):
-            series = order_copy[col]
-            max_len = max((
-                series.astype(str).map(len).max(),  # len of largest item
-                len(str(series.name))  # len of column name/header
-            )) + 0.1  # adding a little extra space
-            worksheet.set_column(idx + 1, idx + 1, max_len)  # set column width
-        writer.close()
+    # The background colors of the blocks in exported Excel files, alternating for readability
+    EVEN_BLOCK_COLOR = '#E5FFE5'  # light green
+    ODD_BLOCK_COLOR = '#E5E5FF'  # light blue
+    EXCEL_SHEET_NAME = 'StimulationOrder'
 
-    @staticmethod
-    def _color_blocks(dataframe):
-        """Sets an alternating color for the blocks."""
+    def save_as_excel(self, path: str):
+        """Saves the stimulation order to an Excel (xlsx) file. The rows are streamed to the file with xlsxwriter's
+        constant_memory mode, so the memory doesn't grow with the number of trials. The column widths are tracked
+        while writing.
+        :param path: File path"""
+        columns = ['block', 'trial', 'channels', 'channel_electrode_map_id', 'electrodes']
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        worksheet = workbook.add_worksheet(self.EXCEL_SHEET_NAME)
+        # Like the header and index of pandas
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        index_format = workbook.add_format({'bold': True, 'border': 1, 'valign': 'top'})
+        block_formats = [workbook.add_format({'bg_color': self.EVEN_BLOCK_COLOR}),
+                         workbook.add_format({'bg_color': self.ODD_BLOCK_COLOR})]
 
-        def color_alternate(x):
-            color1 = '#E5FFE5'  # light green
-            color2 = '#E5E5FF'  # light blue
-            return ['background-color: {}'.format(color1 if x['block'] % 2 == 0 else color2) for _ in range(len(x))]
+        worksheet.write_row(0, 0, [self.stim_order.index.name or 'overall trial', *columns], header_format)
+        widths = [len(column) for column in columns]  # The length of the longest item of each column
+        # The numbers are converted lazily, so no list of all rows is built
+        rows = zip(map(int, self._overall_trials), map(int, self._blocks), map(int, self._trials), self._channels,
+                   self._map_ids, self._electrodes)
+        for row, (overall_trial, block, trial, channels, map_id, electrodes) in enumerate(rows, start=1):
+            cells = [block, trial, str(channels), map_id, str(electrodes)]
+            worksheet.write_number(row, 0, overall_trial, index_format)
+            worksheet.write_row(row, 1, cells, block_formats[block % 2])
+            widths = [max(width, len(str(cell))) for width, cell in zip(widths, cells)]
 
-        return dataframe.style.apply(color_alternate, axis=1)
+        for column, width in enumerate(widths, start=1):
+            worksheet.set_column(column, column, width + 0.1)  # adding a little extra space
+        workbook.close()
 
 
 # Example Usage
@@ -1,11 +1,23 @@
 import logging
+import math
+import threading
 import time
+from concurrent.futures import Future
 from dataclasses import dataclass
 import tkinter as tk
 from tkinter import messagebox
-from typing import Callable
+from typing import Callable, Iterable, Optional
 
-from sciencemode import sciencemode as sm
+try:
+    from sciencemode import sciencemode as sm
+except ImportError:  # The wrapper must be built in the project's root directory (see readme)
+    sm = None
+
+from backend.ack_receiver import AckReceiver, AckTimeoutError
+from backend.io_scheduler import IOScheduler, MainThreadDispatcher
+from backend.latency_metrics import LatencyMetrics
+from backend.ll_streamer import LowLevelStreamer
+from backend.waveforms import Waveform, WaveformCache
 
 
 @dataclass
@@ -15,6 +27,14 @@ class StimulationParameters:
     interpulse_interval: int
     period_ms: float
 
+    def validate(self):
+        """
+        Check that the device can stimulate a rectangular pulse with these parameters, e.g. that it fits in the period.
+        :raises ValueError: If it can't.
+        """
+        Waveform.rectangular(self.amplitude_ma, self.phase_duration, self.interpulse_interval,
+                             self.period_ms).validate()
+
 
 class SerialPortError(Exception):
     """Exception raised for errors related to serial port operations."""
@@ -28,31 +48,117 @@ class StimulatorError(Exception):
 
 class Stimulator:
     MAX_WAIT_TIME_S = 1.0  # Timeout for waiting for device response
-
-    def __init__(self, master: tk.Tk):
+    KEEPALIVE_INTERVAL_S = 1.0  # The time between keepalives. The device stops after 2 s without a command.
+    # The device also de-initializes ML after 2 s without a command. If no command was sent for this long (e.g. because
+    # the keepalive of an ML session was delayed), ML is initialized again before the next stimulation.
+    ML_TIMEOUT_S = 1.5
+    # The timer of the stop is asked to wake up this much before the end (plus its expected lateness). The rest of the
+    # time is waited for precisely.
+    STOP_MARGIN_S = 0.002
+    # The expected lateness of the stop timer before it has been measured (a timer tick on Windows)
+    INITIAL_STOP_LATENESS_S = 0.016
+    # A single lateness counts as at most a timer tick. Longer delays are a blocked thread (e.g. a messagebox on the Tk
+    # thread or a GC pause), which the next stops shouldn't wake up early for.
+    MAX_STOP_LATENESS_S = 0.016
+    # A stop thread waits at most this long precisely. If it wakes up earlier, it's scheduled again.
+    MAX_STOP_SPIN_S = 0.005
+    # How fast the expected lateness decreases when the timer is on time
+    STOP_LATENESS_DECAY = 0.9
+    # Live updates requested within this time are sent as one ml_update
+    UPDATE_COALESCE_MS = 2
+
+    def __init__(self, master: tk.Tk, backend=None, io_scheduler: Optional[IOScheduler] = None,
+                 stop_thread: bool = False):
+        """
+        :param master: The widget whose event loop is used for scheduling.
+        :param backend: The module used to communicate with the device. Defaults to the ScienceMode wrapper.
+        A ``SimulatedP24`` can be passed to stimulate without a device.
+        :param io_scheduler: If given, the keepalive, error polling, and timed stop run on this I/O thread instead of
+        the event loop of ``master``. The callbacks passed to ``stimulate_ml`` are still called on the Tk thread.
+        :param stop_thread: Without an io_scheduler, whether the timed stop runs on a dedicated thread instead of the
+        event loop of ``master``. This makes the stimulation duration independent of the load of the event loop.
+        """
         self.master = master
+        self._master_thread = threading.current_thread()
+        self._threaded = io_scheduler is not None
+        # The keepalive and error checks are scheduled with ``after`` of the I/O thread or the Tk event loop
+        self._timer = io_scheduler if self._threaded else master
+        # The timed stop is scheduled on the I/O thread, a dedicated thread (which is started with the other helpers),
+        # or the Tk event loop
+        self._owns_stop_thread = not self._threaded and stop_thread
+        self._stop_timer = io_scheduler if self._threaded else master
+        # How late the stop timer is expected to be. It's measured at every stop.
+        self._stop_lateness_s = self.INITIAL_STOP_LATENESS_S
+        # Device communication can happen from the Tk thread, the I/O thread, and the ack receiver thread
+        self._lock = threading.RLock()
+        if backend is None:
+            if sm is None:
+                raise StimulatorError('The ScienceMode wrapper is not installed. Install it (see readme) or pass a '
+                                      'simulated backend.')
+            backend = sm
+        self.sm = backend
 
         # Allocate memory for various structures used in communication with the device
-        self.device = sm.ffi.new("Smpt_device*")  # memory for the device
-        self.ack = sm.ffi.new("Smpt_ack*")  # memory for acknowledgment (responses)
-        self.extended_version_ack = sm.ffi.new("Smpt_get_extended_version_ack*")  # memory for device info
-        self.ml_init = sm.ffi.new("Smpt_ml_init*")
-        self.ml_update = sm.ffi.new("Smpt_ml_update*")  # memory for mid-level (ML) stimulation update
-        self.ml_get_current_data = sm.ffi.new("Smpt_ml_get_current_data*")  # memory for getting current data
-        self.ml_get_current_data_ack = sm.ffi.new("Smpt_ml_get_current_data_ack*")
+        self.device = self.sm.ffi.new("Smpt_device*")  # memory for the device
+        self.extended_version_ack = self.sm.ffi.new("Smpt_get_extended_version_ack*")  # memory for device info
+        self.ml_init = self.sm.ffi.new("Smpt_ml_init*")
+        self.ml_update = self.sm.ffi.new("Smpt_ml_update*")  # memory for mid-level (ML) stimulation update
+        self.ml_get_current_data = self.sm.ffi.new("Smpt_ml_get_current_data*")  # memory for getting current data
+        # The compiled channel configurations of the recently used pulses
+        self.waveforms = WaveformCache(self.sm)
+
+        self._helpers_running = False
+        self._start_helpers()
+        # The round trips, keepalive intervals, stimulation durations, and stop latencies
+        self.metrics = LatencyMetrics()
 
         self.keep_stimulating = False
         # The callback identifier which calls the _stimulation_loop after a certain duration
         self.stim_loop_callback = None
-        # The callback identifier which calls _check_for_error after a certain duration
-        self.check_error_callback = None
+        self._stop_callback = None  # The callback identifier of the timed stop
         self.start_time = None  # start time of stimulation
+        self.last_stimulation_duration_s = None  # The achieved duration of the last ML stimulation
+        self.last_keepalive_time = None  # When the last command which keeps the stimulation going was sent
+        self._loop_due_time = None  # When the next _stimulation_loop is scheduled
+        self._ml_running = False  # Whether an ML stimulation has been started and not stopped yet
+        # Incremented for every stimulation, so callbacks of a stopped stimulation can be recognized in threaded mode
+        self._stimulation_id = 0
+        self._ml_initialized = False  # Whether ml_init has been sent and the device hasn't been stopped since
+        self.ml_session = False  # Whether ML stays initialized between stimulations, see open_ml_session()
+        self._session_keepalive_callback = None  # The callback identifier of the keepalive between stimulations
+        self._update_callback = None  # The callback identifier of the pending (coalesced) live update
+        self.coalesced_updates = 0  # The number of live update requests which didn't need their own ml_update
         self._active_channels_adjusted = set()  # The active channels (adjusted for 0-indexing)
+        self._ll_streamer: Optional[LowLevelStreamer] = None  # The running low-level (LL) stimulation
 
     def active_channels(self):
         """Get a set of the currently active channels as depicted on the stimulator."""
         return {x + 1 for x in self._active_channels_adjusted}  # adjust for 1-indexing
 
+    def _start_helpers(self):
+        """Start the threads which communicate with the device and the dispatching to the Tk thread. They're shut down
+        when the port is closed and started again when it's opened."""
+        if self._helpers_running:
+            return
+        if self._owns_stop_thread:
+            self._stop_timer = IOScheduler(name='StimulationStop')
+        # Runs functions from the I/O thread and the ack receiver thread on the Tk thread
+        self._dispatcher = MainThreadDispatcher(self.master)
+        # Reads all acknowledgements and routes them to the commands waiting for them
+        self.ack_receiver = AckReceiver(self.sm, self.device, self._lock)
+        self._helpers_running = True
+
+    def shutdown(self):
+        """Stop the ack receiver thread, the stop thread, and the dispatching to the Tk thread, e.g. if the port couldn't
+        be opened. Use close_com_port() if it's open. A shared I/O thread isn't stopped."""
+        if not self._helpers_running:
+            return
+        self._helpers_running = False
+        self.ack_receiver.shutdown()
+        if self._owns_stop_thread:
+            self._stop_timer.shutdown()
+        self._dispatcher.shutdown()
+
     def initialize(self, com_port: str):
         """
         Open the COM port and initialize the simulator.
@@ -60,55 +166,53 @@ class Stimulator:
         :return: The ``Smpt_device*`` object for further communication.
         """
         logging.info('--- Initialization ---')
+        self._start_helpers()
         packet_number = self._open_com_port(com_port)
 
         self._log_version_info(packet_number)
 
     def _open_com_port(self, com_port: str):
-        com = sm.ffi.new("char[]", com_port.encode("ascii"))
+        com = self.sm.ffi.new("char[]", com_port.encode("ascii"))
 
         # Check if the serial port is available
-        ret = sm.smpt_check_serial_port(com)
+        ret = self.sm.smpt_check_serial_port(com)
         if not ret:
             msg = f"Failed to open the serial port {com_port}. \n(Port check is {ret})"
             logging.error(msg)
             raise SerialPortError(msg)
 
         # Open the serial port for communication with the device
-        ret = sm.smpt_open_serial_port(self.device, com)
+        ret = self.sm.smpt_open_serial_port(self.device, com)
         if ret:
             logging.info(f"Serial port has been opened successfully.")
 
         # Generate the next packet number for communication (ensures synchronization with device)
-        packet_number = sm.smpt_packet_number_generator_next(self.device)
+        packet_number = self.sm.smpt_packet_number_generator_next(self.device)
         # logging.debug(f"next packet_number {packet_number}") # Output the next packet number
         return packet_number
 
     def _log_version_info(self, packet_number):
         # Send a request to get extended version information from the device
-        _ret = sm.smpt_send_get_extended_version(self.device, packet_number)
+        response = self.ack_receiver.expect(self.sm.Smpt_Cmd_Get_Extended_Version_Ack, packet_number,
+                                            timeout_s=self.MAX_WAIT_TIME_S)
+        with self._lock:
+            _ret = self.sm.smpt_send_get_extended_version(self.device, packet_number)
 
         # Wait for a response packet from the device
         logging.debug("Waiting for device response...")
-        start_time = time.time()
-
-        while not sm.smpt_new_packet_received(self.device):
-            # Check if the timeout has been reached
-            if time.time() - start_time > self.MAX_WAIT_TIME_S:
-                msg = f"Timeout waiting for device response. It took more than {self.MAX_WAIT_TIME_S} seconds."
-                logging.error(msg)
-                raise SerialPortError(msg)
-            time.sleep(0.001)
+        try:
+            ack = response.result()
+        except AckTimeoutError:
+            msg = f"Timeout waiting for device response. It took more than {self.MAX_WAIT_TIME_S} seconds."
+            logging.error(msg)
+            raise SerialPortError(msg)
         logging.info("Device response received.")
 
-        # Get the last acknowledgment packet from the device
-        sm.smpt_last_ack(self.device, self.ack)
-
         # Output command info
-        # logging.debug(f"command number {self.ack.command_number}, packet_number {self.ack.packet_number}")
+        # logging.debug(f"command number {ack.command_number}, packet_number {ack.packet_number}")
 
-        # Retrieve the extended version information from the device
-        _ret = sm.smpt_get_get_extended_version_ack(self.device, self.extended_version_ack)
+        # The extended version information from the device
+        self.extended_version_ack = ack.payload
         # logging.debug(f"fw_hash: {self.extended_version_ack.fw_hash}") # Output the firmware hash
 
         fw_version = self.extended_version_ack.uc_version.fw_version
@@ -128,21 +232,118 @@ class Stimulator:
         :param stim_params: A StimulationParameters object with the amplitude, phase_duration, interpulse_interval, and period
         :return: None
         """
+        self.waveform_pulse(channel, Waveform.rectangular(stim_params.amplitude_ma, stim_params.phase_duration,
+                                                          stim_params.interpulse_interval, stim_params.period_ms))
+
+    def waveform_pulse(self, channel: int, waveform: Waveform):
+        """
+        Configure a pulse of any shape (up to 16 points) for the specified channel using mid-level configuration.
+        The waveform is compiled and validated once and then copied into the update as a whole.
+        :param channel: The channel number as depicted on the stimulator (1-8)
+        :param waveform: The shape and period of the pulse.
+        :raises ValueError: If the waveform is invalid, e.g. not charge balanced.
+        """
+        channel_adjusted = channel - 1  # adjust channel for 0-indexing
+        with self._lock:
+            compiled = self.waveforms.get(waveform)
+            self._active_channels_adjusted.add(channel_adjusted)
+
+            # configure
+            self.ml_update.enable_channel[channel_adjusted] = True
+            self.ml_update.channel_config[channel_adjusted] = compiled[0]  # Copies the whole structure
+
+    def disable_channel(self, channel: int):
+        """
+        Remove the pulse of the specified channel.
+        :param channel: The channel number as depicted on the stimulator (1-8)
+        """
         channel_adjusted = channel - 1  # adjust channel for 0-indexing
-        self._active_channels_adjusted.add(channel_adjusted)
+        with self._lock:
+            self._active_channels_adjusted.discard(channel_adjusted)
+            self.ml_update.enable_channel[channel_adjusted] = False
 
-        # configure
-        self.ml_update.enable_channel[channel_adjusted] = True
+    def update_ml(self):
+        """
+        Apply the pulse configurations (see rectangular_pulse(), waveform_pulse(), and disable_channel()) to the
+        running stimulation without stopping it. Requests in quick succession are coalesced into one ml_update.
+        If no stimulation is running, the configurations are applied when the next one starts.
+        """
+        with self._lock:
+            if not self._ml_running:
+                return
+            if self._update_callback is not None:
+                self.coalesced_updates += 1
+                return
+            self._update_callback = self._timer.after(self.UPDATE_COALESCE_MS, self._send_live_update,
+                                                      self._stimulation_id)
+
+    def _send_live_update(self, stimulation_id: int):
+        with self._lock:
+            self._update_callback = None
+            if stimulation_id != self._stimulation_id:
+                return  # The stimulation was stopped in the meantime
+            logging.debug(f'Live update of channels {self.active_channels()}')
+            self._send_ml_update()
+
+    def _send_ml_update(self) -> tuple[bool, Future]:
+        """Send the ml_update. This starts, changes, or (without enabled channels) stops the stimulation.
+        :return: The return value of smpt_send_ml_update and the Future of its acknowledgement."""
+        self.ml_update.packet_number = self.sm.smpt_packet_number_generator_next(self.device)
+        response = self.ack_receiver.expect(self.sm.Smpt_Cmd_Ml_Update_Ack, self.ml_update.packet_number)
+        send_time = time.perf_counter()
+        ret = self.sm.smpt_send_ml_update(self.device, self.ml_update)
+        self.last_keepalive_time = time.perf_counter()
+        self.metrics.record_response(LatencyMetrics.RTT_ML_UPDATE, response, send_time)
+        return ret, response
+
+    def open_ml_session(self):
+        """
+        Initialize ML stimulation once and keep it initialized between stimulations, e.g. for a whole experiment.
+        Stimulations then start with a single ml_update and are stopped by disabling all channels instead of ml_stop.
+        Between stimulations, a keepalive is sent every KEEPALIVE_INTERVAL_S, so the device doesn't de-initialize ML.
+        """
+        with self._lock:
+            self.ml_session = True
+            self._ensure_ml_initialized()
+            self._schedule_session_keepalive()
+
+    def close_ml_session(self):
+        """Stop any stimulation, send ml_stop, and go back to initializing ML for every stimulation."""
+        with self._lock:
+            self.ml_session = False
+            self._cancel_session_keepalive()
+            self.stop_stimulation()
 
-        config = self.ml_update.channel_config[channel_adjusted]
-        config.period = stim_params.period_ms
-        config.number_of_points = 3
-        config.points[0].current = stim_params.amplitude_ma
-        config.points[0].time = stim_params.phase_duration
-        config.points[1].current = 0
-        config.points[1].time = stim_params.interpulse_interval
-        config.points[2].current = -stim_params.amplitude_ma
-        config.points[2].time = stim_params.phase_duration
+    def _schedule_session_keepalive(self):
+        """Schedule the next keepalive of the ML session if no stimulation is running. Must be called on the thread of
+        the timer."""
+        with self._lock:
+            self._cancel_session_keepalive()
+            if self.ml_session and self._ml_initialized and not self._ml_running:
+                self._session_keepalive_callback = self._timer.after(round(self.KEEPALIVE_INTERVAL_S * 1000),
+                                                                     self._session_keepalive)
+
+    def _cancel_session_keepalive(self):
+        if self._session_keepalive_callback is not None:
+            self._timer.after_cancel(self._session_keepalive_callback)
+            self._session_keepalive_callback = None
+
+    def _session_keepalive(self):
+        with self._lock:
+            self._session_keepalive_callback = None
+            if not self.ml_session or not self._ml_initialized or self._ml_running:
+                return  # A stimulation keeps the device alive itself
+            self._send_get_current_data()
+            self._schedule_session_keepalive()
+
+    def _ensure_ml_initialized(self):
+        """Send ml_init unless ML is initialized and the device can't have de-initialized it in the meantime."""
+        if (self._ml_initialized and self.last_keepalive_time is not None
+                and time.perf_counter() - self.last_keepalive_time > self.ML_TIMEOUT_S):
+            logging.warning('No command was sent to the device for too long. Initializing ML again.')
+            self._ml_initialized = False
+        if not self._ml_initialized:
+            self._initialize_ml()
 
     def _reset_pulse_configs(self):
         """Rests the pulse configurations to remove the previously specified pulses"""
@@ -159,146 +360,311 @@ class Stimulator:
         :param on_error: A function to be executed if the stimulator says there's an error.
         :return: The start time of the stimulation.
         """
-        logging.info('--- Stimulation ---')
-        self._initialize_ml()  # Initialize mid-level (ML) stimulation
+        with self._lock:
+            logging.info('--- Stimulation ---')
+            self._cancel_session_keepalive()  # The stimulation loop sends the keepalives
+            self._ensure_ml_initialized()  # Initialize mid-level (ML) stimulation
 
-        logging.info(f'Stimulating on channels {self.active_channels()}')
+            logging.info(f'Stimulating on channels {self.active_channels()}')
 
-        self.start_time = time.perf_counter()
-        self.ml_update.packet_number = sm.smpt_packet_number_generator_next(self.device)
-        ret = sm.smpt_send_ml_update(self.device, self.ml_update)  # This already starts the stimulation
+            self.start_time = time.perf_counter()
+            ret, _response = self._send_ml_update()  # This already starts the stimulation
 
-        if ret:
-            logging.info("Stimulation started successfully.")
-            self.keep_stimulating = True
-        else:
-            msg = "Failed to start stimulation."
-            logging.error(msg)
-            raise StimulatorError(msg)
+            if ret:
+                logging.info("Stimulation started successfully.")
+                self.keep_stimulating = True
+                self._ml_running = True
+                self._stimulation_id += 1
+            else:
+                msg = "Failed to start stimulation."
+                logging.error(msg)
+                raise StimulatorError(msg)
+
+            # Let it loop but don't block the main thread
+            self._loop_due_time = self.start_time  # The keepalives are due at whole seconds after the start
+            if self._threaded:
+                # The loop runs on the I/O thread. This also lets several devices on the same I/O thread be started
+                # back to back before their first keepalives are sent.
+                self.stim_loop_callback = self._timer.after(0, self._stimulation_loop, self._stimulation_id,
+                                                            stim_duration_s, on_termination, on_error)
+            else:
+                self._stimulation_loop(self._stimulation_id, stim_duration_s, on_termination, on_error)
 
-        # Let it loop but don't block the main thread
-        self._stimulation_loop(stim_duration_s, on_termination, on_error)
+            return self.start_time
 
-        return self.start_time
+    def prepare_ml(self):
+        """Send ml_init ahead of stimulate_ml(), so that starting the stimulation only takes the ml_update."""
+        with self._lock:
+            self._ensure_ml_initialized()
+
+    def _call_in_master(self, func: Callable, *args):
+        """Call a function on the Tk thread. From other threads, it's called asynchronously."""
+        if threading.current_thread() is not self._master_thread:
+            self._dispatcher.call(func, *args)
+        else:
+            func(*args)
+
+    def _call_in_io(self, func: Callable, *args):
+        """Asynchronously call a function on the thread which handles the stimulation (the I/O or Tk thread).
+        Can be called from any thread."""
+        if self._threaded:
+            self._timer.after(0, func, *args)
+        else:
+            self._dispatcher.call(func, *args)
 
     def _initialize_ml(self):
         """Initialize mid-level (ML) stimulation."""
-        self.ml_init.packet_number = sm.smpt_packet_number_generator_next(self.device)
-        ret = sm.smpt_send_ml_init(self.device, self.ml_init)
+        self.ml_init.packet_number = self.sm.smpt_packet_number_generator_next(self.device)
+        response = self.ack_receiver.expect(self.sm.Smpt_Cmd_Ml_Init_Ack, self.ml_init.packet_number)
+        send_time = time.perf_counter()
+        ret = self.sm.smpt_send_ml_init(self.device, self.ml_init)
+        self.last_keepalive_time = time.perf_counter()
+        self.metrics.record_response(LatencyMetrics.RTT_ML_INIT, response, send_time)
+        self._ml_initialized = bool(ret)
         logging.debug(f"smpt_send_ml_init: {ret}")
         # time.sleep(0.001)
 
-    def _stimulation_loop(self, stim_duration_s: float, on_termination: Callable[[], None],
+    def _stimulation_loop(self, stimulation_id: int, stim_duration_s: float, on_termination: Callable[[], None],
                           on_error: Callable[[int], None]):
-        """Sends an update once per second to keep the stimulation running and stops after the specified time.
+        """Sends an update once per second to keep the stimulation running and schedules the stop at the end.
+        The keepalives are scheduled at fixed times after the start, so the lateness of one doesn't add up.
         :return: Elapsed time in seconds"""
-        elapsed_time = time.perf_counter() - self.start_time
+        with self._lock:
+            if stimulation_id != self._stimulation_id:
+                return None  # The stimulation was stopped while this callback was already due
 
-        if self.keep_stimulating:
-            self.ml_get_current_data.data_selection = sm.Smpt_Ml_Data_Channels
-            self.ml_get_current_data.packet_number = sm.smpt_packet_number_generator_next(self.device)
+            now = time.perf_counter()
+            elapsed_time = now - self.start_time
+            self.metrics.record(LatencyMetrics.KEEPALIVE_LATENESS, now - self._loop_due_time)
             # We have to call this at least every 2s to keep the stimulation going
-            ret = sm.smpt_send_ml_get_current_data(self.device, self.ml_get_current_data)
-            if ret:
-                logging.debug(f"ML update sent. Elapsed time: {elapsed_time:.5f} s")
-            else:
-                logging.error(f"smpt_send_ml_get_current_data returned {ret}")
-
-            # Check for errors asynchronously
-            # 150 ms seems to give it enough time to receive a response consistently
-            self.check_error_callback = self.master.after(150, self._check_for_error, on_error)
+            # Check for errors as soon as the response arrives
+            self._send_get_current_data(lambda response: self._call_in_io(
+                self._check_for_error, stimulation_id, response, on_error))
+            logging.debug(f"ML update sent. Elapsed time: {elapsed_time:.5f} s")
 
             # If we have more than 1.5 s left of stimulation, we wait for 1 s
-            # Otherwise, we break out of the loop and wait for the remaining time
-            # This is for precision as well as performance reasons: we can wait for the exact time, and we don't need to
-            # call sm.smpt_send_ml_get_current_data that often.
+            # Otherwise, we break out of the loop and schedule the stop at the exact end
+            # This is for precision as well as performance reasons: we can wait for the exact time, and we don't
+            # need to call self.sm.smpt_send_ml_get_current_data that often.
             if elapsed_time < (stim_duration_s - 1.5):
-                callback_after_ms = 1000
+                self._loop_due_time += self.KEEPALIVE_INTERVAL_S
+                self.stim_loop_callback = self._call_at(self._timer, self._loop_due_time, self._stimulation_loop,
+                                                        stimulation_id, stim_duration_s, on_termination, on_error)
             else:
                 self.keep_stimulating = False
-                callback_after_ms = round((stim_duration_s - elapsed_time) * 1000)  # call back after the remaining time
-            self.stim_loop_callback = self.master.after(callback_after_ms, self._stimulation_loop, stim_duration_s,
-                                                        on_termination, on_error)
-        else:
-            # We should only reach this after the time has run out. Otherwise, log this error.
-            if elapsed_time < stim_duration_s:
-                logging.warning("Stimulation time has not run out, but the stimulation is being stopped. "
-                                "Something went wrong internally")
-            self.stop_stimulation()
-            on_termination()
-        return elapsed_time
-
-    def _check_for_error(self, on_error: Callable[[int], None]):
-        """Checks is the device is reporting an issue during stimulation."""
-        # This code is copied and adapted from the notebook P24_ml_eight_channels.ipynb from the ScienceMode
-        # python wrapper.
-        self.ml_get_current_data_ack.packet_number = sm.smpt_packet_number_generator_next(self.device)
-        while sm.smpt_new_packet_received(self.device):
-            # Clear up the acknowledgment structure
-            sm.smpt_clear_ack(self.ack)
-            sm.smpt_last_ack(self.device, self.ack)
-
-            # Check whether this packet is the acknowledgement for the ml_get_current_data command
-            if self.ack.command_number != sm.Smpt_Cmd_Ml_Get_Current_Data_Ack:
-                continue
-
-            # Get the acknowledgement (response)
-            ret = sm.smpt_get_ml_get_current_data_ack(self.device, self.ml_get_current_data_ack)
-            if not ret:
-                logging.debug(
-                    f"Couldn't get the ml_get_current_data acknowledgement. (smpt_get_ml_get_current_data_ack: {ret})")
+                self.stim_loop_callback = None
+                self._schedule_stop(stimulation_id, stim_duration_s, on_termination)
+            return elapsed_time
+
+    @staticmethod
+    def _call_at(timer, deadline: float, func: Callable, *args):
+        """Schedule a function at a ``time.perf_counter`` deadline on a timer with ``after`` (and maybe ``call_at``).
+        Timers with only ``after`` (Tk) are rounded down to whole milliseconds, so they can be up to 1 ms early because
+        of it.
+        :return: The callback identifier."""
+        if isinstance(timer, IOScheduler):
+            return timer.call_at(deadline, func, *args)
+        return timer.after(max(0, int((deadline - time.perf_counter()) * 1000)), func, *args)
+
+    def _schedule_stop(self, stimulation_id: int, stim_duration_s: float, on_termination: Callable[[], None]):
+        """Schedule the stop at the end of the stimulation. The timer is asked to wake up early by its expected
+        lateness, and the rest is waited for in _timed_stop."""
+        end_time = self.start_time + stim_duration_s
+        wake_time = end_time - self._stop_lateness_s - self.STOP_MARGIN_S
+        self._stop_callback = self._call_at(self._stop_timer, wake_time, self._timed_stop, stimulation_id,
+                                            wake_time, stim_duration_s, on_termination)
+
+    def _timed_stop(self, stimulation_id: int, wake_time: Optional[float], stim_duration_s: float,
+                    on_termination: Callable[[], None]):
+        """Stop the stimulation at its exact end. A stop thread waits for the rest of the time precisely. The Tk
+        thread is scheduled again instead, because waiting would freeze the GUI.
+        :param wake_time: When this was scheduled to be called. None if it has been scheduled again after waking up
+        early, which isn't measured."""
+        now = time.perf_counter()
+        if wake_time is not None:
+            # Update the expected lateness: it rises to the lateness of this call (at most a timer tick) and decays
+            # while the timer is on time
+            lateness_s = min(max(0.0, now - wake_time), self.MAX_STOP_LATENESS_S)
+            self._stop_lateness_s = max(lateness_s, self._stop_lateness_s * self.STOP_LATENESS_DECAY)
+
+        end_time = self.start_time + stim_duration_s
+        remaining_s = end_time - now
+        on_tk_thread = not isinstance(self._stop_timer, IOScheduler)
+        if remaining_s > (0 if on_tk_thread else self.MAX_STOP_SPIN_S):
+            with self._lock:
+                if stimulation_id != self._stimulation_id:
+                    return
+                if on_tk_thread:
+                    # Rounded up, so it isn't early again
+                    self._stop_callback = self._stop_timer.after(math.ceil(remaining_s * 1000), self._timed_stop,
+                                                                 stimulation_id, None, stim_duration_s,
+                                                                 on_termination)
+                else:
+                    self._stop_callback = self._stop_timer.call_at(end_time - self.MAX_STOP_SPIN_S, self._timed_stop,
+                                                                   stimulation_id, None, stim_duration_s,
+                                                                   on_termination)
+            return
+
+        while time.perf_counter() < end_time:
+            time.sleep(0)  # Wait for the rest of the time precisely, while letting other threads run
+        with self._lock:
+            if stimulation_id != self._stimulation_id:
+                return  # The stimulation was stopped while this callback was already due
+            self._stop_callback = None
+            self.stop_stimulation(requested_duration_s=stim_duration_s)
+        self._call_in_master(on_termination)
+
+    def stimulate_ll(self, channels: Iterable[int], stim_params: StimulationParameters, stim_duration_s: float,
+                     on_termination: Callable[[], None], on_error: Callable[[int], None]) -> LowLevelStreamer:
+        """
+        Start low-level (LL) stimulation with rectangular pulses. The pulses of the channels are interleaved, and the
+        device's buffer is kept full with acknowledgement-driven flow control. This supports pulse rates up to 1000 Hz.
+        :param channels: The channels as depicted on the stimulator (1-8)
+        :param stim_params: The pulse parameters for all channels. The period is the time between pulses on a channel.
+        :param stim_duration_s: How long the stimulation should go on for in seconds
+        :param on_termination: The function to call when all pulses have been stimulated.
+        :param on_error: A function to be executed with the channel if the stimulator says there's an error.
+        :return: The LowLevelStreamer. Its ``stats`` contain the underruns and the achieved pulse timing.
+        """
+        with self._lock:
+            logging.info('--- Low-level stimulation ---')
+            self._ll_streamer = LowLevelStreamer(self.sm, self.device, self._lock, self.ack_receiver, self._timer,
+                                                 self._dispatcher.call, channels, stim_params.amplitude_ma,
+                                                 stim_params.phase_duration, stim_params.interpulse_interval,
+                                                 stim_params.period_ms, stim_duration_s, on_termination, on_error)
+            self.start_time = time.perf_counter()
+            self._ll_streamer.start()
+            return self._ll_streamer
+
+    def get_current_data(self) -> Future:
+        """Request the current data (e.g. the channel states) from the device. This also keeps a stimulation going.
+        :return: A Future with the ReceivedAck. Its payload is the ``Smpt_ml_get_current_data_ack*``."""
+        with self._lock:
+            return self._send_get_current_data()
+
+    def _send_get_current_data(self, callback: Optional[Callable[[Future], None]] = None) -> Future:
+        """Send ml_get_current_data and return the Future of its acknowledgement."""
+        self.ml_get_current_data.data_selection = self.sm.Smpt_Ml_Data_Channels
+        self.ml_get_current_data.packet_number = self.sm.smpt_packet_number_generator_next(self.device)
+        response = self.ack_receiver.expect(self.sm.Smpt_Cmd_Ml_Get_Current_Data_Ack,
+                                            self.ml_get_current_data.packet_number, callback=callback)
+        send_time = time.perf_counter()
+        ret = self.sm.smpt_send_ml_get_current_data(self.device, self.ml_get_current_data)
+        self.metrics.record_response(LatencyMetrics.RTT_ML_GET_CURRENT_DATA, response, send_time)
+        if self._ml_running and self.last_keepalive_time is not None:
+            self.metrics.record(LatencyMetrics.KEEPALIVE_INTERVAL, send_time - self.last_keepalive_time)
+        self.last_keepalive_time = time.perf_counter()
+        if not ret:
+            logging.error(f"smpt_send_ml_get_current_data returned {ret}")
+        return response
+
+    def _check_for_error(self, stimulation_id: int, response: Future, on_error: Callable[[int], None]):
+        """Checks is the device is reporting an issue during stimulation.
+        :param response: The Future of the ml_get_current_data acknowledgement."""
+        with self._lock:
+            if stimulation_id != self._stimulation_id:
+                return
+            try:
+                ack = response.result()
+            except AckTimeoutError:
+                # The next keepalive will check again
+                logging.warning("The device didn't respond to ml_get_current_data in time.")
+                return
 
             # Check for an error on all active channels
             for channel_adj in self._active_channels_adjusted:
-                error_on_channel = self.ml_get_current_data_ack.channel_data.channel_state[channel_adj]
+                error_on_channel = ack.payload.channel_data.channel_state[channel_adj]
                 if bool(error_on_channel):
                     channel_input = channel_adj + 1  # adjust for 0-indexing
                     logging.error(f"There's an error on channel {channel_input}. Stopping stimulation.")
+                    self._ml_initialized = False  # Even in an ML session, the device is stopped and re-initialized
                     self.stop_stimulation()
-                    on_error(channel_input)
-                    break # We don't check for further errors because the stimulation is stopped
+                    self._call_in_master(on_error, channel_input)
+                    break  # We don't check for further errors because the stimulation is stopped
                 # else:
                 #     channel_input = channel_adj + 1
                 #     logging.debug(f"No error on channel {channel_input}.")
 
-    def stop_stimulation(self):
+    def stop_stimulation(self, requested_duration_s: Optional[float] = None):
         """
         Stop stimulation.
+        :param requested_duration_s: If the stimulation is stopped because its time ran out, the requested duration.
+        It's used to record the duration error and the stop latency.
         :returns: Whether stimulation was stopped successfully.
         """
-        self.keep_stimulating = False
-        # Cancel the callback to _stimulation_loop and _check_for_error
-        if self.stim_loop_callback is not None:
-            self.master.after_cancel(self.stim_loop_callback)
-            # logging.debug(f'Called after_cancel for stimulation callback: {self.stim_loop_callback}')
-            self.stim_loop_callback = None
-        if self.check_error_callback is not None:
-            self.master.after_cancel(self.check_error_callback)
-            # logging.debug(f'Called after_cancel for check_error_callback: {self.check_error_callback}')
-            self.check_error_callback = None
-        self._reset_pulse_configs()
-
-        packet_number = sm.smpt_packet_number_generator_next(self.device)
-        ret = sm.smpt_send_ml_stop(self.device, packet_number)  # Stops the stimulation
+        requested_time = time.perf_counter()
+        if requested_duration_s is not None and self.start_time is not None:
+            requested_time = self.start_time + requested_duration_s  # When the stop was due
+        with self._lock:
+            if self._ll_streamer is not None:
+                streamer, self._ll_streamer = self._ll_streamer, None
+                # A streamer which has terminated or stopped on an error doesn't stop the ML stimulation after it
+                if streamer.running:
+                    streamer.stop()
+                    return True
+
+            self.keep_stimulating = False
+            self._stimulation_id += 1  # Pending callbacks of this stimulation are ignored from now on
+            # Cancel the callback to _stimulation_loop
+            if self.stim_loop_callback is not None:
+                self._timer.after_cancel(self.stim_loop_callback)
+                # logging.debug(f'Called after_cancel for stimulation callback: {self.stim_loop_callback}')
+                self.stim_loop_callback = None
+            if self._stop_callback is not None:
+                self._stop_timer.after_cancel(self._stop_callback)
+                self._stop_callback = None
+            if self._update_callback is not None:
+                self._timer.after_cancel(self._update_callback)
+                self._update_callback = None
+            self._reset_pulse_configs()
+
+            if self.ml_session and self._ml_initialized:
+                # Disabling all channels stops the stimulation, but ML stays initialized
+                send_time = time.perf_counter()
+                ret, response = self._send_ml_update()
+            else:
+                packet_number = self.sm.smpt_packet_number_generator_next(self.device)
+                response = self.ack_receiver.expect(self.sm.Smpt_Cmd_Ml_Stop_Ack, packet_number)
+                send_time = time.perf_counter()
+                ret = self.sm.smpt_send_ml_stop(self.device, packet_number)  # Stops the stimulation
+                self.metrics.record_response(LatencyMetrics.RTT_ML_STOP, response, send_time)
+                self._ml_initialized = False
+            if self._ml_running:
+                self.metrics.record_response(LatencyMetrics.STOP_LATENCY, response, requested_time)
+                duration_s = send_time - self.start_time
+                self.last_stimulation_duration_s = duration_s
+                self.metrics.record(LatencyMetrics.STIMULATION_DURATION, duration_s)
+                if requested_duration_s is not None:
+                    self.metrics.record(LatencyMetrics.DURATION_ERROR, duration_s - requested_duration_s)
+                self._ml_running = False
+            if self.ml_session and self._ml_initialized:
+                self._call_in_io(self._schedule_session_keepalive)
 
-        if ret:
-            msg = 'Stimulation stopped successfully.'
-            if self.start_time is not None:
-                msg += f' Stimulation time: {time.perf_counter() - self.start_time:.5f} s'
+            if ret:
+                msg = 'Stimulation stopped successfully.'
+                if self.start_time is not None:
+                    msg += f' Stimulation time: {time.perf_counter() - self.start_time:.5f} s'
+                else:
+                    logging.warning('No start time recorded. '
+                                    'This should only occur if the stimulation was not started.')
+                logging.info(msg)
             else:
-                logging.warning('No start time recorded. This should only occur if the stimulation was not started.')
-            logging.info(msg)
-        else:
-            msg = "Failed to send stop signal to stimulator."
-            logging.error(msg)
-            messagebox.showerror(title='Stimulator Error', message=msg)
-            raise StimulatorError(msg)
+                msg = "Failed to send stop signal to stimulator."
+                logging.error(msg)
+                self._call_in_master(messagebox.showerror, 'Stimulator Error', msg)
+                raise StimulatorError(msg)
 
-        return ret
+            return ret
 
     def close_com_port(self):
-        """Close the COM port."""
-        ret = sm.smpt_close_serial_port(self.device)
+        """Close the COM port and shut down the threads which communicate with the device."""
+        with self._lock:
+            self._cancel_session_keepalive()
+            self._ml_initialized = False  # Also ends an ML session on the device
+        try:
+            ret = self.sm.smpt_close_serial_port(self.device)
+        finally:
+            self.shutdown()
         if ret:
             logging.info("Serial port has been closed successfully.")
         else:
@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Mapping, Optional
+
+from backend.io_scheduler import IOScheduler
+from backend.stimulator import Stimulator, StimulationParameters, StimulatorError
+
+
+@dataclass
+class DeviceHealth:
+    """The state of one device of a StimulatorPool.
+
+    Attributes:
+        port: The COM port of the device.
+        stimulating: Whether the device is currently stimulating.
+        keepalive_age_s: The time since the last keepalive was sent, or None if none was sent yet.
+        lost_acks: The number of acknowledgements of the device which didn't arrive in time.
+        channel_errors: The channels (1-8) on which the device has reported an error.
+    """
+    port: str
+    stimulating: bool
+    keepalive_age_s: Optional[float]
+    lost_acks: int
+    channel_errors: list[int] = field(default_factory=list)
+
+    @property
+    def healthy(self) -> bool:
+        keepalive_ok = not self.stimulating or (self.keepalive_age_s is not None and
+                                                self.keepalive_age_s < StimulatorPool.KEEPALIVE_DEADLINE_S)
+        return keepalive_ok and not self.channel_errors
+
+
+class StimulatorPool:
+    # The device stops stimulating if it doesn't receive a command within this time
+    KEEPALIVE_DEADLINE_S = 2.0
+    # How far in the future a synchronized start is scheduled, so all devices are started from the I/O thread
+    START_DELAY_S = 0.05
+
+    def __init__(self, master, backend=None, io_scheduler: Optional[IOScheduler] = None):
+        """Several stimulators whose keepalives and error polling all run on one I/O thread.
+        This lets one host run several sessions or stimulate on more than 8 channels:
+
+            pool = StimulatorPool(root)
+            pool.open(['COM5', 'COM6'])
+            pool.start({'COM5': [1, 2], 'COM6': [1]}, params, 5, on_termination, on_error)
+
+        :param master: The widget whose event loop the callbacks are called on.
+        :param backend: The module used to communicate with the devices. Defaults to the ScienceMode wrapper.
+        :param io_scheduler: The I/O thread of the devices. If not given, the pool creates (and shuts down) its own.
+        """
+        self.master = master
+        self.backend = backend
+        self._owns_io_scheduler = io_scheduler is None
+        self.io_scheduler = IOScheduler(name='StimulatorPoolIO') if io_scheduler is None else io_scheduler
+        self.stimulators: dict[str, Stimulator] = {}
+        self._channel_errors: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+        self._running_ports: set[str] = set()
+        self._start_callback = None  # The scheduled synchronized start
+        self.start_times: dict[str, float] = {}  # The start time of the last stimulation of each device
+
+    def open(self, ports: Iterable[str]):
+        """
+        Open and initialize a device on each port.
+        :raises SerialPortError: If a port can't be opened. The devices opened so far stay open.
+        """
+        for port in ports:
+            if port in self.stimulators:
+                raise StimulatorError(f'The port {port} is already open.')
+            stimulator = Stimulator(self.master, backend=self.backend, io_scheduler=self.io_scheduler)
+            try:
+                stimulator.initialize(port)
+            except Exception:
+                stimulator.shutdown()
+                raise
+            self.stimulators[port] = stimulator
+            self._channel_errors[port] = []
+
+    def start(self, channels: Mapping[str, Iterable[int]], stim_params: StimulationParameters, stim_duration_s: float,
+              on_termination: Callable[[], None], on_error: Callable[[str, Optional[int]], None]):
+        """
+        Start stimulating on several devices at the same time. If a device reports an error or can't be started, all
+        devices are stopped.
+        :param channels: The channels (1-8) to stimulate on by the port of the device.
+        :param stim_params: The pulse parameters for all channels.
+        :param stim_duration_s: How long the stimulation should go on for in seconds.
+        :param on_termination: Called on the Tk thread when the stimulation has terminated on all devices.
+        :param on_error: Called on the Tk thread with the port and channel if a device reports an error. The channel is
+        None if the device couldn't be started.
+        """
+        if self.stimulating:
+            raise StimulatorError('A stimulation is already running.')
+        unknown_ports = set(channels) - set(self.stimulators)
+        if unknown_ports:
+            raise StimulatorError(f'The ports {sorted(unknown_ports)} are not open.')
+
+        # Configure all devices first, so starting them only takes one ml_update each
+        for port, port_channels in channels.items():
+            for channel in port_channels:
+                self.stimulators[port].rectangular_pulse(channel, stim_params)
+        self.start_times = {}
+        with self._lock:
+            self._running_ports = set(channels)
+            self._start_callback = self.io_scheduler.call_at(time.perf_counter() + self.START_DELAY_S,
+                                                             self._start_all, list(channels), stim_duration_s,
+                                                             on_termination, on_error)
+
+    def _start_all(self, ports: list[str], stim_duration_s: float, on_termination: Callable[[], None],
+                   on_error: Callable[[str, Optional[int]], None]):
+        """Start the devices back to back. Runs on the I/O thread.
+        The lock is held while starting, so a concurrent stop() waits until all devices have been started and then
+        stops them."""
+        started_ports = []
+        with self._lock:
+            if self._start_callback is None:
+                return  # The pool was stopped after this was already due
+            self._start_callback = None
+            port = None
+            try:
+                for port in ports:
+                    self.stimulators[port].prepare_ml()
+                for port in ports:
+                    self._channel_errors[port] = []
+                    self.start_times[port] = self.stimulators[port].stimulate_ml(
+                        stim_duration_s,
+                        on_termination=lambda port=port: self._on_device_termination(port, on_termination),
+                        on_error=lambda channel, port=port: self._on_device_error(port, channel, on_error))
+                    started_ports.append(port)
+            except Exception:
+                logging.exception(f'Could not start the stimulation on {port}. Stopping all devices.')
+                self._running_ports.clear()
+                failed_port = port
+            else:
+                failed_port = None
+
+        if failed_port is None:
+            logging.info(f'Started stimulation on {len(ports)} devices. '
+                         f'Start skew: {self.start_skew_s() * 1000:.3f} ms')
+            return
+        for port in started_ports:
+            try:
+                self.stimulators[port].stop_stimulation()
+            except StimulatorError:
+                logging.exception(f'Could not stop the stimulation on {port}.')
+        self.stimulators[failed_port]._call_in_master(on_error, failed_port, None)
+
+    def _on_device_termination(self, port: str, on_termination: Callable[[], None]):
+        with self._lock:
+            self._running_ports.discard(port)
+            done = not self._running_ports
+        if done:
+            on_termination()
+
+    def _on_device_error(self, port: str, channel: int, on_error: Callable[[str, Optional[int]], None]):
+        self._channel_errors[port].append(channel)
+        self.stop()
+        on_error(port, channel)
+
+    @property
+    def stimulating(self) -> bool:
+        with self._lock:
+            return bool(self._running_ports)
+
+    def start_skew_s(self) -> float:
+        """The time between the first and the last device starting in the last stimulation."""
+        if not self.start_times:
+            return 0.0
+        return max(self.start_times.values()) - min(self.start_times.values())
+
+    def stop(self):
+        """Stop the stimulation on all devices."""
+        with self._lock:
+            ports = list(self._running_ports)
+            self._running_ports.clear()
+            start_callback, self._start_callback = self._start_callback, None
+        if start_callback is not None:
+            # The devices haven't been started yet. They're still stopped to reset their pulse configurations.
+            self.io_scheduler.after_cancel(start_callback)
+        for port in ports:
+            self.stimulators[port].stop_stimulation()
+
+    def health(self) -> dict[str, DeviceHealth]:
+        """The health of each device by its port."""
+        now = time.perf_counter()
+        with self._lock:
+            running_ports = set(self._running_ports)
+        health = {}
+        for port, stimulator in self.stimulators.items():
+            age = None if stimulator.last_keepalive_time is None else now - stimulator.last_keepalive_time
+            health[port] = DeviceHealth(port, port in running_ports, age, stimulator.ack_receiver.lost_acks,
+                                        list(self._channel_errors[port]))
+        return health
+
+    def close(self):
+        """Stop any stimulation and close all ports."""
+        self.stop()
+        for stimulator in self.stimulators.values():
+            stimulator.close_com_port()
+        self.stimulators.clear()
+        if self._owns_io_scheduler:
+            self.io_scheduler.shutdown()
@@ -0,0 +1,188 @@
+import logging
+from abc import ABC, abstractmethod
+from typing import Iterable, Mapping, Sequence
+
+import numpy as np
+
+
+class ThresholdEstimator(ABC):
+    """Chooses the amplitudes of the calibration from the intensities the participant reports.
+    ``next_amplitude()`` is the amplitude of the next stimulation or, once ``finished``, the calibrated amplitude."""
+
+    @property
+    @abstractmethod
+    def finished(self) -> bool:
+        ...
+
+    @abstractmethod
+    def next_amplitude(self) -> float:
+        ...
+
+    @abstractmethod
+    def update(self, amplitude_ma: float, intensity: str):
+        """Take the intensity the participant reported for a stimulation into account."""
+
+
+class StaircaseEstimator(ThresholdEstimator):
+    def __init__(self, increment_map: Mapping[str, float], start_ma: float, minimum_ma: float, maximum_ma: float):
+        """Adjusts the amplitude by a fixed increment per reported intensity. It's finished when the increment is 0.
+        :param increment_map: The amplitude increment in mA for each intensity.
+        :param start_ma: The amplitude of the first stimulation.
+        :param minimum_ma: The lowest amplitude.
+        :param maximum_ma: The highest amplitude."""
+        self.increment_map = increment_map
+        self.minimum_ma, self.maximum_ma = minimum_ma, maximum_ma
+        self._amplitude_ma = start_ma
+        self._finished = False
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def next_amplitude(self) -> float:
+        return self._amplitude_ma
+
+    def update(self, amplitude_ma: float, intensity: str):
+        try:
+            increment_ma = self.increment_map[intensity]
+        except KeyError:
+            raise ValueError(f"intensity should be in {list(self.increment_map.keys())} but is '{intensity}'.")
+
+        if increment_ma == 0.0:
+            # We've reached our target intensity
+            self._amplitude_ma = amplitude_ma
+            self._finished = True
+            return
+
+        # make sure it's in range
+        new_amplitude = float(np.clip(amplitude_ma + increment_ma, self.minimum_ma, self.maximum_ma))
+        if new_amplitude in [self.minimum_ma, self.maximum_ma]:
+            logging.info(f'Amplitude has reached its {"minimum" if new_amplitude == self.minimum_ma else "maximum"} '
+                         f'of {new_amplitude} mA.')
+        else:
+            logging.info(f'Increasing amplitude by {increment_ma} mA to {new_amplitude} mA')
+        self._amplitude_ma = new_amplitude
+
+
+class PsiEstimator(ThresholdEstimator):
+    STEP_MA = 0.5  # The amplitude resolution of the device. Thresholds and amplitudes are on this grid.
+    # The slopes of the posterior: how many intensity levels the sensation rises per mA
+    SLOPES = np.geomspace(0.25, 4.0, 15)
+    LEVEL_NOISE = 0.5  # The scale (in intensity levels) of the logistic noise of a reported intensity
+    # The probability of a response which doesn't depend on the amplitude
+    LAPSE_RATE = 0.02
+    CREDIBLE_MASS = 0.95  # The probability mass of the credible interval of the threshold
+    MAX_CREDIBLE_WIDTH_MA = 2.0  # The calibration is finished when the credible interval is this narrow
+    MAX_STIMULATIONS = 30
+    # The next amplitude is at most this much above the highest one so far, so the amplitude rises gradually
+    MAX_STEP_UP_MA = 3.0
+    # Amplitudes which are more likely than this to be reported as painful aren't stimulated
+    MAX_PAINFUL_PROBABILITY = 0.2
+
+    def __init__(self, intensities: Sequence[str], target_intensity: str, start_ma: float, minimum_ma: float,
+                 maximum_ma: float, painful_intensities: Iterable[str] = ('Painful',)):
+        """Adaptive threshold estimation with the psi method (Kontsevich & Tyler, 1999), generalized to the ordered
+        intensities the participant reports. The sensation level rises linearly with the amplitude; the threshold is
+        the amplitude at which half of the reports are the target intensity or stronger, and the slope is the number
+        of levels per mA. A posterior over threshold and slope is updated after every stimulation. The next amplitude
+        is the one whose expected posterior entropy is lowest, i.e. which is expected to give the most information.
+        :param intensities: The intensities from weakest to strongest.
+        :param target_intensity: The intensity the threshold is estimated for.
+        :param start_ma: The amplitude of the first stimulation.
+        :param minimum_ma: The lowest amplitude.
+        :param maximum_ma: The highest amplitude.
+        :param painful_intensities: Amplitudes at or above one reported with these intensities aren't used again."""
+        self.intensities = list(intensities)
+        self.painful_intensities = set(painful_intensities)
+        self._painful_indices = [self.intensities.index(intensity) for intensity in self.painful_intensities]
+        self.amplitudes = np.arange(minimum_ma, maximum_ma + self.STEP_MA / 2, self.STEP_MA)
+        # The thresholds are the same grid as the amplitudes
+        self.thresholds = self.amplitudes
+
+        # The probability of each intensity, indexed by amplitude, intensity, threshold, and slope.
+        # The probability of reporting intensity k or stronger is logistic in the level relative to the target.
+        level = (self.SLOPES[None, None, :] * (self.amplitudes[:, None, None] - self.thresholds[None, :, None]))
+        offsets = np.arange(1, len(self.intensities)) - self.intensities.index(target_intensity)
+        at_least = 1 / (1 + np.exp(-(level[:, None] - offsets[None, :, None, None]) / self.LEVEL_NOISE))
+        ones = np.ones_like(at_least[:, :1])
+        at_least = np.concatenate((ones, at_least, 0 * ones), axis=1)
+        self._p_intensity = (self.LAPSE_RATE / len(self.intensities) +
+                             (1 - self.LAPSE_RATE) * (at_least[:, :-1] - at_least[:, 1:]))
+
+        # Uniform prior over threshold and slope
+        self.posterior = np.full((self.thresholds.size, self.SLOPES.size), 1.0)
+        self.posterior /= self.posterior.sum()
+        self.n_stimulations = 0
+        self._highest_ma = start_ma  # The highest amplitude stimulated so far (or the start amplitude)
+        self._painful_ma = np.inf  # The lowest amplitude reported as painful
+        self._next_ma = float(self._snap(start_ma))
+
+    def _snap(self, amplitude_ma: float) -> float:
+        return self.amplitudes[np.abs(self.amplitudes - amplitude_ma).argmin()]
+
+    @property
+    def finished(self) -> bool:
+        return self.n_stimulations >= self.MAX_STIMULATIONS or (
+                self.n_stimulations > 0 and self.credible_interval_width() <= self.MAX_CREDIBLE_WIDTH_MA)
+
+    def next_amplitude(self) -> float:
+        if self.finished:
+            return self.threshold_estimate()
+        return self._next_ma
+
+    def threshold_marginal(self) -> np.ndarray:
+        return self.posterior.sum(axis=1)
+
+    def threshold_estimate(self) -> float:
+        """The posterior mean of the threshold on the amplitude grid, below any painful amplitude."""
+        estimate = self._snap(float(self.thresholds @ self.threshold_marginal()))
+        return float(min(estimate, self.amplitudes[self._allowed()].max(initial=self.amplitudes[0])))
+
+    def credible_interval_width(self) -> float:
+        """The width of the central credible interval of the threshold in mA."""
+        cdf = np.cumsum(self.threshold_marginal())
+        tail = (1 - self.CREDIBLE_MASS) / 2
+        lower = self.thresholds[np.searchsorted(cdf, tail)]
+        upper = self.thresholds[min(np.searchsorted(cdf, 1 - tail), self.thresholds.size - 1)]
+        return float(upper - lower)
+
+    def _allowed(self) -> np.ndarray:
+        """Which amplitudes may be stimulated next."""
+        return (self.amplitudes <= self._highest_ma + self.MAX_STEP_UP_MA) & (self.amplitudes < self._painful_ma)
+
+    def update(self, amplitude_ma: float, intensity: str):
+        try:
+            intensity_index = self.intensities.index(intensity)
+        except ValueError:
+            raise ValueError(f"intensity should be in {self.intensities} but is '{intensity}'.")
+        self.posterior *= self._p_intensity[np.abs(self.amplitudes - amplitude_ma).argmin(), intensity_index]
+        self.posterior /= self.posterior.sum()
+        self.n_stimulations += 1
+        self._highest_ma = max(self._highest_ma, amplitude_ma)
+        if intensity in self.painful_intensities:
+            self._painful_ma = min(self._painful_ma, amplitude_ma)
+        self._next_ma = self._most_informative_amplitude()
+        logging.info(f'Threshold estimate {self.threshold_estimate()} mA, credible interval width '
+                     f'{self.credible_interval_width()} mA, next amplitude {self._next_ma} mA')
+
+    def _most_informative_amplitude(self) -> float:
+        """The amplitude whose reported intensity is expected to leave the lowest posterior entropy."""
+        allowed = self._allowed()
+        # The unnormalized posteriors after each intensity for each amplitude
+        joint = self._p_intensity * self.posterior  # (amplitudes, intensities, thresholds, slopes)
+        p_intensity = joint.sum(axis=(2, 3))  # The probabilities of the intensities
+        allowed &= p_intensity[:, self._painful_indices].sum(axis=1) <= self.MAX_PAINFUL_PROBABILITY
+        if not allowed.any():
+            return float(self.amplitudes[0])
+        joint, p_intensity = joint[allowed], p_intensity[allowed]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            posteriors = joint / p_intensity[:, :, None, None]
+        expected_entropy = (self._entropy(posteriors) * p_intensity).sum(axis=1)
+        return float(self.amplitudes[allowed][expected_entropy.argmin()])
+
+    @staticmethod
+    def _entropy(distributions: np.ndarray) -> np.ndarray:
+        """The entropy of each distribution over the last two axes."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(distributions > 0, distributions * np.log(distributions), 0.0)
+        return -terms.sum(axis=(-2, -1))
@@ -0,0 +1,103 @@
+import math
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Waveform:
+    """The shape of a mid-level (ML) pulse. It's hashable, so it can be used as the key of the WaveformCache.
+
+    Attributes:
+        points: The (current in mA, time in µs) of each point of the pulse.
+        period_ms: The time between the starts of two pulses in ms.
+    """
+    points: tuple[tuple[float, int], ...]
+    period_ms: float
+
+    MAX_POINTS = 16  # The maximum number of points of a pulse
+    MAX_POINT_TIME_US = 4095  # The maximum duration of a point
+    MAX_CURRENT_MA = 150  # The maximum absolute current of the P24
+    # The remaining charge (in mA·µs) up to which a pulse counts as charge balanced
+    CHARGE_TOLERANCE = 1e-6
+
+    @classmethod
+    def rectangular(cls, amplitude_ma: float, phase_duration: int, interpulse_interval: int,
+                    period_ms: float) -> 'Waveform':
+        """A symmetric biphasic rectangular pulse: a positive phase, the interpulse interval, and a negative phase."""
+        return cls(((amplitude_ma, phase_duration), (0, interpulse_interval), (-amplitude_ma, phase_duration)),
+                   period_ms)
+
+    def charge(self) -> float:
+        """The net charge of a pulse in mA·µs."""
+        return sum(current * time_us for current, time_us in self.points)
+
+    def duration_us(self) -> int:
+        return sum(time_us for _, time_us in self.points)
+
+    def validate(self):
+        """
+        Check that the device can stimulate the pulse and that it's charge balanced.
+        :raises ValueError: If the pulse is invalid.
+        """
+        if not 1 <= len(self.points) <= self.MAX_POINTS:
+            raise ValueError(f'A pulse must have between 1 and {self.MAX_POINTS} points, not {len(self.points)}.')
+        for current, time_us in self.points:
+            if abs(current) > self.MAX_CURRENT_MA:
+                raise ValueError(f'The current of a point can be at most {self.MAX_CURRENT_MA} mA, not {current} mA.')
+            if not 0 <= time_us <= self.MAX_POINT_TIME_US:
+                raise ValueError(f'The time of a point must be between 0 and {self.MAX_POINT_TIME_US} µs, '
+                                 f'not {time_us} µs.')
+        if self.duration_us() > self.period_ms * 1000:
+            raise ValueError(f'The pulse takes {self.duration_us()} µs, which is longer than the period of '
+                             f'{self.period_ms} ms.')
+        if not math.isclose(self.charge(), 0, abs_tol=self.CHARGE_TOLERANCE):
+            raise ValueError(f'The pulse is not charge balanced. Its net charge is {self.charge()} mA·µs.')
+
+
+class WaveformCache:
+    DEFAULT_MAX_SIZE = 64
+
+    def __init__(self, backend, max_size: int = DEFAULT_MAX_SIZE):
+        """Compiles waveforms into ready-to-send ``Smpt_ml_channel_config`` structures and keeps the most recently
+        used ones. Each waveform is validated once when it's compiled.
+        :param backend: The ScienceMode module (or a simulation of it).
+        :param max_size: The number of compiled waveforms to keep. The least recently used one is evicted first."""
+        self.sm = backend
+        self.max_size = max_size
+        self._compiled: OrderedDict[Waveform, object] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._compiled)
+
+    def get(self, waveform: Waveform):
+        """
+        Get the compiled waveform.
+        :return: The ``Smpt_ml_channel_config*``. It's shared, so it must not be modified.
+        :raises ValueError: If the waveform is invalid.
+        """
+        config = self._compiled.get(waveform)
+        if config is not None:
+            self.hits += 1
+            self._compiled.move_to_end(waveform)
+            return config
+
+        self.misses += 1
+        config = self._compile(waveform)
+        self._compiled[waveform] = config
+        if len(self._compiled) > self.max_size:
+            self._compiled.popitem(last=False)
+        return config
+
+    def _compile(self, waveform: Waveform):
+        waveform.validate()
+        config = self.sm.ffi.new("Smpt_ml_channel_config*")
+        config.period = waveform.period_ms
+        config.number_of_points = len(waveform.points)
+        for point, (current, time_us) in zip(config.points, waveform.points):
+            point.current, point.time = current, time_us
+        return config
+
+    def clear(self):
+        self._compiled.clear()
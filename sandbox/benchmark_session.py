@@ -0,0 +1,247 @@
+# How long does the app take for a whole session, and how much CPU and memory does it need?
+# The experimenter window runs the calibration and sensory phase against a simulated stimulator, and a scripted
+# participant answers every screen of the participant window after a short reaction time. Per trial, it reports how
+# long the stimulation took to start once the countdown was over, how much longer than requested it was, how long
+# building the query screen took and how long after the stimulation it was interactive, and how long saving the
+# answers blocked the Tk thread. It also reports how long the writer thread took per record, and the CPU time and peak
+# memory of the whole session.
+# Tk needs a display. Without one, the session runs on a virtual display if Xvfb is installed.
+# Run from the project root: python -m sandbox.benchmark_session
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from tkinter import ttk
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from backend.latency_metrics import LatencyMetrics
+from backend.settings import Settings
+from backend.simulated_stimulator import SimulatedP24, SimulationConfig
+from backend.stimulation_order import StimulationOrder
+from widgets.evoked_sensations_frame import EvokedSensationsFrame
+from widgets.experimenter_window import ExperimenterWindow
+from widgets.phase_frames import EndOfBlockFrame, ExperimentCompletedFrame, InputIntensityFrame, TextAndButtonFrame
+
+# --- Inputs ---
+order_path = None  # A stimulation order, e.g. 'data/test_participant/stimulation_order.xlsx'. None generates one.
+n_blocks, n_trials_per_block = 10, 50  # The size of the generated order
+stim_duration_s = 0.1  # The shortest allowed duration
+countdown_duration_s = 0  # 0 skips the countdown screen
+break_duration_s = 0
+reaction_time_s = 0.02  # How long the participant looks at a screen before answering it
+max_sensations = 3  # The participant reports 0 to max_sensations sensations per trial
+detection_threshold_ma, level_width_ma = 3.0, 1.0  # The intensity the participant reports for an amplitude
+ack_latency_s = 0.002
+threaded_stimulation, stop_thread = False, True  # Like in app.py
+timeout_s = 3600  # The session is aborted after this
+csv_path = None  # Where to save the per-trial measurements. None doesn't save them.
+seed = 0
+
+
+def start_virtual_display() -> Optional[subprocess.Popen]:
+    """Start Xvfb if there's no display.
+    :return: The Xvfb process, or None if there's a display already."""
+    if os.environ.get('DISPLAY') or not sys.platform.startswith('linux'):
+        return None
+    if shutil.which('Xvfb') is None:
+        sys.exit('There is no display and Xvfb is not installed.')
+    display = ':99'
+    xvfb = subprocess.Popen(['Xvfb', display, '-screen', '0', '1920x1080x24', '-nolisten', 'tcp'])
+    os.environ['DISPLAY'] = display
+    time.sleep(1)  # Give it time to accept connections
+    return xvfb
+
+
+def last_value(metrics: LatencyMetrics, metric: str) -> float:
+    values = metrics.values(metric)
+    return values[-1] if len(values) > 0 else np.nan
+
+
+class ScriptedParticipant:
+    def __init__(self, window: ExperimenterWindow, rng: np.random.Generator, on_completed: Callable[[], None]):
+        """Answers the screens of the participant window and measures each trial. It polls the shown screen like a
+        participant looking at it, so it doesn't change how the app schedules its work."""
+        self.window, self.rng, self.on_completed = window, rng, on_completed
+        self.stimulator = window.stimulator
+        self.trials: list[dict] = []  # The measurements of each trial
+        self.write_times_s: list[float] = []  # How long the writer thread took for each record
+        self._frame = None  # The screen which is shown
+        self._shown_time = 0.0
+        self._answered = False
+        self._phase = None
+        self._stimulate_time = np.nan  # When the current trial's stimulation was requested
+
+    def start(self):
+        participant_data = self.window.participant_data
+        self._time_save(participant_data, 'update_calibration_data', 'calibration')
+        self._time_save(participant_data, 'update_sensation_data', 'sensory')
+        write_record = participant_data._write_record
+
+        def timed_write_record(*args):
+            start_time = time.perf_counter()
+            write_record(*args)
+            self.write_times_s.append(time.perf_counter() - start_time)
+
+        participant_data._write_record = timed_write_record
+        self._poll()
+
+    def _time_save(self, participant_data, method_name: str, phase_name: str):
+        """Replace a saving method of the participant data with one which records the trial."""
+        save = getattr(participant_data, method_name)
+
+        def timed_save(*args, **kwargs):
+            start_time = time.perf_counter()
+            save(*args, **kwargs)
+            save_s = time.perf_counter() - start_time
+            metrics = self.stimulator.metrics
+            self.trials.append({
+                'phase': phase_name,
+                'onset_s': self.stimulator.start_time - self._stimulate_time,
+                'duration_error_s': self.stimulator.last_stimulation_duration_s - stim_duration_s,
+                'query_build_s': last_value(metrics, LatencyMetrics.QUERY_BUILD),
+                'query_latency_s': last_value(metrics, LatencyMetrics.QUERY_LATENCY),
+                'save_s': save_s,
+            })
+
+        setattr(participant_data, method_name, timed_save)
+
+    def _time_stimulate(self, phase):
+        """Replace the stimulate method of a phase with one which notes when the stimulation was requested."""
+        stimulate = phase.stimulate
+
+        def timed_stimulate():
+            self._stimulate_time = time.perf_counter()
+            stimulate()
+
+        phase.stimulate = timed_stimulate
+
+    def _poll(self):
+        phase = self.window.participant_window.current_frame
+        if phase is not self._phase:
+            self._phase = phase
+            self._time_stimulate(phase)
+
+        now = time.perf_counter()
+        if phase.frame is not self._frame:
+            self._frame, self._shown_time, self._answered = phase.frame, now, False
+        elif not self._answered and now - self._shown_time >= reaction_time_s:
+            if isinstance(self._frame, ExperimentCompletedFrame):
+                self.on_completed()
+                return
+            self._answered = self._answer(self._frame)
+        self.window.after(1, self._poll)
+
+    def _answer(self, frame) -> bool:
+        """Answer the screen like a participant would.
+        :return: Whether it was answered. Some screens can only be answered after a while."""
+        if isinstance(frame, InputIntensityFrame):
+            intensity = self._intensity(Settings().amplitude.get())
+            radiobutton = next(button for button in descendants(frame) if isinstance(button, ttk.Radiobutton)
+                               and str(button.cget('value')) == intensity)
+            radiobutton.invoke()
+            frame.continue_button.invoke()
+        elif isinstance(frame, EvokedSensationsFrame):
+            for _ in range(self.rng.integers(max_sensations + 1)):
+                frame.add_sensation()
+                sensation = frame.sensations_frames[-1]
+                sensation.type_var.set(self.rng.choice(sensation.form.SENSATION_TYPES))
+                sensation.intensity_var.set(int(self.rng.choice(sensation.form.INTENSITY_OPTIONS)))
+                sensation.location_vars[self.rng.choice(sensation.form.LOCATIONS)].set(True)
+            frame.continue_button.invoke()
+        elif isinstance(frame, (TextAndButtonFrame, EndOfBlockFrame)):
+            button = next(button for button in descendants(frame) if isinstance(button, ttk.Button))
+            if button.instate(['disabled']):  # The break isn't over yet
+                return False
+            button.invoke()
+        else:  # e.g. the stimulation screen
+            return False
+        return True
+
+    @staticmethod
+    def _intensity(amplitude_ma: float) -> str:
+        """The participant feels the stimulation above the detection threshold and reports one level stronger per
+        level_width_ma."""
+        level = (amplitude_ma - detection_threshold_ma) / level_width_ma
+        index = 0 if level < 0 else int(min(np.floor(level) + 1, len(InputIntensityFrame.INTENSITY_OPTIONS) - 1))
+        return InputIntensityFrame.INTENSITY_OPTIONS[index]
+
+
+def descendants(widget):
+    for child in widget.winfo_children():
+        yield child
+        yield from descendants(child)
+
+
+def summarize(values_s) -> str:
+    values_ms = np.asarray(values_s, dtype=np.float64) * 1000
+    return (f'{np.nanmean(values_ms):>9.3f} {np.nanpercentile(values_ms, 50):>9.3f} '
+            f'{np.nanpercentile(values_ms, 99):>9.3f} {np.nanmax(values_ms):>9.3f}')
+
+
+def on_completed():
+    global completed
+    completed = True
+    window.on_stop_experiment()
+    window.quit()
+
+
+logging.basicConfig(level=logging.WARNING)
+completed = False
+xvfb = start_virtual_display()
+try:
+    window = ExperimenterWindow(threaded_stimulation, stop_thread,
+                                stimulator_backend=SimulatedP24(SimulationConfig(ack_latency_s=ack_latency_s,
+                                                                                 seed=seed)))
+    participant_folder = tempfile.TemporaryDirectory()
+    Settings().participant_folder_var.set(participant_folder.name)
+    Settings().stim_duration.set(stim_duration_s)
+    Settings.COUNTDOWN_DURATION = countdown_duration_s
+    Settings.BREAK_AFTER_BLOCK_DURATION_SEC = break_duration_s
+
+    if order_path is None:
+        stim_order = StimulationOrder.generate_new(n_blocks, n_trials_per_block, seed=seed)
+    else:
+        stim_order = StimulationOrder.from_file(order_path, use_cache=False)
+
+    participant = ScriptedParticipant(window, np.random.default_rng(seed), on_completed)
+    window.com_port_manager.open_port()
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    window.on_start_experiment(stim_order, resume=False)
+    participant.start()
+    window.after(timeout_s * 1000, window.quit)
+    window.mainloop()
+    wall_s = time.perf_counter() - start_time
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    window.com_port_manager.close_port()
+    window.destroy()
+    participant_folder.cleanup()
+finally:
+    if xvfb is not None:
+        xvfb.terminate()
+
+trials = pd.DataFrame(participant.trials)
+if csv_path is not None:
+    trials.to_csv(csv_path, index_label='trial')
+
+print(f'{"[ms]":<32} {"mean":>9} {"median":>9} {"p99":>9} {"max":>9}')
+for phase_name, phase_trials in trials.groupby('phase', sort=False):
+    print(f'--- {phase_name} phase: {len(phase_trials)} trials ---')
+    for column, label in [('onset_s', 'stimulation onset'), ('duration_error_s', 'stimulation end error'),
+                          ('query_build_s', 'query screen construction'),
+                          ('query_latency_s', 'query screen after stimulation'), ('save_s', 'saving (Tk thread)')]:
+        print(f'{label:<32} {summarize(phase_trials[column])}')
+print(f'{"writing a record (writer thread)":<32} {summarize(participant.write_times_s)}')
+
+cpu_s = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+# ru_maxrss is in kB on Linux and in bytes on macOS
+peak_rss_mb = usage_end.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+print(f'{"completed" if completed else "TIMED OUT"} after {wall_s:.1f} s: {len(stim_order)} sensory trials, '
+      f'CPU {cpu_s:.1f} s ({cpu_s / wall_s * 100:.1f} %), peak RSS {peak_rss_mb:.1f} MB')
@@ -0,0 +1,72 @@
+# How many simulated P24 devices can one process keep stimulating within the 2 s keepalive deadline?
+# All devices of a StimulatorPool share one I/O thread. Sending a command blocks for SEND_DURATION_S, like writing
+# to the serial port does, so the I/O thread gets busier with every device.
+# Run from the project root: python -m sandbox.benchmark_stimulator_pool
+import logging
+import threading
+import time
+
+from backend.io_scheduler import IOScheduler
+from backend.simulated_stimulator import SimulatedP24, SimulationConfig
+from backend.stimulator import StimulationParameters
+from backend.stimulator_pool import StimulatorPool
+
+# --- Inputs ---
+device_counts = [1, 2, 4, 8, 16, 32, 64, 128]
+stim_duration_s = 6  # long enough for a few keepalives
+SEND_DURATION_S = 0.002  # how long sending one command blocks
+ACK_LATENCY_S = 0.005
+ACK_JITTER_S = 0.003
+params = StimulationParameters(amplitude_ma=2.0, phase_duration=200, interpulse_interval=100, period_ms=20.0)
+
+
+def max_keepalive_gap_s(device) -> float:
+    """The longest time between two commands while the device was stimulating."""
+    start, end = device.stimulation_intervals[0] if device.stimulation_intervals else (0, 0)
+    times = [t for t, _, _ in device.sent_commands if start <= t <= end]
+    return max((b - a for a, b in zip(times, times[1:])), default=0.0)
+
+
+def run(n_devices: int) -> dict:
+    # The callbacks of the pool run on this thread instead of a Tk thread
+    master = IOScheduler(name='BenchmarkMain')
+    backend = SimulatedP24(SimulationConfig(ack_latency_s=ACK_LATENCY_S, ack_jitter_s=ACK_JITTER_S,
+                                            send_duration_s=SEND_DURATION_S, seed=0))
+    pool = StimulatorPool(master, backend=backend)
+    try:
+        pool.open([f'SIM{i}' for i in range(n_devices)])
+        terminated = threading.Event()
+        errors = []
+        cpu_start = time.process_time()
+        pool.start({port: [1] for port in pool.stimulators}, params, stim_duration_s, terminated.set,
+                   lambda port, channel: errors.append((port, channel)))
+        terminated.wait(stim_duration_s + 5)
+        cpu_s = time.process_time() - cpu_start
+
+        devices = [stimulator.device for stimulator in pool.stimulators.values()]
+        return {
+            'terminated': terminated.is_set(),
+            'errors': len(errors),
+            'timeouts': sum(device.keepalive_timeouts for device in devices),
+            'max_gap_s': max(max_keepalive_gap_s(device) for device in devices),
+            'skew_ms': pool.start_skew_s() * 1000,
+            'cpu_percent': cpu_s / stim_duration_s * 100,
+        }
+    finally:
+        pool.close()
+        master.shutdown()
+
+
+logging.basicConfig(level=logging.WARNING)
+print(f'{"devices":>8} {"timeouts":>9} {"max gap [s]":>12} {"start skew [ms]":>16} {"CPU [%]":>8}')
+sustained = 0
+for n in device_counts:
+    result = run(n)
+    print(f'{n:>8} {result["timeouts"]:>9} {result["max_gap_s"]:>12.3f} {result["skew_ms"]:>16.3f} '
+          f'{result["cpu_percent"]:>8.1f}')
+    if not result['terminated'] or result['timeouts'] or result['errors'] or \
+            result['max_gap_s'] >= StimulatorPool.KEEPALIVE_DEADLINE_S:
+        break
+    sustained = n
+print(f'One process sustains at least {sustained} devices within the {StimulatorPool.KEEPALIVE_DEADLINE_S} s '
+      f'keepalive deadline.')
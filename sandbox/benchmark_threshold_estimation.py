@@ -0,0 +1,79 @@
+# How many stimulations does the calibration need with the fixed staircase and with the adaptive psi estimation?
+# Both are run against the same simulated participants. A participant's sensation level rises linearly with the
+# amplitude above their detection threshold, with some noise per stimulation. The level is reported as one of the
+# intensity options. The target is the amplitude at which half of the responses are 'Very strong' or stronger.
+# The psi estimation is run with several widths of the credible interval at which it stops.
+# Run from the project root: python -m sandbox.benchmark_threshold_estimation
+import logging
+
+import numpy as np
+
+from backend.threshold_estimation import PsiEstimator
+from widgets.phase_frames import InputIntensityFrame
+from widgets.phases import CalibrationPhase
+
+# --- Inputs ---
+n_participants = 200
+start_ma = 2.0
+detection_threshold_range_ma = (1.0, 8.0)
+level_width_range_ma = (0.5, 1.5)  # The amplitude difference between two intensity levels
+level_noise = 0.5  # The standard deviation of the sensation level per stimulation
+max_stimulations = 100  # The staircase can oscillate forever
+credible_widths_ma = [1.0, 1.5, 2.0, 2.5]
+TARGET_LEVEL = InputIntensityFrame.INTENSITY_OPTIONS.index('Very strong')
+
+
+class SimulatedParticipant:
+    def __init__(self, rng: np.random.Generator):
+        self.rng = rng
+        self.detection_ma = rng.uniform(*detection_threshold_range_ma)
+        self.level_width_ma = rng.uniform(*level_width_range_ma)
+
+    def target_ma(self) -> float:
+        # The level is reported as 'Very strong' or stronger at or above TARGET_LEVEL - 1 (level 0 is 'Nothing')
+        return self.detection_ma + (TARGET_LEVEL - 1) * self.level_width_ma
+
+    def report(self, amplitude_ma: float) -> str:
+        level = (amplitude_ma - self.detection_ma) / self.level_width_ma + self.rng.normal(0, level_noise)
+        index = 0 if level < 0 else int(min(np.floor(level) + 1, len(InputIntensityFrame.INTENSITY_OPTIONS) - 1))
+        return InputIntensityFrame.INTENSITY_OPTIONS[index]
+
+
+def run(mode: str, participant: SimulatedParticipant) -> dict:
+    estimator = CalibrationPhase.create_estimator(mode, start_ma)
+    n_stimulations = n_painful = 0
+    while not estimator.finished and n_stimulations < max_stimulations:
+        amplitude = estimator.next_amplitude()
+        intensity = participant.report(amplitude)
+        estimator.update(amplitude, intensity)
+        n_stimulations += 1
+        n_painful += intensity == 'Painful'
+    return {'stimulations': n_stimulations, 'painful': n_painful, 'finished': estimator.finished,
+            'error_ma': estimator.next_amplitude() - participant.target_ma()}
+
+
+def run_all(mode: str) -> list[dict]:
+    rng = np.random.default_rng(0)  # The same participants for all modes
+    return [run(mode, SimulatedParticipant(rng)) for _ in range(n_participants)]
+
+
+logging.basicConfig(level=logging.WARNING)
+results = {'staircase': run_all('staircase')}
+default_width_ma = PsiEstimator.MAX_CREDIBLE_WIDTH_MA
+for width_ma in credible_widths_ma:
+    PsiEstimator.MAX_CREDIBLE_WIDTH_MA = width_ma
+    results[f'psi {width_ma} mA'] = run_all('psi')
+PsiEstimator.MAX_CREDIBLE_WIDTH_MA = default_width_ma
+
+print(f'{"mode":>14} {"stimulations":>13} {"p95":>5} {"unfinished":>11} {"painful":>8} {"|error| [mA]":>13} '
+      f'{"p95 |error|":>12}')
+for mode, runs in results.items():
+    stimulations = np.array([r['stimulations'] for r in runs])
+    errors = np.abs([r['error_ma'] for r in runs])
+    print(f'{mode:>14} {stimulations.mean():>13.1f} {np.percentile(stimulations, 95):>5.0f} '
+          f'{sum(not r["finished"] for r in runs):>11} {np.mean([r["painful"] for r in runs]):>8.2f} '
+          f'{errors.mean():>13.2f} {np.percentile(errors, 95):>12.2f}')
+staircase_mean = np.mean([r['stimulations'] for r in results['staircase']])
+psi_mean = np.mean([r['stimulations'] for r in results[f'psi {default_width_ma} mA']])
+print(f'With the default credible interval width of {default_width_ma} mA, the psi estimation needs '
+      f'{psi_mean - staircase_mean:+.1f} stimulations per calibration compared with the staircase.')
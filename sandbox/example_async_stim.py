@@ -0,0 +1,41 @@
+import asyncio
+import logging
+
+from backend.async_stimulator import AsyncStimulator, ChannelError
+from backend.stimulator import StimulationParameters
+
+logging.basicConfig(level=logging.DEBUG)
+
+# --- Inputs ---
+amplitude_mA: float = 5.0  # amplitude in mA
+frequency_Hz = 10  # frequency in Hz
+phase_duration = 100  # pulse width in microseconds
+# inter pulse width in microseconds: the time between the positive and negative phase of a pulse
+interphase_interval = 200
+stim_duration_s = 10  # stimulation duration in seconds
+channels = [1]  # channel numbers (1-8). Refer to labels on device.
+
+# --- Derived variables ---
+period_ms = (1 / frequency_Hz) * 1000
+
+# --- Variables ---
+port = "COM5"
+
+
+# --- The script ---
+# No Tk window is needed. The stimulation runs on the asyncio event loop.
+async def main():
+    stimulator = AsyncStimulator()
+    await stimulator.initialize(port)
+
+    params = StimulationParameters(amplitude_mA, phase_duration, interphase_interval, period_ms)
+    try:
+        duration_s = await stimulator.stimulate(channels, params, stim_duration_s)
+        print(f'Stimulation over after {duration_s:.3f} s')
+    except ChannelError as e:
+        print(f'error on channel {e.channel}')
+    finally:
+        await stimulator.close()
+
+
+asyncio.run(main())
@@ -0,0 +1,41 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class FakeMaster:
+    """A minimal stand-in for ``tk.Tk`` that provides ``after`` and ``after_cancel`` without a display. Like Tk, it can
+    be called from other threads, and the callbacks still run on the thread which calls run()."""
+
+    def __init__(self):
+        self._callbacks = []  # heap of (due time, sequence, identifier, func, args)
+        self._cancelled = set()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def after(self, ms: int, func=None, *args):
+        identifier = f'after#{next(self._counter)}'
+        with self._lock:
+            heapq.heappush(self._callbacks,
+                           (time.perf_counter() + ms / 1000, next(self._counter), identifier, func, args))
+        return identifier
+
+    def after_cancel(self, identifier):
+        with self._lock:
+            self._cancelled.add(identifier)
+
+    def run(self, timeout_s: float = 10.0, until=lambda: False):
+        """Run the scheduled callbacks in real time until ``until()`` is True or the timeout."""
+        end = time.perf_counter() + timeout_s
+        while not until() and time.perf_counter() < end:
+            with self._lock:
+                due = self._callbacks and self._callbacks[0][0] <= time.perf_counter()
+                if due:
+                    _, _, identifier, func, args = heapq.heappop(self._callbacks)
+                    cancelled = identifier in self._cancelled
+                    self._cancelled.discard(identifier)
+            if not due:
+                time.sleep(0.001)
+            elif not cancelled:
+                func(*args)
@@ -0,0 +1,75 @@
+import threading
+import time
+import unittest
+
+from backend.ack_receiver import AckReceiver, AckTimeoutError
+from backend.simulated_stimulator import SimulatedP24, SimulationConfig
+
+
+class TestAckReceiver(unittest.TestCase):
+    def setUp(self):
+        self.sm = SimulatedP24(SimulationConfig(ack_latency_s=0.005, seed=0))
+        self.device = self.sm.ffi.new('Smpt_device*')
+        self.receiver = AckReceiver(self.sm, self.device, threading.RLock())
+        self.addCleanup(self.receiver.shutdown)
+
+    def _send_get_current_data(self):
+        request = self.sm.ffi.new('Smpt_ml_get_current_data*')
+        request.packet_number = self.sm.smpt_packet_number_generator_next(self.device)
+        response = self.receiver.expect(self.sm.Smpt_Cmd_Ml_Get_Current_Data_Ack, request.packet_number)
+        self.sm.smpt_send_ml_get_current_data(self.device, request)
+        return request.packet_number, response
+
+    def test_overlapping_requests(self):
+        self.device.inject_channel_error(3)
+        requests = [self._send_get_current_data() for _ in range(5)]
+
+        for packet_number, response in requests:
+            ack = response.result(timeout=1)
+            self.assertEqual(ack.packet_number, packet_number)
+            self.assertEqual(ack.payload.channel_data.channel_state[2], self.sm.Smpt_Ml_Channel_State_Electrode_Error)
+        self.assertEqual(self.receiver.lost_acks, 0)
+
+    def test_callback_and_unexpected_acks(self):
+        called = threading.Event()
+        packet_number = self.sm.smpt_packet_number_generator_next(self.device)
+        self.receiver.expect(self.sm.Smpt_Cmd_Get_Extended_Version_Ack, packet_number,
+                             callback=lambda _response: called.set())
+        # Nobody waits for the acknowledgement of this command
+        self.sm.smpt_send_ml_init(self.device, self.sm.ffi.new('Smpt_ml_init*'))
+        self.sm.smpt_send_get_extended_version(self.device, packet_number)
+
+        self.assertTrue(called.wait(timeout=1))
+        self.assertEqual(self.receiver.unexpected_acks, 1)
+
+    def test_lost_ack(self):
+        self.sm.config.drop_probability = 1.0
+        packet_number, response = self._send_get_current_data()
+        with self.assertRaises(AckTimeoutError):
+            response.result(timeout=1)
+        self.assertEqual(self.receiver.lost_acks, 1)
+
+    def test_per_command_timeout(self):
+        self.sm.config.ack_latency_s = 0.05
+        packet_number = self.sm.smpt_packet_number_generator_next(self.device)
+        response = self.receiver.expect(self.sm.Smpt_Cmd_Get_Extended_Version_Ack, packet_number, timeout_s=0.01)
+        self.sm.smpt_send_get_extended_version(self.device, packet_number)
+        with self.assertRaises(AckTimeoutError):
+            response.result(timeout=1)
+
+    def test_woken_by_the_device(self):
+        self.sm.config.ack_latency_s = 0.05
+        poll_times = []
+        poll = self.receiver.poll
+
+        def recorded_poll():
+            poll_times.append(time.perf_counter())
+            poll()
+
+        self.receiver.poll = recorded_poll
+        send_time = time.perf_counter()
+        _, response = self._send_get_current_data()
+        response.result(timeout=1)
+        # The device isn't polled every millisecond. The receiver wakes up when the acknowledgement can be read.
+        self.assertEqual(len(poll_times), 1)
+        self.assertGreaterEqual(poll_times[0] - send_time, 0.05)
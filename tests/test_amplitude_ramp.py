@@ -0,0 +1,71 @@
+import unittest
+
+from backend.amplitude_ramp import AmplitudeRamp
+from backend.simulated_stimulator import SimulatedP24, SimulationConfig
+from backend.stimulator import Stimulator, StimulationParameters
+from tests.fake_master import FakeMaster
+
+STIM_PARAMS = StimulationParameters(amplitude_ma=2.0, phase_duration=700, interpulse_interval=500, period_ms=20.0)
+
+
+class TestAmplitudeRamp(unittest.TestCase):
+    def setUp(self):
+        self.master = FakeMaster()
+        self.stimulator = Stimulator(self.master, backend=SimulatedP24(SimulationConfig(ack_latency_s=0.002, seed=0)))
+        self.stimulator.initialize('SIM')
+        self.stimulator.open_ml_session()
+        self.reached_maximum = False
+        self.errors = []
+
+    def _start(self, maximum_ma: float) -> AmplitudeRamp:
+        # 0.5 mA every 50 ms
+        ramp = AmplitudeRamp(self.master, self.stimulator, 1, STIM_PARAMS, rate_ma_per_s=10.0, maximum_ma=maximum_ma)
+        ramp.HOLD_AT_MAXIMUM_S = 0.1
+        ramp.start(self._on_maximum, self.errors.append)
+        return ramp
+
+    def _on_maximum(self):
+        self.reached_maximum = True
+
+    def test_stop_records_applied_amplitude(self):
+        ramp = self._start(maximum_ma=20.0)
+        self.master.run(timeout_s=0.23)
+        marked = ramp.stop()
+        self.master.run(timeout_s=0.05)
+
+        self.assertFalse(ramp.running)
+        self.assertEqual(marked['amplitude_ma'], 4.0)
+        self.assertAlmostEqual(marked['ramp_time_s'], 0.23, delta=0.03)
+        device = self.stimulator.device
+        self.assertFalse(device.stimulating)
+        self.assertEqual(device.channel_configs[0].points[0].current, 4.0)
+        self.assertIsNone(ramp.stop())
+        self.assertFalse(self.reached_maximum)
+
+    def test_holds_maximum_and_ends(self):
+        ramp = self._start(maximum_ma=3.0)
+        self.assertAlmostEqual(ramp.duration_s(), 0.2)
+        self.master.run(until=lambda: self.reached_maximum)
+
+        self.assertTrue(self.reached_maximum)
+        self.assertFalse(ramp.running)
+        self.assertEqual(ramp.amplitude_ma, 3.0)
+        self.assertFalse(self.stimulator.device.stimulating)
+        self.assertEqual(self.errors, [])
+
+    def test_error_stops_ramp(self):
+        self.stimulator.device.inject_channel_error(1)
+        ramp = self._start(maximum_ma=20.0)
+        self.master.run(until=lambda: self.errors)
+        self.master.run(timeout_s=0.1)
+
+        self.assertEqual(self.errors, [1])
+        self.assertFalse(ramp.running)
+        self.assertLess(ramp.amplitude_ma, 20.0)
+
+    def test_comfortable_amplitude(self):
+        self.assertEqual(AmplitudeRamp.comfortable_amplitude(3.0, 6.0, 20.0), 5.5)
+        self.assertEqual(AmplitudeRamp.comfortable_amplitude(3.0, 3.0, 20.0), 3.0)  # Never below the detection
+        self.assertEqual(AmplitudeRamp.comfortable_amplitude(3.0, None, 20.0), 20.0)
+        # Without a detection, the maximum isn't a threshold
+        self.assertIsNone(AmplitudeRamp.comfortable_amplitude(None, None, 20.0))
@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+
+from backend.async_stimulator import AsyncStimulator, ChannelError
+from backend.simulated_stimulator import SimulatedP24
+from backend.stimulator import StimulationParameters
+
+STIM_PARAMS = StimulationParameters(amplitude_ma=2.0, phase_duration=700, interpulse_interval=500, period_ms=20.0)
+
+
+class TestAsyncStimulator(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.stimulator = AsyncStimulator(backend=SimulatedP24())
+        await self.stimulator.initialize('SIM')
+
+    async def test_stimulate(self):
+        duration_s = await self.stimulator.stimulate([1, 8], STIM_PARAMS, 0.2)
+        self.assertAlmostEqual(duration_s, 0.2, delta=0.05)
+        self.assertFalse(self.stimulator.stimulating)
+
+    async def test_channel_error(self):
+        self.stimulator.stimulator.device.inject_channel_error(8)
+        errors = self.stimulator.errors()
+        with self.assertRaises(ChannelError) as context:
+            await self.stimulator.stimulate([1, 8], STIM_PARAMS, 1.0)
+        self.assertEqual(context.exception.channel, 8)
+        self.assertEqual(await anext(errors), 8)
+
+    async def test_stop_and_get_current_data(self):
+        stimulation = self.stimulator.start([2], STIM_PARAMS, 5.0)
+        ack = await self.stimulator.get_current_data()
+        self.assertEqual(ack.command_number, self.stimulator.stimulator.sm.Smpt_Cmd_Ml_Get_Current_Data_Ack)
+
+        await self.stimulator.stop()
+        with self.assertRaises(asyncio.CancelledError):
+            await stimulation
+        self.assertFalse(self.stimulator.stimulator.device.stimulating)
+        await self.stimulator.close()
+
+    async def test_reopen(self):
+        await self.stimulator.close()
+        # Opening starts the helpers of the Stimulator again, this time in a worker thread
+        await self.stimulator.initialize('SIM')
+        duration_s = await self.stimulator.stimulate([1], STIM_PARAMS, 0.2)
+        self.assertAlmostEqual(duration_s, 0.2, delta=0.05)
+        await self.stimulator.close()
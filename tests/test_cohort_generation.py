@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+from itertools import pairwise
+
+import numpy as np
+import pandas as pd
+
+from backend.cohort_generation import (OrderConstraints, REPORT_FILE_NAME, apportion, balance_statistics,
+                                       balanced_latin_square, generate_cohort, generate_order)
+from backend.stimulation_order import StimulationOrder
+
+
+class TestCohortGeneration(unittest.TestCase):
+    def test_balanced_latin_square(self):
+        for n in [2, 3, 4, 5]:
+            rows = balanced_latin_square(n)
+            self.assertEqual(len(rows), n if n % 2 == 0 else 2 * n)
+            for row in rows:
+                self.assertEqual(sorted(row), list(range(n)))
+            # Every condition is at every position equally often
+            for position in range(n):
+                self.assertEqual(len({sum(row[position] == c for row in rows) for c in range(n)}), 1)
+            # Every condition directly follows every other one equally often
+            pairs = [pair for row in rows for pair in pairwise(row)]
+            self.assertEqual(len({pairs.count((a, b)) for a in range(n) for b in range(n) if a != b}), 1)
+
+    def test_apportion(self):
+        self.assertEqual(apportion({1: 4, 2: 1}, 8), {1: 6, 2: 2})
+        self.assertEqual(sum(apportion({1: 8, 2: 7, 3: 6}, 10).values()), 10)
+
+    def test_constraints(self):
+        constraints = OrderConstraints(n_blocks=4, n_trials_per_block=12, channels=tuple(range(1, 9)),
+                                       n_channels_weights={1: 3, 2: 2, 3: 1}, max_consecutive=1)
+        for participant_index in range(4):
+            so = generate_order(constraints, participant_index, seed=participant_index)
+            self.assertEqual(len(so), 48)
+            statistics = balance_statistics(so, constraints.channels)
+            self.assertLessEqual(statistics['max channel count difference in a block'], 1)
+            self.assertEqual(statistics['longest channel run'], 1)
+            # The two maps alternate, starting with the participant's row of the Latin square
+            self.assertEqual(statistics['map order'].split(', ')[0],
+                             constraints.map_ids[participant_index % 2])
+
+        # The default design: the two channels are stimulated equally often in every block
+        statistics = balance_statistics(generate_order(OrderConstraints(), 0, seed=0), StimulationOrder.CHANNELS)
+        self.assertEqual(statistics['max channel count difference in a block'], 0)
+        self.assertLessEqual(statistics['longest channel run'], 2)
+
+    def test_impossible_constraints(self):
+        with self.assertRaises(ValueError):
+            generate_order(OrderConstraints(max_consecutive=1), 0, seed=0)
+
+    def test_generate_cohort(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        participant_ids = ['p1', 'p2', 'p3', 'p4']
+        report = generate_cohort(directory.name, participant_ids, seed=3, max_workers=2)
+
+        self.assertEqual(report.index.tolist(), participant_ids)
+        self.assertEqual(report['map order'].value_counts().tolist(), [2, 2])
+        self.assertTrue(os.path.isfile(os.path.join(directory.name, REPORT_FILE_NAME)))
+        for index, participant_id in enumerate(participant_ids):
+            so = StimulationOrder.from_file(os.path.join(directory.name, participant_id, 'stimulation_order.xlsx'),
+                                            use_cache=False)
+            # The saved orders don't depend on the worker processes
+            pd.testing.assert_frame_equal(so.stim_order, generate_order(OrderConstraints(), index,
+                                                                        seed=participant_seed(3, index)).stim_order,
+                                          check_index_type=False)
+
+        with self.assertRaises(FileExistsError):
+            generate_cohort(directory.name, participant_ids, seed=3, max_workers=2)
+
+
+def participant_seed(seed: int, index: int):
+    """The seed generate_cohort uses for a participant."""
+    return np.random.SeedSequence(seed).spawn(index + 1)[index]
+
@@ -0,0 +1,88 @@
+import threading
+import unittest
+
+from backend.data_writer import DataWriter
+
+
+class TestDataWriter(unittest.TestCase):
+    def setUp(self):
+        self.statuses = []
+        self.writer = DataWriter(on_status=self.statuses.append)
+        self.addCleanup(self.writer.shutdown, 1.0)
+        self.written = []
+
+    def _block(self) -> threading.Event:
+        """Keep the writer busy until the returned event is set."""
+        release = threading.Event()
+        started = threading.Event()
+
+        def write():
+            started.set()
+            release.wait()
+
+        self.writer.submit(write)
+        started.wait()
+        return release
+
+    def test_order_and_coalescing(self):
+        release = self._block()
+        self.writer.submit(lambda: self.written.append('record 1'))
+        for snapshot in range(3):
+            self.writer.submit(lambda snapshot=snapshot: self.written.append(f'snapshot {snapshot}'), key='snapshot')
+        self.writer.submit(lambda: self.written.append('record 2'))
+        self.assertFalse(self.writer.flush(timeout_s=0.01))
+        release.set()
+
+        self.assertTrue(self.writer.flush(timeout_s=1.0))
+        self.assertEqual(self.written, ['record 1', 'snapshot 2', 'record 2'])
+        self.assertEqual(self.writer.coalesced_writes, 2)
+
+    def test_retry_until_success(self):
+        self.writer.INITIAL_BACKOFF_S = 0.01
+        attempts = []
+
+        def failing_write():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise OSError('Network drive not available')
+            self.written.append('record')
+
+        self.writer.submit(failing_write)
+        self.assertTrue(self.writer.flush(timeout_s=1.0))
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(self.written, ['record'])
+        self.assertEqual(len(self.statuses), 3)
+        self.assertIn('Network drive not available', self.statuses[0])
+        self.assertIsNone(self.statuses[-1])
+        self.assertIsNone(self.writer.error)
+
+    def test_full_queue_drops(self):
+        self.writer.max_pending = 2
+        release = self._block()
+        for record in range(3):
+            self.writer.submit(lambda record=record: self.written.append(f'record {record}'))  # Doesn't block
+        self.writer.submit(lambda: self.written.append('snapshot'), key='snapshot')  # Writes with a key are kept
+        self.assertEqual(self.writer.dropped_writes, 1)
+        self.assertIn('could not be queued', self.statuses[0])
+        release.set()
+
+        self.assertTrue(self.writer.flush(timeout_s=1.0))
+        self.assertEqual(self.written, ['record 0', 'record 1', 'snapshot'])
+        self.assertIsNone(self.writer.error)
+
+    def test_when_written(self):
+        release = self._block()
+        self.writer.submit(lambda: self.written.append('record'))
+        written = threading.Event()
+        threads = []
+        self.writer.when_written(lambda: (threads.append(threading.current_thread()),
+                                          self.written.append('callback'), written.set()))
+        self.assertFalse(self.writer.is_idle())
+        self.assertFalse(written.wait(0.01))
+        release.set()
+
+        self.assertTrue(written.wait(1.0))
+        self.assertEqual(self.written, ['record', 'callback'])
+        self.assertIsNot(threads[0], threading.main_thread())
+        self.assertTrue(self.writer.flush(timeout_s=1.0))
+        self.assertTrue(self.writer.is_idle())
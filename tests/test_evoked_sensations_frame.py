@@ -50,3 +50,31 @@ class TestEvokedSensationsFrame(unittest.TestCase):
         single_sense.type_var.set('Tingling')
         single_sense.location_vars['D1'].set(True)
         self.assertTrue(single_sense.all_inputs_filled())
+
+    def test_reuse(self):
+        es_frame = EvokedSensationsFrame(tk.Frame(), lambda _: None, 1, 2)
+        es_frame.add_sensation()
+        sensation = es_frame.sensations_frames[0]
+        sensation.type_var.set('Tingling')
+        sensation.location_vars['D1'].set(True)
+
+        # A removed sensation frame is reused with empty inputs
+        es_frame.remove_sensation(sensation)
+        es_frame.add_sensation()
+        self.assertIs(es_frame.sensations_frames[0], sensation)
+        self.assertEqual(sensation.get_sensation_data(), {'type': '', 'intensity': 0, 'locations': []})
+
+        # The frame is reused for the next trial
+        es_frame.reset(2, 2)
+        self.assertEqual(es_frame.sensations_frames, [])
+        self.assertEqual(es_frame.trial_number_label['text'], 'Durchgang 2 von 2')
+        self.assertEqual(str(es_frame.continue_button['state']), 'normal')
+
+    def test_toplevel_bound_once(self):
+        root = tk.Tk()
+        self.addCleanup(root.destroy)
+        frames = [EvokedSensationsFrame(root, lambda _: None, 1, 2) for _ in range(3)]
+        self.assertEqual(len(root.bind('<MouseWheel>').strip().splitlines()), 1)
+
+        frames[0].destroy()
+        self.assertEqual(set(EvokedSensationsFrame._toplevel_frames[root]), set(frames[1:]))
@@ -1,4 +1,6 @@
 import unittest
+
+from backend.simulated_stimulator import SimulatedP24, SimulationConfig
 from widgets import experimenter_window
 
 
@@ -30,7 +32,8 @@ class TestExperimenterWindow(unittest.TestCase):
         )
 
     def test_open_start_close(self):
-        ex = experimenter_window.ExperimenterWindow()
+        # The simulated stimulator doesn't need a device on a COM port
+        ex = experimenter_window.ExperimenterWindow(stimulator_backend=SimulatedP24(SimulationConfig(seed=0)))
         # open port > start > close port (stimulation should be stopped)
         ex.com_port_manager.open_port()
         ex.stimulation_buttons._on_start()
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image
+
+from backend.image_cache import ImageCache
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.images_dir = Path(directory.name) / 'images'
+        self.cache_dir = Path(directory.name) / 'cache'
+        os.makedirs(self.images_dir)
+        Image.new('RGB', (200, 100), 'red').save(self.images_dir / 'test.png')
+
+    def test_scaled_image(self):
+        cache = ImageCache(self.images_dir, self.cache_dir)
+        image = cache.scaled_image('test.png', 50)
+        self.assertEqual(image.size, (50, 25))
+        # Each width is only loaded once
+        self.assertIs(cache.scaled_image('test.png', 50), image)
+        self.assertEqual(cache.scaled_image('test.png', 80).size, (80, 40))
+        # On a screen with a higher resolution, the image is larger
+        self.assertEqual(cache.scaled_image('test.png', 50, scaling=1.5).size, (75, 38))
+        self.assertIs(cache.scaled_image('test.png', 50), image)
+
+    def test_disk_cache(self):
+        ImageCache(self.images_dir, self.cache_dir).scaled_image('test.png', 50)
+        cache_path = self.cache_dir / 'test_50.png'
+        self.assertTrue(cache_path.exists())
+
+        # A new cache reads the resized image instead of the original
+        Image.new('RGB', (50, 25), 'blue').save(cache_path)
+        self.assertEqual(ImageCache(self.images_dir, self.cache_dir).scaled_image('test.png', 50).getpixel((0, 0)),
+                         (0, 0, 255))
+
+        # It's resized again when the original is newer
+        mtime_ns = cache_path.stat().st_mtime_ns + 10 ** 9
+        os.utime(self.images_dir / 'test.png', ns=(mtime_ns, mtime_ns))
+        self.assertEqual(ImageCache(self.images_dir, self.cache_dir).scaled_image('test.png', 50).getpixel((0, 0)),
+                         (255, 0, 0))
+
+    def test_warm_up(self):
+        cache = ImageCache(self.images_dir, None)
+        cache.warm_up(['test.png', 'missing.png'], 50).join(timeout=5)
+        self.assertIn(('test.png', 50, 1.0), cache._images)
+        self.assertFalse(self.cache_dir.exists())
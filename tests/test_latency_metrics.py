@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from backend.latency_metrics import LatencyMetrics, RingBuffer
+from backend.simulated_stimulator import SimulatedP24, SimulationConfig
+from backend.stimulator import Stimulator, StimulationParameters
+from tests.fake_master import FakeMaster
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_wraparound(self):
+        buffer = RingBuffer(3)
+        for value in range(5):
+            buffer.append(value)
+        self.assertEqual(buffer.count, 5)
+        np.testing.assert_array_equal(buffer.values(), [2, 3, 4])
+        summary = buffer.summary()
+        self.assertEqual((summary['min'], summary['p50'], summary['max']), (2, 3, 4))
+
+    def test_empty(self):
+        self.assertEqual(RingBuffer(3).summary(), {'count': 0})
+
+
+class TestStimulatorMetrics(unittest.TestCase):
+    def test_stimulation_metrics(self):
+        master = FakeMaster()
+        stimulator = Stimulator(master, backend=SimulatedP24(SimulationConfig(ack_latency_s=0.003, seed=0)))
+        stimulator.initialize('SIM')
+        stimulator.rectangular_pulse(1, StimulationParameters(2.0, 700, 500, 20.0))
+        terminated = []
+        stimulator.stimulate_ml(1.8, lambda: terminated.append(True), print)
+        master.run(until=lambda: terminated)
+        master.run(timeout_s=0.05)  # Let the stop acknowledgement arrive
+
+        metrics = stimulator.metrics
+        for metric in (LatencyMetrics.RTT_ML_INIT, LatencyMetrics.RTT_ML_UPDATE,
+                       LatencyMetrics.RTT_ML_GET_CURRENT_DATA, LatencyMetrics.RTT_ML_STOP):
+            rtt = metrics.values(metric)
+            self.assertGreater(rtt.size, 0, metric)
+            self.assertTrue(np.all((rtt >= 0.003) & (rtt < 0.05)), metric)
+        self.assertAlmostEqual(metrics.values(LatencyMetrics.KEEPALIVE_INTERVAL).max(), 1.0, delta=0.05)
+        self.assertTrue(np.all(metrics.values(LatencyMetrics.KEEPALIVE_LATENESS) < 0.05))
+        self.assertAlmostEqual(metrics.values(LatencyMetrics.STIMULATION_DURATION)[0], 1.8, delta=0.05)
+        self.assertLess(abs(metrics.values(LatencyMetrics.DURATION_ERROR)[0]), 0.05)
+        self.assertEqual(metrics.values(LatencyMetrics.STOP_LATENCY).size, 1)
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'stimulator_timing.json')
+            metrics.dump(path)
+            with open(path) as file:
+                dumped = json.load(file)
+        self.assertEqual(dumped['metrics'][LatencyMetrics.RTT_ML_UPDATE]['summary']['count'], 1)
@@ -0,0 +1,130 @@
+import time
+import unittest
+
+import numpy as np
+
+from backend.ll_streamer import LowLevelStreamer
+from backend.simulated_stimulator import SimulatedP24, SimulationConfig
+from backend.stimulator import Stimulator, StimulationParameters
+from tests.fake_master import FakeMaster
+
+
+class TestLowLevelStreamer(unittest.TestCase):
+    ACK_LATENCY_S = 0.001
+
+    def setUp(self):
+        self.master = FakeMaster()
+        self.stimulator = Stimulator(self.master,
+                                     backend=SimulatedP24(SimulationConfig(ack_latency_s=self.ACK_LATENCY_S, seed=0)))
+        self.stimulator.initialize('SIM')
+        self.addCleanup(self.stimulator.close_com_port)
+        self.terminated = False
+        self.error_channels = []
+
+    def _stimulate(self, channels, params: StimulationParameters, duration_s: float):
+        streamer = self.stimulator.stimulate_ll(channels, params, duration_s, self._on_termination,
+                                                self.error_channels.append)
+        self.master.run(until=lambda: self.terminated or self.error_channels)
+        return streamer
+
+    def _on_termination(self):
+        self.terminated = True
+
+    def _record_polls(self) -> list[float]:
+        """Record when the ack receiver polls the device. It's woken up for every acknowledgement, which arrive every
+        millisecond while pulses are outstanding, no matter how the flow control behaves. So a longer gap means that the
+        test machine didn't run its thread.
+        :return: The list the poll times are appended to."""
+        poll_times = []
+        poll = self.stimulator.ack_receiver.poll
+
+        def recorded_poll():
+            poll_times.append(time.perf_counter())
+            poll()
+
+        self.stimulator.ack_receiver.poll = recorded_poll
+        return poll_times
+
+    def test_1000_hz(self):
+        params = StimulationParameters(amplitude_ma=2.0, phase_duration=100, interpulse_interval=100, period_ms=1.0)
+        poll_times = self._record_polls()
+        streamer = self._stimulate([1], params, 0.5)
+
+        self.assertTrue(self.terminated)
+        # An acknowledgement arrives ACK_LATENCY_S after its pulse, when the other buffered pulses still take
+        # (BUFFER_SIZE - 1) periods. If the receiver thread doesn't run for that long, the buffer runs empty whatever
+        # the flow control does.
+        max_stall_s = (LowLevelStreamer.BUFFER_SIZE - 1) * params.period_ms / 1000 - self.ACK_LATENCY_S
+        max_poll_gap_s = float(np.diff(poll_times).max())
+        if max_poll_gap_s > max_stall_s:
+            self.skipTest(f'The ack receiver thread was stalled for {max_poll_gap_s * 1000:.1f} ms.')
+        stats = streamer.stats
+        self.assertEqual(stats.requested_pulses, 500)
+        self.assertEqual(stats.acknowledged_pulses, 500)
+        self.assertEqual(stats.underruns, 0)
+        device = self.stimulator.device
+        self.assertEqual(device.ll_underruns, 0)
+        self.assertEqual(device.ll_overflows, 0)
+        starts = [start for start, _ in device.ll_pulses]
+        self.assertAlmostEqual((starts[-1] - starts[0]) / (len(starts) - 1), 0.001, delta=1e-6)
+        self.assertAlmostEqual(stats.achieved_rate_hz(), 1000, delta=50)
+
+    def test_interleaved_channels(self):
+        params = StimulationParameters(amplitude_ma=2.0, phase_duration=200, interpulse_interval=100, period_ms=2.0)
+        streamer = self._stimulate([1, 6], params, 0.1)
+
+        self.assertTrue(self.terminated)
+        self.assertEqual(streamer.stats.acknowledged_pulses, 100)
+        channels = [channel for _, channel in self.stimulator.device.ll_pulses]
+        self.assertEqual(channels[:4], [1, 6, 1, 6])
+
+    def test_host_timed(self):
+        params = StimulationParameters(amplitude_ma=2.0, phase_duration=300, interpulse_interval=100, period_ms=100.0)
+        streamer = self._stimulate([2], params, 0.5)
+
+        self.assertFalse(streamer.device_timed)
+        self.assertTrue(self.terminated)
+        self.assertEqual(streamer.stats.acknowledged_pulses, 5)
+        starts = [start for start, _ in self.stimulator.device.ll_pulses]
+        self.assertAlmostEqual((starts[-1] - starts[0]) / 4, 0.1, delta=0.01)
+
+    def test_electrode_error(self):
+        params = StimulationParameters(amplitude_ma=2.0, phase_duration=100, interpulse_interval=100, period_ms=1.0)
+        self.stimulator.device.inject_channel_error(3, after_s=0.05)
+        streamer = self._stimulate([3], params, 1.0)
+
+        self.assertFalse(self.terminated)
+        self.assertEqual(self.error_channels, [3])
+        self.assertFalse(streamer.running)
+        self.assertLess(len(self.stimulator.device.ll_pulses), 100)
+
+    def test_stop(self):
+        params = StimulationParameters(amplitude_ma=2.0, phase_duration=100, interpulse_interval=100, period_ms=1.0)
+        streamer = self.stimulator.stimulate_ll([1], params, 1.0, self._on_termination, self.error_channels.append)
+        self.master.run(timeout_s=0.1)
+        self.assertTrue(self.stimulator.stop_stimulation())
+
+        self.assertFalse(streamer.running)
+        self.assertFalse(self.stimulator.device.ll_initialized)
+        self.master.run(timeout_s=0.05)
+        self.assertFalse(self.terminated)
+
+    def test_ml_after_ll(self):
+        params = StimulationParameters(amplitude_ma=2.0, phase_duration=100, interpulse_interval=100, period_ms=1.0)
+        self._stimulate([1], params, 0.05)
+        self.assertTrue(self.terminated)
+
+        # The finished LL stimulation mustn't keep the ML stimulation from being stopped
+        self.terminated = False
+        self.stimulator.rectangular_pulse(1, params)
+        start_time = self.stimulator.stimulate_ml(0.3, self._on_termination, self.error_channels.append)
+        self.master.run(until=lambda: self.terminated)
+
+        self.assertTrue(self.terminated)
+        self.assertFalse(self.stimulator.device.stimulating)
+        self.assertAlmostEqual(time.perf_counter() - start_time, 0.3, delta=0.05)
+
+    def test_pulse_too_long(self):
+        params = StimulationParameters(amplitude_ma=2.0, phase_duration=500, interpulse_interval=100, period_ms=1.0)
+        with self.assertRaises(ValueError):
+            self.stimulator.stimulate_ll([1], params, 1.0, self._on_termination, self.error_channels.append)
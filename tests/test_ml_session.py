@@ -0,0 +1,110 @@
+import unittest
+
+from backend.simulated_stimulator import SimulatedP24, SimulationConfig
+from backend.stimulator import Stimulator, StimulationParameters
+from tests.fake_master import FakeMaster
+
+STIM_PARAMS = StimulationParameters(amplitude_ma=2.0, phase_duration=700, interpulse_interval=500, period_ms=20.0)
+
+
+class TestMlSession(unittest.TestCase):
+    def setUp(self):
+        self.master = FakeMaster()
+        self.sm = SimulatedP24(SimulationConfig(ack_latency_s=0.002, seed=0))
+        self.stimulator = Stimulator(self.master, backend=self.sm)
+        self.stimulator.initialize('SIM')
+        self.terminated = 0
+        self.error_channels = []
+
+    def _on_termination(self):
+        self.terminated += 1
+
+    def _stimulate(self, duration_s: float, channel: int = 1):
+        self.stimulator.rectangular_pulse(channel, STIM_PARAMS)
+        terminated = self.terminated
+        self.stimulator.stimulate_ml(duration_s, self._on_termination, self.error_channels.append)
+        self.master.run(until=lambda: self.terminated > terminated or self.error_channels)
+
+    def _count(self, command_number: int) -> int:
+        return sum(1 for _, number, _ in self.stimulator.device.sent_commands if number == command_number)
+
+    def test_initialized_once(self):
+        self.stimulator.open_ml_session()
+        for _ in range(3):
+            self._stimulate(0.1)
+        self.stimulator.close_ml_session()
+
+        self.assertEqual(self.terminated, 3)
+        self.assertEqual(self._count(self.sm.Smpt_Cmd_Ml_Init), 1)
+        self.assertEqual(self._count(self.sm.Smpt_Cmd_Ml_Stop), 1)
+        self.assertEqual(len(self.stimulator.device.stimulation_intervals), 3)
+        for start, end in self.stimulator.device.stimulation_intervals:
+            self.assertAlmostEqual(end - start, 0.1, delta=0.005)
+
+    def test_without_session(self):
+        for _ in range(2):
+            self._stimulate(0.1)
+        self.assertEqual(self._count(self.sm.Smpt_Cmd_Ml_Init), 2)
+        self.assertEqual(self._count(self.sm.Smpt_Cmd_Ml_Stop), 2)
+
+    def test_coalesced_live_update(self):
+        self.stimulator.open_ml_session()
+        self.stimulator.rectangular_pulse(1, STIM_PARAMS)
+        self.stimulator.stimulate_ml(0.3, self._on_termination, self.error_channels.append)
+        self.master.run(timeout_s=0.05)
+        updates_before = self._count(self.sm.Smpt_Cmd_Ml_Update)
+
+        for amplitude in (3.0, 3.5, 4.0):
+            self.stimulator.rectangular_pulse(2, StimulationParameters(amplitude, 700, 500, 20.0))
+            self.stimulator.update_ml()
+        self.stimulator.disable_channel(1)
+        self.stimulator.update_ml()
+        self.master.run(timeout_s=0.05)
+
+        self.assertEqual(self._count(self.sm.Smpt_Cmd_Ml_Update), updates_before + 1)
+        self.assertEqual(self.stimulator.coalesced_updates, 3)
+        device = self.stimulator.device
+        self.assertEqual(device.enabled_channels[:2], [False, True])
+        self.assertEqual(device.channel_configs[1].points[0].current, 4.0)
+        self.assertTrue(device.stimulating)
+
+        self.master.run(until=lambda: self.terminated)
+        self.assertEqual(len(device.stimulation_intervals), 1)
+
+    def test_error_reinitializes(self):
+        self.stimulator.open_ml_session()
+        self.stimulator.device.inject_channel_error(1)
+        self._stimulate(0.5)
+        self.assertEqual(self.error_channels, [1])
+        self.assertEqual(self._count(self.sm.Smpt_Cmd_Ml_Stop), 1)
+
+        self.stimulator.device.clear_channel_errors()
+        self.error_channels.clear()
+        self._stimulate(0.1)
+        self.assertEqual(self.terminated, 1)
+        self.assertEqual(self._count(self.sm.Smpt_Cmd_Ml_Init), 2)
+
+    def test_idle_session_kept_alive(self):
+        self.sm.config.keepalive_timeout_s = 0.3
+        self.stimulator.KEEPALIVE_INTERVAL_S = 0.1
+        self.stimulator.open_ml_session()
+        self._stimulate(0.1)
+        self.master.run(timeout_s=0.6)  # Longer than the device waits for a command
+
+        self._stimulate(0.1)
+        self.assertEqual(self.terminated, 2)
+        self.assertEqual(self._count(self.sm.Smpt_Cmd_Ml_Init), 1)
+        self.assertEqual(len(self.stimulator.device.stimulation_intervals), 2)
+
+    def test_timed_out_session_reinitializes(self):
+        self.sm.config.keepalive_timeout_s = 0.2
+        self.stimulator.ML_TIMEOUT_S = 0.15
+        self.stimulator.open_ml_session()
+        self._stimulate(0.1)
+        # The keepalive of the session comes too late, so the device de-initializes ML
+        self.master.run(timeout_s=0.3)
+
+        self._stimulate(0.1)
+        self.assertEqual(self.terminated, 2)
+        self.assertEqual(self._count(self.sm.Smpt_Cmd_Ml_Init), 2)
+        self.assertEqual(len(self.stimulator.device.stimulation_intervals), 2)
@@ -0,0 +1,106 @@
+import json
+import os
+import tempfile
+import unittest
+
+from backend.journal import Journal
+from backend.participant_data import ParticipantData
+from backend.stimulation_order import TrialInfo
+
+
+def close_journal(participant_data: ParticipantData):
+    """Close the journal without compacting, which needs the Settings."""
+    participant_data.writer.submit(participant_data._close_journal)
+    participant_data.writer.shutdown()
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'participant_data.jsonl')
+
+    def _write_data(self) -> ParticipantData:
+        participant_data = ParticipantData(self.path)
+        participant_data.update_calibration_data(2.0, 'Nothing')
+        participant_data.update_calibration_data(5.0, 'Very strong', ramp_time_s=3.0)
+        participant_data.update_calibrated_amplitude(5.0)
+        for overall_trial in (1, 2):
+            trial_info = TrialInfo(overall_trial, 1, overall_trial, [1, 8], 'A', [(1, 2), (7, 8)])
+            participant_data.update_sensation_data(trial_info, [{'type': 'Tingling', 'intensity': 3}], 5.001)
+        close_journal(participant_data)
+        return participant_data
+
+    def test_reconstruct(self):
+        written = self._write_data()
+        with open(self.path) as file:
+            self.assertEqual(len(file.readlines()), 5)
+
+        read = ParticipantData.from_journal(self.path)
+        close_journal(read)
+        self.assertEqual(read.calibration_data, written.calibration_data)
+        self.assertEqual(json.dumps(read.sensation_data), json.dumps(written.sensation_data))
+        self.assertEqual(list(read.sensation_data), [1, 2])
+        self.assertEqual(read.calibrated_amplitude_ma, 5.0)
+
+    def test_completed(self):
+        self._write_data()
+        self.assertFalse(ParticipantData.session_completed(self.path))
+
+        participant_data = ParticipantData.from_journal(self.path)
+        participant_data.mark_completed()
+        close_journal(participant_data)
+        self.assertTrue(ParticipantData.session_completed(self.path))
+        read = ParticipantData.from_journal(self.path)
+        close_journal(read)
+        self.assertTrue(read.completed)
+
+    def test_legacy_files(self):
+        directory = os.path.dirname(self.path)
+        calibration_path = os.path.join(directory, 'calibration_data.json')
+        sensation_path = os.path.join(directory, 'sensation_data.json')
+        self.assertFalse(ParticipantData.has_legacy_data(self.path, calibration_path, sensation_path))
+        written = self._write_data()
+        with open(calibration_path, 'w') as file:
+            json.dump(written.calibration_data, file)
+        with open(sensation_path, 'w') as file:
+            json.dump(written.sensation_data, file)
+        self.assertFalse(ParticipantData.has_legacy_data(self.path, calibration_path, sensation_path))
+        os.remove(self.path)
+        self.assertTrue(ParticipantData.has_legacy_data(self.path, calibration_path, sensation_path))
+
+        converted = ParticipantData.from_legacy_files(self.path, calibration_path, sensation_path)
+        close_journal(converted)
+        self.assertEqual(list(converted.sensation_data), [1, 2])
+        self.assertFalse(ParticipantData.has_legacy_data(self.path, calibration_path, sensation_path))
+        read = ParticipantData.from_journal(self.path)
+        close_journal(read)
+        self.assertEqual(read.calibration_data, written.calibration_data)
+        self.assertEqual(json.dumps(read.sensation_data), json.dumps(written.sensation_data))
+
+    def test_truncated_last_line(self):
+        self._write_data()
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        with open(self.path, 'wb') as file:
+            file.write(content[:-20])  # The last line is incomplete
+
+        records, valid_size = Journal.read(self.path)
+        self.assertEqual(len(records), 4)
+        self.assertEqual(valid_size, content.rindex(b'\n', 0, len(content) - 1) + 1)
+
+        # Appending continues after the last complete line
+        participant_data = ParticipantData.from_journal(self.path)
+        self.assertEqual(len(participant_data.sensation_data), 1)
+        participant_data.update_sensation_data(TrialInfo(2, 1, 2, [1], 'A', [(1, 2)]), [])
+        close_journal(participant_data)
+        self.assertEqual(len(Journal.read(self.path)[0]), 5)
+
+    def test_invalid_line(self):
+        self._write_data()
+        with open(self.path, 'rb') as file:
+            lines = file.read().split(b'\n')
+        with open(self.path, 'wb') as file:
+            file.write(b'\n'.join([lines[0], b'{"type"', *lines[2:]]))
+        with self.assertRaises(ValueError):
+            Journal.read(self.path)
@@ -0,0 +1,33 @@
+import unittest
+import tkinter as tk
+
+from backend.latency_metrics import LatencyMetrics
+from backend.locale_manager import LocaleManager
+from backend.simulated_stimulator import SimulatedP24
+from backend.stimulator import Stimulator
+from widgets.phases import _BasePhase
+
+LocaleManager().set_locale('English')
+
+
+class _PhaseWithoutQuery(_BasePhase):
+    def __init__(self, master, stimulator: Stimulator):
+        super().__init__(master, stimulator, participant_data=None)
+        self.continued = 0
+
+    def on_continue_after_querying(self):
+        self.continued += 1
+
+
+class TestBasePhase(unittest.TestCase):
+    def test_query_without_frame(self):
+        root = tk.Tk()
+        self.addCleanup(root.destroy)
+        stimulator = Stimulator(root, backend=SimulatedP24())
+        phase = _PhaseWithoutQuery(root, stimulator)
+
+        phase.query_after_stimulation()
+        root.update()
+        self.assertEqual(phase.continued, 1)
+        self.assertIsNone(phase.frame)
+        self.assertEqual(len(stimulator.metrics.values(LatencyMetrics.QUERY_LATENCY)), 0)
@@ -0,0 +1,71 @@
+import unittest
+
+from backend.sensation_form import SensationForm
+
+
+class TestSensationForm(unittest.TestCase):
+    def setUp(self):
+        self.changes = []
+        self.form = SensationForm(on_complete_change=self.changes.append)
+
+    def fill(self, entry, sensation_type='Tingling', intensity=3, location='D1'):
+        self.form.set_type(entry, sensation_type)
+        self.form.set_intensity(entry, intensity)
+        self.form.set_location(entry, location, True)
+
+    def test_completeness(self):
+        self.assertTrue(self.form.complete)
+        first = self.form.add()
+        self.assertFalse(self.form.complete)
+        self.assertEqual(self.changes, [False])
+
+        self.form.set_type(first, 'Tingling')
+        self.form.set_intensity(first, 3)
+        self.assertFalse(first.complete)
+        self.form.set_location(first, 'Calf', True)
+        self.assertTrue(self.form.complete)
+
+        second = self.form.add()
+        self.fill(second)
+        self.form.set_location(second, 'D1', False)
+        self.assertEqual(self.form.n_incomplete, 1)
+        self.form.set_location(second, 'Shin', True)
+        self.assertEqual(self.form.n_incomplete, 0)
+
+        # Unsetting an input makes it incomplete again
+        self.form.set_type(first, '')
+        self.assertFalse(self.form.complete)
+        self.form.remove(first)
+        self.assertTrue(self.form.complete)
+        self.assertEqual(self.changes, [False, True, False, True, False, True, False, True])
+
+        self.form.remove(second)
+        self.assertTrue(self.form.complete)
+        self.assertEqual(self.form.entries, [])
+
+    def test_invalid_inputs_are_unset(self):
+        entry = self.form.add()
+        self.fill(entry)
+        self.form.set_intensity(entry, 11)
+        self.assertEqual(entry.intensity, 0)
+        self.form.set_intensity(entry, 10)
+        self.form.set_type(entry, 'Unknown')
+        self.assertEqual(entry.type_index, -1)
+        self.assertFalse(self.form.complete)
+
+    def test_data(self):
+        entry = self.form.add()
+        self.assertEqual(self.form.entry_data(entry), {'type': '', 'intensity': 0, 'locations': []})
+        self.fill(entry, 'Heat', 7, 'Shin')
+        self.form.set_location(entry, 'D2', True)
+        self.fill(self.form.add(), 'Touch', 1, 'S5')
+        # The locations are in the order of LOCATIONS
+        self.assertEqual(self.form.data(), [{'type': 'Heat', 'intensity': 7, 'locations': ['D2', 'Shin']},
+                                            {'type': 'Touch', 'intensity': 1, 'locations': ['S5']}])
+
+    def test_many_entries(self):
+        entries = [self.form.add() for _ in range(1000)]
+        for entry in entries:
+            self.fill(entry)
+        self.assertTrue(self.form.complete)
+        self.assertEqual(self.changes, [False, True])
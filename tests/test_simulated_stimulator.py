@@ -0,0 +1,227 @@
+import threading
+import time
+import unittest
+
+from backend.io_scheduler import IOScheduler, MainThreadDispatcher
+from backend.simulated_stimulator import SimulatedP24, SimulationConfig
+from backend.stimulator import Stimulator, StimulationParameters, SerialPortError
+from tests.fake_master import FakeMaster
+
+STIM_PARAMS = StimulationParameters(amplitude_ma=2.0, phase_duration=700, interpulse_interval=500, period_ms=20.0)
+
+
+class _VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSimulatedStimulator(unittest.TestCase):
+    def setUp(self):
+        self.master = FakeMaster()
+        self.stimulator = Stimulator(self.master, backend=SimulatedP24(SimulationConfig(ack_latency_s=0.002, seed=0)))
+        self.stimulator.initialize('SIM')
+        self.addCleanup(self.stimulator.close_com_port)
+        self.terminated = False
+        self.error_channels = []
+
+    def _stimulate(self, duration_s: float):
+        self.stimulator.stimulate_ml(duration_s, self._on_termination, self.error_channels.append)
+        self.master.run(until=lambda: self.terminated or self.error_channels)
+
+    def _on_termination(self):
+        self.terminated = True
+
+    def test_stimulate_and_terminate(self):
+        self.stimulator.rectangular_pulse(1, STIM_PARAMS)
+        self._stimulate(0.3)
+
+        self.assertTrue(self.terminated)
+        self.assertEqual(self.error_channels, [])
+        device = self.stimulator.device
+        self.assertFalse(device.stimulating)
+        self.assertEqual(len(device.stimulation_intervals), 1)
+        start, end = device.stimulation_intervals[0]
+        self.assertAlmostEqual(end - start, 0.3, delta=0.05)
+
+    def test_injected_channel_error(self):
+        self.stimulator.rectangular_pulse(2, STIM_PARAMS)
+        self.stimulator.device.inject_channel_error(2)
+        self._stimulate(1.0)
+
+        self.assertFalse(self.terminated)
+        self.assertEqual(self.error_channels, [2])
+        device = self.stimulator.device
+        self.assertFalse(device.stimulating)
+        start, end = device.stimulation_intervals[0]
+        self.assertLess(end - start, 0.1, 'the error should be detected when the first keepalive is acknowledged')
+
+    def test_lost_version_ack(self):
+        stimulator = Stimulator(FakeMaster(), backend=SimulatedP24(SimulationConfig(drop_probability=1.0)))
+        self.addCleanup(stimulator.shutdown)
+        stimulator.MAX_WAIT_TIME_S = 0.05
+        with self.assertRaises(SerialPortError):
+            stimulator.initialize('SIM')
+
+    def test_close_and_reopen(self):
+        threads_before = set(threading.enumerate())
+        master = FakeMaster()
+        stimulator = Stimulator(master, backend=SimulatedP24(), stop_thread=True)
+        for _ in range(2):  # The port can be opened again after it was closed
+            stimulator.initialize('SIM')
+            stimulator.rectangular_pulse(1, STIM_PARAMS)
+            terminated = []
+            stimulator.stimulate_ml(0.1, lambda: terminated.append(True), print)
+            master.run(until=lambda: terminated)
+            self.assertTrue(terminated)
+
+            stimulator.close_com_port()
+            # The helper threads have ended, and nothing is scheduled on the Tk thread anymore
+            self.assertEqual(set(threading.enumerate()) - threads_before, set())
+            master.run(timeout_s=0.05)
+            self.assertEqual(master._callbacks, [])
+
+
+class TestSimulatedP24(unittest.TestCase):
+    def setUp(self):
+        self.clock = _VirtualClock()
+        self.sm = SimulatedP24(SimulationConfig(ack_latency_s=0.01, clock=self.clock))
+        self.device = self.sm.ffi.new('Smpt_device*')
+        self.sm.smpt_open_serial_port(self.device, self.sm.ffi.new('char[]', b'SIM'))
+
+    def _start(self):
+        ml_init = self.sm.ffi.new('Smpt_ml_init*')
+        self.sm.smpt_send_ml_init(self.device, ml_init)
+        ml_update = self.sm.ffi.new('Smpt_ml_update*')
+        ml_update.enable_channel[0] = True
+        self.sm.smpt_send_ml_update(self.device, ml_update)
+
+    def test_ack_latency(self):
+        self.sm.smpt_send_get_extended_version(self.device, 5)
+        self.assertFalse(self.sm.smpt_new_packet_received(self.device))
+        self.clock.now = 0.01
+        self.assertTrue(self.sm.smpt_new_packet_received(self.device))
+
+        ack = self.sm.ffi.new('Smpt_ack*')
+        self.sm.smpt_last_ack(self.device, ack)
+        self.assertEqual(ack.command_number, self.sm.Smpt_Cmd_Get_Extended_Version_Ack)
+        self.assertEqual(ack.packet_number, 5)
+        self.assertFalse(self.sm.smpt_new_packet_received(self.device))
+
+    def test_keepalive_deadline(self):
+        self._start()
+        self.clock.now = 1.9
+        self.sm.smpt_send_ml_get_current_data(self.device, self.sm.ffi.new('Smpt_ml_get_current_data*'))
+        self.clock.now = 3.8
+        self.assertTrue(self.device.stimulating, 'a keepalive within 2 s should keep the stimulation going')
+
+        self.clock.now = 4.0
+        self.sm.smpt_new_packet_received(self.device)
+        self.assertFalse(self.device.stimulating)
+        self.assertEqual(self.device.keepalive_timeouts, 1)
+        self.assertEqual(self.device.stimulation_intervals, [(0.0, 3.9)])
+
+
+class TestThreadedStimulator(unittest.TestCase):
+    def test_keepalive_independent_of_gui_load(self):
+        master = FakeMaster()
+        io_scheduler = IOScheduler()
+        self.addCleanup(io_scheduler.shutdown)
+        stimulator = Stimulator(master, backend=SimulatedP24(), io_scheduler=io_scheduler)
+        stimulator.initialize('SIM')
+        stimulator.rectangular_pulse(1, STIM_PARAMS)
+
+        termination_threads = []
+        stimulator.stimulate_ml(3.0, lambda: termination_threads.append(threading.current_thread()), print)
+        time.sleep(2.2)  # The Tk thread is blocked for longer than the keepalive deadline, e.g., by a messagebox
+        master.run(until=lambda: termination_threads)
+
+        device = stimulator.device
+        self.assertEqual(device.keepalive_timeouts, 0)
+        self.assertEqual(len(device.stimulation_intervals), 1)
+        start, end = device.stimulation_intervals[0]
+        self.assertAlmostEqual(end - start, 3.0, delta=0.05)
+        self.assertEqual(termination_threads, [threading.current_thread()],
+                         'on_termination should be called on the Tk thread')
+
+
+class TestMainThreadDispatcher(unittest.TestCase):
+    def test_calls_from_other_threads(self):
+        master = FakeMaster()
+        dispatcher = MainThreadDispatcher(master)
+        self.addCleanup(dispatcher.shutdown)
+        master.run(timeout_s=0.02)
+        self.assertEqual(master._callbacks, [], "the Tk thread mustn't be polled while there's nothing to do")
+
+        threads = []
+        for _ in range(3):
+            threading.Thread(target=dispatcher.call, args=(lambda: threads.append(threading.current_thread()),)).start()
+        master.run(until=lambda: len(threads) == 3, timeout_s=1)
+        self.assertEqual(threads, [threading.current_thread()] * 3)
+        master.run(timeout_s=0.02)
+        self.assertEqual(master._callbacks, [])
+
+
+class TestStimulationDuration(unittest.TestCase):
+    def _stimulate(self, duration_s: float, **stimulator_options) -> float:
+        master = FakeMaster()
+        stimulator = Stimulator(master, backend=SimulatedP24(), **stimulator_options)
+        stimulator.initialize('SIM')
+        self.addCleanup(stimulator.close_com_port)
+        stimulator.rectangular_pulse(1, STIM_PARAMS)
+        terminated = []
+        stimulator.stimulate_ml(duration_s, lambda: terminated.append(True), print)
+        master.run(until=lambda: terminated)
+
+        start, end = stimulator.device.stimulation_intervals[0]
+        self.assertAlmostEqual(stimulator.last_stimulation_duration_s, end - start, delta=0.0005)
+        return end - start
+
+    def test_sub_millisecond_duration_error(self):
+        for duration_s in (0.1, 0.55, 1.7):
+            with self.subTest(duration_s=duration_s):
+                self.assertAlmostEqual(self._stimulate(duration_s, stop_thread=True), duration_s, delta=0.001)
+
+    def test_tk_timer(self):
+        # The Tk thread doesn't wait precisely, so the stop is only as precise as ``after``'s milliseconds
+        self.assertAlmostEqual(self._stimulate(0.3), 0.3, delta=0.003)
+
+    def test_blocked_tk_thread(self):
+        master = FakeMaster()
+        stimulator = Stimulator(master, backend=SimulatedP24())
+        stimulator.initialize('SIM')
+        stimulator.rectangular_pulse(1, STIM_PARAMS)
+        stop_call_durations = []
+        timed_stop = stimulator._timed_stop
+
+        def measured_timed_stop(*args):
+            start_time = time.perf_counter()
+            timed_stop(*args)
+            stop_call_durations.append(time.perf_counter() - start_time)
+
+        stimulator._timed_stop = measured_timed_stop
+        terminated = []
+        stimulator.stimulate_ml(0.1, lambda: terminated.append(True), print)
+        time.sleep(0.5)  # The Tk thread is blocked past the end, e.g., by a messagebox
+        master.run(until=lambda: terminated)
+        # The blocked thread counts as at most a timer tick
+        self.assertLessEqual(stimulator._stop_lateness_s, Stimulator.MAX_STOP_LATENESS_S)
+
+        terminated.clear()
+        stop_call_durations.clear()
+        stimulator.stimulate_ml(0.3, lambda: terminated.append(True), print)
+        master.run(until=lambda: terminated)
+        self.assertAlmostEqual(stimulator.last_stimulation_duration_s, 0.3, delta=0.003)
+        # The Tk thread is scheduled again instead of waiting for the end
+        self.assertGreater(len(stop_call_durations), 1)
+        self.assertLess(max(stop_call_durations), 0.001)
+
+    def test_stop_thread(self):
+        self.assertAlmostEqual(self._stimulate(0.3, stop_thread=True), 0.3, delta=0.001)
+
+    def test_io_scheduler(self):
+        io_scheduler = IOScheduler()
+        self.addCleanup(io_scheduler.shutdown)
+        self.assertAlmostEqual(self._stimulate(0.3, io_scheduler=io_scheduler), 0.3, delta=0.001)
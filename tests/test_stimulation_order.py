@@ -1,8 +1,27 @@
+import os
+import shutil
+import tempfile
+import time
 import unittest
 from os import path
+
+import openpyxl
+import pandas as pd
+
 from backend.stimulation_order import StimulationOrder
 
 
+def make_order(n_blocks: int, n_trials_per_block: int) -> pd.DataFrame:
+    n = n_blocks * n_trials_per_block
+    order = pd.DataFrame({'block': [i // n_trials_per_block + 1 for i in range(n)],
+                          'trial': [i % n_trials_per_block + 1 for i in range(n)],
+                          'channels': [[1 + i % 8] for i in range(n)],
+                          'channel_electrode_map_id': ['horizontal'] * n,
+                          'electrodes': [[(1, 2)]] * n},
+                         index=pd.RangeIndex(1, n + 1, name='overall trial'))
+    return order
+
+
 class TestStimulationOrder(unittest.TestCase):
     def test_n_blocks_and_trials(self):
         stim_path = path.join('data', 'test_participant', 'stimulation_order.xlsx')
@@ -11,4 +30,115 @@ class TestStimulationOrder(unittest.TestCase):
         for _ in range(4):
             self.assertEqual(so.n_blocks(), 2, 'number of blocks should be 2')
             self.assertEqual(so.n_trials_in_current_block(), 2, 'number trials should be 2')
-            so.next_trial()
\ No newline at end of file
+            so.next_trial()
+
+    def test_resume(self):
+        stim_path = path.join('data', 'test_participant', 'stimulation_order.xlsx')
+        so = StimulationOrder.from_file(str(stim_path))
+
+        trial_info = so.resume({1: {}, 2: {}, 3: {}, 4: {}, 6: {}})
+        self.assertEqual((trial_info.overall_trial, trial_info.block, trial_info.trial), (5, 2, 1))
+        self.assertEqual(so.next_trial().overall_trial, 6)
+
+        self.assertIsNone(so.resume(range(1, 9)))
+
+    def test_navigation(self):
+        so = StimulationOrder(make_order(3, 4))
+        self.assertEqual(len(so), 12)
+        self.assertEqual(so.n_blocks(), 3)
+        for _ in range(5):
+            so.next_trial()
+        trial_info = so.current_trial()
+        self.assertEqual((trial_info.overall_trial, trial_info.block, trial_info.trial), (6, 2, 2))
+        self.assertEqual(trial_info.channels, [6])
+        self.assertIs(so.current_trial(), trial_info)
+        self.assertEqual(so.channel_masks[5], 1 << 5)
+        self.assertEqual(so.n_trials_in_current_block(), 4)
+        self.assertEqual(so.reset_block().overall_trial, 5)
+
+        so.overall_trial = 12
+        self.assertIsNone(so.next_trial())
+        self.assertEqual(so.overall_trial, 12)
+
+    def test_large_order(self):
+        so = StimulationOrder(make_order(1000, 100))
+        start = time.perf_counter()
+        while so.next_trial() is not None:
+            so.n_trials_in_current_block()
+            so.n_blocks()
+        self.assertEqual(so.overall_trial, 100_000)
+        self.assertLess(time.perf_counter() - start, 5.0)
+
+    def test_generate_new(self):
+        so = StimulationOrder.generate_new(n_blocks=3, n_trials_per_block=5, seed=1)
+        self.assertEqual(len(so), 15)
+        self.assertEqual(so.n_blocks(), 3)
+        self.assertEqual(so.n_trials_in_current_block(), 5)
+        map_ids = []
+        while True:
+            trial_info = so.current_trial()
+            self.assertIn(len(trial_info.channels), StimulationOrder.N_CHANNELS_WEIGHTS)
+            self.assertEqual(len(set(trial_info.channels)), len(trial_info.channels))
+            self.assertTrue(set(trial_info.channels) <= set(StimulationOrder.CHANNELS))
+            self.assertEqual(len(trial_info.electrodes), len(trial_info.channels))
+            map_ids.append(trial_info.channel_electrode_map_id)
+            if so.next_trial() is None:
+                break
+        self.assertEqual(map_ids, ['horizontal'] * 5 + ['vertical'] * 5 + ['horizontal'] * 5)
+
+        # The same seed generates the same order
+        same = StimulationOrder.generate_new(n_blocks=3, n_trials_per_block=5, seed=1)
+        pd.testing.assert_frame_equal(so.stim_order, same.stim_order)
+
+    def test_generate_large(self):
+        start = time.perf_counter()
+        so = StimulationOrder.generate_new(n_blocks=100, n_trials_per_block=1000, seed=0)
+        self.assertEqual(len(so), 100_000)
+        self.assertLess(time.perf_counter() - start, 5.0)
+
+    def test_cache(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        stim_path = path.join(directory.name, 'stimulation_order.xlsx')
+        shutil.copy(path.join('data', 'test_participant', 'stimulation_order.xlsx'), stim_path)
+        cache_path = stim_path + StimulationOrder.CACHE_SUFFIX
+
+        from_excel = StimulationOrder.from_file(stim_path)
+        self.assertTrue(path.isfile(cache_path))
+        from_cache = StimulationOrder.from_file(stim_path)
+        pd.testing.assert_frame_equal(from_cache.stim_order, from_excel.stim_order, check_index_type=False)
+        self.assertEqual(from_cache.current_trial(), from_excel.current_trial())
+
+        # The cache isn't used once the Excel file has changed
+        cache_mtime = os.stat(cache_path).st_mtime_ns
+        os.utime(stim_path, ns=(cache_mtime + 10 ** 9, cache_mtime + 10 ** 9))
+        with self.assertRaises(ValueError):
+            StimulationOrder.from_npz(cache_path, StimulationOrder._source_key(stim_path))
+        StimulationOrder.from_file(stim_path)
+        StimulationOrder.from_npz(cache_path, StimulationOrder._source_key(stim_path))
+
+    def test_npz(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        npz_path = path.join(directory.name, 'stimulation_order.npz')
+        so = StimulationOrder.generate_new(n_blocks=2, n_trials_per_block=3, seed=0)
+        so.save_as_npz(npz_path)
+        pd.testing.assert_frame_equal(StimulationOrder.from_file(npz_path).stim_order, so.stim_order,
+                                      check_index_type=False)
+
+    def test_save_as_excel(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        excel_path = path.join(directory.name, 'stimulation_order.xlsx')
+        so = StimulationOrder.generate_new(n_blocks=3, n_trials_per_block=4, seed=2)
+        so.save_as_excel(excel_path)
+        pd.testing.assert_frame_equal(StimulationOrder.from_excel(excel_path).stim_order, so.stim_order,
+                                      check_index_type=False)
+
+        worksheet = openpyxl.load_workbook(excel_path)[StimulationOrder.EXCEL_SHEET_NAME]
+        # The blocks alternate colors
+        self.assertEqual(worksheet['B2'].fill.fgColor.rgb[2:], StimulationOrder.ODD_BLOCK_COLOR[1:])
+        self.assertEqual(worksheet['B6'].fill.fgColor.rgb[2:], StimulationOrder.EVEN_BLOCK_COLOR[1:])
+        # The columns are as wide as their longest item
+        longest = max(len(str(electrodes)) for electrodes in so.stim_order['electrodes'])
+        self.assertAlmostEqual(worksheet.column_dimensions['F'].width, longest + 0.1, delta=1)
@@ -0,0 +1,88 @@
+import time
+import unittest
+
+from backend.simulated_stimulator import SimulatedP24, SimulationConfig
+from backend.stimulator import StimulationParameters, StimulatorError
+from backend.stimulator_pool import StimulatorPool
+from tests.fake_master import FakeMaster
+
+STIM_PARAMS = StimulationParameters(amplitude_ma=2.0, phase_duration=700, interpulse_interval=500, period_ms=20.0)
+PORTS = ['SIM1', 'SIM2', 'SIM3']
+
+
+class TestStimulatorPool(unittest.TestCase):
+    def setUp(self):
+        self.master = FakeMaster()
+        self.pool = StimulatorPool(self.master, backend=SimulatedP24(SimulationConfig(ack_latency_s=0.002, seed=0)))
+        self.addCleanup(self.pool.close)
+        self.pool.open(PORTS)
+        self.terminated = False
+        self.errors = []
+
+    def _start(self, channels, duration_s: float):
+        self.pool.start(channels, STIM_PARAMS, duration_s, self._on_termination,
+                        lambda port, channel: self.errors.append((port, channel)))
+
+    def _on_termination(self):
+        self.terminated = True
+
+    def test_synchronized_start(self):
+        self._start({'SIM1': [1, 2], 'SIM2': [8], 'SIM3': [1]}, 0.3)
+        self.master.run(until=lambda: self.terminated)
+
+        self.assertTrue(self.terminated)
+        self.assertFalse(self.pool.stimulating)
+        self.assertLess(self.pool.start_skew_s(), 0.01)
+        for port, stimulator in self.pool.stimulators.items():
+            start, end = stimulator.device.stimulation_intervals[0]
+            self.assertAlmostEqual(end - start, 0.3, delta=0.05, msg=port)
+        self.assertTrue(all(health.healthy for health in self.pool.health().values()))
+
+    def test_error_stops_all_devices(self):
+        self.pool.stimulators['SIM2'].device.inject_channel_error(3)
+        self._start({port: [3] for port in PORTS}, 1.0)
+        self.master.run(until=lambda: self.errors)
+        self.master.run(timeout_s=0.1)
+
+        self.assertEqual(self.errors, [('SIM2', 3)])
+        self.assertFalse(self.terminated)
+        self.assertFalse(any(stimulator.device.stimulating for stimulator in self.pool.stimulators.values()))
+        health = self.pool.health()
+        self.assertFalse(health['SIM2'].healthy)
+        self.assertEqual(health['SIM2'].channel_errors, [3])
+        self.assertTrue(health['SIM1'].healthy)
+
+    def test_stop_before_start(self):
+        self._start({'SIM1': [1]}, 1.0)
+        self.pool.stop()
+        self.master.run(timeout_s=0.1)
+
+        self.assertFalse(self.pool.stimulating)
+        self.assertEqual(self.pool.stimulators['SIM1'].device.stimulation_intervals, [])
+        self.assertEqual(self.pool.stimulators['SIM1'].active_channels(), set())
+
+    def test_failed_start(self):
+        def fail(*_args, **_kwargs):
+            raise StimulatorError('Failed to start stimulation.')
+
+        self.pool.stimulators['SIM2'].stimulate_ml = fail
+        self._start({port: [1] for port in PORTS}, 1.0)
+        self.master.run(until=lambda: self.errors)
+
+        self.assertEqual(self.errors, [('SIM2', None)])
+        self.assertFalse(self.terminated)
+        self.assertFalse(self.pool.stimulating)
+        # The device started before the failure is stopped, and the one after it isn't started
+        self.assertEqual(len(self.pool.stimulators['SIM1'].device.stimulation_intervals), 1)
+        self.assertFalse(any(stimulator.device.stimulating for stimulator in self.pool.stimulators.values()))
+        self.assertEqual(self.pool.stimulators['SIM3'].device.stimulation_intervals, [])
+
+    def test_stop_while_start_is_due(self):
+        self._start({'SIM1': [1]}, 1.0)
+        # The start is already being run on the I/O thread when the pool is stopped
+        time.sleep(StimulatorPool.START_DELAY_S + 0.01)
+        self.pool.stop()
+        self.master.run(timeout_s=0.1)
+
+        self.assertFalse(self.pool.stimulating)
+        self.assertFalse(self.pool.stimulators['SIM1'].device.stimulating)
@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+
+from backend.threshold_estimation import PsiEstimator, StaircaseEstimator, ThresholdEstimator
+
+INTENSITIES = ['Nothing', 'Very weak', 'Weak', 'Moderate', 'Strong', 'Very strong', 'Painful']
+INCREMENTS = {'Nothing': 3.0, 'Very weak': 2.0, 'Weak': 1.5, 'Moderate': 1.0, 'Strong': 0.5, 'Very strong': 0.0,
+              'Painful': -1.0}
+
+
+def report(amplitude_ma: float, detection_ma: float = 4.0, level_width_ma: float = 1.0) -> str:
+    """A participant without noise. 'Very strong' starts at detection_ma + 4 * level_width_ma."""
+    level = (amplitude_ma - detection_ma) / level_width_ma
+    return INTENSITIES[0 if level < 0 else int(min(np.floor(level) + 1, len(INTENSITIES) - 1))]
+
+
+class TestThresholdEstimator(unittest.TestCase):
+    def test_incomplete_subclass(self):
+        class WithoutUpdate(ThresholdEstimator):
+            finished = False
+
+            def next_amplitude(self) -> float:
+                return 1.0
+
+        with self.assertRaises(TypeError):
+            WithoutUpdate()
+
+
+class TestStaircaseEstimator(unittest.TestCase):
+    def test_steps(self):
+        estimator = StaircaseEstimator(INCREMENTS, 2.0, 0.5, 20.0)
+        amplitudes = []
+        while not estimator.finished:
+            amplitudes.append(estimator.next_amplitude())
+            estimator.update(amplitudes[-1], report(amplitudes[-1]))
+        self.assertEqual(amplitudes, [2.0, 5.0, 6.5, 7.5, 8.0])
+        self.assertEqual(estimator.next_amplitude(), 8.0)
+
+    def test_clipped(self):
+        estimator = StaircaseEstimator(INCREMENTS, 19.0, 0.5, 20.0)
+        estimator.update(19.0, 'Nothing')
+        self.assertEqual(estimator.next_amplitude(), 20.0)
+        self.assertFalse(estimator.finished)
+
+    def test_invalid_intensity(self):
+        with self.assertRaises(ValueError):
+            StaircaseEstimator(INCREMENTS, 2.0, 0.5, 20.0).update(2.0, 'Unknown')
+
+
+class TestPsiEstimator(unittest.TestCase):
+    def _estimator(self) -> PsiEstimator:
+        return PsiEstimator(INTENSITIES, 'Very strong', 2.0, 0.5, 20.0)
+
+    def test_converges(self):
+        estimator = self._estimator()
+        amplitudes = []
+        while not estimator.finished:
+            amplitudes.append(estimator.next_amplitude())
+            estimator.update(amplitudes[-1], report(amplitudes[-1]))
+
+        self.assertLessEqual(len(amplitudes), PsiEstimator.MAX_STIMULATIONS)
+        self.assertEqual(amplitudes[0], 2.0)
+        self.assertLessEqual(estimator.credible_interval_width(), PsiEstimator.MAX_CREDIBLE_WIDTH_MA)
+        # 'Very strong' starts at 8 mA
+        self.assertAlmostEqual(estimator.next_amplitude(), 8.0, delta=1.0)
+        # The amplitudes are on the grid of the device and rise gradually
+        self.assertTrue(all(amplitude % 0.5 == 0 for amplitude in amplitudes))
+        for i, amplitude in enumerate(amplitudes[1:], start=1):
+            self.assertLessEqual(amplitude, max(amplitudes[:i]) + PsiEstimator.MAX_STEP_UP_MA)
+
+    def test_painful_not_repeated(self):
+        estimator = self._estimator()
+        estimator.update(2.0, 'Painful')
+        self.assertLess(estimator.next_amplitude(), 2.0)
+
+    def test_invalid_intensity(self):
+        with self.assertRaises(ValueError):
+            self._estimator().update(2.0, 'Unknown')
@@ -0,0 +1,84 @@
+import unittest
+
+from backend.simulated_stimulator import SimulatedP24
+from backend.stimulator import Stimulator, StimulationParameters
+from backend.waveforms import Waveform, WaveformCache
+from tests.fake_master import FakeMaster
+
+
+class TestWaveform(unittest.TestCase):
+    def test_rectangular_is_valid(self):
+        Waveform.rectangular(5.0, 200, 100, 20.0).validate()
+
+    def test_asymmetric_charge_balanced(self):
+        waveform = Waveform(((4.0, 200), (0, 50), (-1.0, 800)), period_ms=10.0)
+        waveform.validate()
+        self.assertEqual(waveform.duration_us(), 1050)
+
+    def test_invalid(self):
+        invalid = [
+            Waveform(((4.0, 200), (-2.0, 200)), period_ms=10.0),  # not charge balanced
+            Waveform(((1.0, 100), (-1.0, 100)) * 9, period_ms=10.0),  # too many points
+            Waveform(((1.0, 5000), (-1.0, 5000)), period_ms=20.0),  # point too long
+            Waveform(((200.0, 100), (-200.0, 100)), period_ms=10.0),  # current too high
+            Waveform.rectangular(5.0, 1000, 500, 2.0),  # longer than the period
+        ]
+        for waveform in invalid:
+            with self.subTest(waveform=waveform), self.assertRaises(ValueError):
+                waveform.validate()
+
+
+class TestStimulationParameters(unittest.TestCase):
+    def test_default_pulse_fits_in_period(self):
+        # The default phase durations and interphase interval at 50 Hz
+        StimulationParameters(2.0, 700, 500, 1000 / 50).validate()
+
+    def test_pulse_longer_than_period(self):
+        # The defaults at 600 Hz: the pulse takes 1900 µs, but the period is 1.667 ms
+        with self.assertRaises(ValueError):
+            StimulationParameters(2.0, 700, 500, 1000 / 600).validate()
+
+
+class TestWaveformCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = WaveformCache(SimulatedP24(), max_size=2)
+
+    def test_hit(self):
+        first = self.cache.get(Waveform.rectangular(5.0, 200, 100, 20.0))
+        second = self.cache.get(Waveform.rectangular(5.0, 200, 100, 20.0))
+        self.assertIs(first, second)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(first.number_of_points, 3)
+        self.assertEqual(first.points[2].current, -5.0)
+
+    def test_lru_eviction(self):
+        a, b, c = (Waveform.rectangular(amplitude, 200, 100, 20.0) for amplitude in (1.0, 2.0, 3.0))
+        self.cache.get(a)
+        self.cache.get(b)
+        self.cache.get(a)  # b is now the least recently used
+        self.cache.get(c)
+        self.assertEqual(len(self.cache), 2)
+        self.cache.get(a)
+        self.assertEqual(self.cache.misses, 3)
+        self.cache.get(b)
+        self.assertEqual(self.cache.misses, 4)
+
+    def test_invalid_not_cached(self):
+        with self.assertRaises(ValueError):
+            self.cache.get(Waveform(((4.0, 200), (-2.0, 200)), period_ms=10.0))
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestStimulatorWaveforms(unittest.TestCase):
+    def test_swap_copies_config(self):
+        stimulator = Stimulator(FakeMaster(), backend=SimulatedP24())
+        params = StimulationParameters(amplitude_ma=2.0, phase_duration=700, interpulse_interval=500, period_ms=20.0)
+        stimulator.rectangular_pulse(1, params)
+        stimulator.rectangular_pulse(2, params)
+
+        configs = stimulator.ml_update.channel_config
+        self.assertIsNot(configs[0], configs[1])
+        self.assertEqual(configs[1].points[0].time, 700)
+        configs[0].points[0].current = 0  # modifying the update must not change the compiled waveform
+        self.assertEqual(stimulator.waveforms.get(Waveform.rectangular(2.0, 700, 500, 20.0)).points[0].current, 2.0)
+        self.assertEqual(stimulator.active_channels(), {1, 2})
@@ -1,16 +1,19 @@
+import functools
 import sys
+import weakref
 
 import tkinter as tk
 from tkinter import ttk
-from typing import Callable, Any
+from typing import Callable, Any, Optional
 
+from backend.sensation_form import SensationEntry, SensationForm
 from .location_inputter import LocationInputter, LocationType
 
 
 class _SingleSensationFrame(tk.Frame):
-    SENSATION_TYPES = ['Touch', 'Pulse', 'Tingling', 'Vibration', 'Cramp', 'Pain', 'Heat', 'Cold', 'Other']
-    INTENSITY_OPTIONS = [i for i in range(1, 11)]
-    LOCATIONS = ['D1', 'D2', 'D3', 'D4', 'S1', 'S2', 'S3', 'S4', 'S5', 'Calf', 'Shin']
+    SENSATION_TYPES = SensationForm.SENSATION_TYPES
+    INTENSITY_OPTIONS = SensationForm.INTENSITY_OPTIONS
+    LOCATIONS = SensationForm.LOCATIONS
 
     # noinspection PyUnreachableCode
     if False:  # Just so gettext realizes that these strings need to be translated
@@ -26,21 +29,33 @@ class _SingleSensationFrame(tk.Frame):
         _('Cold')
         _('Other')
 
-    def __init__(self, master, sensation_number: int, on_remove: Callable, on_input_callback: Callable):
-        """A Frame which lets the participant input information for a single sensation.
+    def __init__(self, master, sensation_number: int, on_remove: Callable,
+                 on_input_callback: Optional[Callable] = None, form: Optional[SensationForm] = None):
+        """A Frame which lets the participant input information for a single sensation. The inputs are stored in an
+        entry of the form.
         :param master: The parent widget.
         :param sensation_number: The number of the sensation.
-        :param on_remove: A function to call when the sensation is removed."""
+        :param on_remove: A function to call when the sensation is removed.
+        :param on_input_callback: A function to call when an input changes.
+        :param form: The form the sensation is added to. Defaults to a form of its own."""
         super().__init__(master, padx=10, pady=10, borderwidth=1, relief="solid")
+        self.form = SensationForm() if form is None else form
+        self.entry: SensationEntry = self.form.add()
 
         # Initialize tkinter vars for inputs
         self.type_var = tk.StringVar(self)
         self.intensity_var = tk.IntVar(self)
         self.location_vars = {location: tk.BooleanVar(self, value=False) for location in self.LOCATIONS}
 
-        # Link changes in the variables to on_input_callback
-        for var in [self.type_var, self.intensity_var] + list(self.location_vars.values()):
-            var.trace_add('write', on_input_callback)
+        # Update the entry with the variable which changed
+        self.type_var.trace_add('write', lambda *_: self.form.set_type(self.entry, self.type_var.get()))
+        self.intensity_var.trace_add('write', lambda *_: self.form.set_intensity(self.entry, self.intensity_var.get()))
+        for location, var in self.location_vars.items():
+            var.trace_add('write', lambda *_, location=location, var=var:
+                          self.form.set_location(self.entry, location, var.get()))
+        if on_input_callback is not None:
+            for var in [self.type_var, self.intensity_var] + list(self.location_vars.values()):
+                var.trace_add('write', on_input_callback)
 
         # Header Frame (first row)
         header_frame = ttk.Frame(self)  # The frame at the top of this Widget
@@ -93,21 +108,32 @@ class _SingleSensationFrame(tk.Frame):
         for frame in [header_frame, type_frame, intensity_frame, location_frame]:
             frame.pack(fill='x', expand=True, padx=5, pady=5)
 
+    def reset(self, sensation_number: int):
+        """Clear the inputs and add a new entry to the form, so the frame can be reused for another sensation.
+        :param sensation_number: The new number of the sensation."""
+        self.entry = self.form.add()
+        self.title_label.config(text=_('Sensation {}').format(sensation_number))
+        self.type_var.set('')
+        self.intensity_var.set(0)
+        for var in self.location_vars.values():
+            if var.get():
+                var.set(False)
+
     def get_sensation_data(self) -> dict[str, Any]:
         """Access the data the participant has input for this sensation.
         :returns: A dict with the entries 'type', 'intensity', and 'locations'."""
-        locations = [loc for loc in self.LOCATIONS if self.location_vars[loc].get()]
-        return {'type': self.type_var.get(), 'intensity': self.intensity_var.get(), 'locations': locations}
+        return self.form.entry_data(self.entry)
 
     def all_inputs_filled(self) -> bool:
         """Check if all inputs have been filled in."""
-        type_check = self.type_var.get() in self.SENSATION_TYPES
-        intensity_check = self.intensity_var.get() in self.INTENSITY_OPTIONS
-        location_check = any(self.location_vars[loc].get() for loc in self.LOCATIONS)
-        return type_check and intensity_check and location_check
+        return self.entry.complete
 
 
 class EvokedSensationsFrame(tk.Frame):
+    # The frames of each toplevel. The toplevel's mousewheel binding is only added once and scrolls them.
+    _toplevel_frames: weakref.WeakKeyDictionary[tk.Misc, weakref.WeakSet['EvokedSensationsFrame']] = \
+        weakref.WeakKeyDictionary()
+
     def __init__(self, master: tk.Widget, on_continue: Callable[[list[dict[str, Any]]], None], trial_number: int,
                  trials_in_block: int):
         """The Frame where the participant can add multiple evoked sensations and continue stimulation.
@@ -117,6 +143,8 @@ class EvokedSensationsFrame(tk.Frame):
         :param trials_in_block: The number of trials in the current block."""
         super().__init__(master)
         self.on_continue = on_continue
+        # The entered sensations. It tracks whether all of them are complete.
+        self.form = SensationForm(on_complete_change=lambda _complete: self.check_complete_inputs())
 
         # The canvas is just here to enable scrolling and only contains the main_frame
         self.canvas = tk.Canvas(self, highlightthickness=0)
@@ -142,20 +170,35 @@ class EvokedSensationsFrame(tk.Frame):
         self.window_id = self.canvas.create_window((0, 0), window=self.main_frame, anchor='nw')
 
         if sys.platform == 'darwin':  # mac
-            on_mousewheel = self._on_mousewheel_mac
+            self._on_mousewheel = self._on_mousewheel_mac
         elif sys.platform.startswith('win'):  # windows
-            on_mousewheel = self._on_mousewheel_windows
-        else:
-            raise NotImplementedError(f"Unsupported platform: {sys.platform}")
-
-        # bind this to all children of self recursively
-        self._bind_mousewheel(self, on_mousewheel)
-
-    def _bind_mousewheel(self, widget, callback):
-        """Bind the mousewheel event to the callback for the given widget."""
-        widget.bind("<MouseWheel>", callback)
-        for child in widget.winfo_children():
-            self._bind_mousewheel(child, callback)
+            self._on_mousewheel = self._on_mousewheel_windows
+        else:  # X11 reports the mousewheel as the buttons 4 and 5
+            self._on_mousewheel = self._on_mousewheel_x11
+
+        # Every widget has its toplevel in its bindtags, so binding the mousewheel to the toplevel covers all
+        # widgets of this frame, including the sensations which are added later
+        toplevel = self.winfo_toplevel()
+        if toplevel not in self._toplevel_frames:
+            self._toplevel_frames[toplevel] = weakref.WeakSet()
+            for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+                toplevel.bind(sequence, functools.partial(self._on_toplevel_mousewheel, toplevel), add='+')
+        self._toplevel_frames[toplevel].add(self)
+        self.bind('<Destroy>', self._on_destroy, add='+')
+
+    @classmethod
+    def _on_toplevel_mousewheel(cls, toplevel: tk.Misc, event):
+        """Scroll the frame which the mousewheel is used over."""
+        path = str(event.widget)
+        for frame in list(cls._toplevel_frames.get(toplevel, ())):
+            if path == str(frame) or path.startswith(str(frame) + '.'):
+                frame._on_mousewheel(event)
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            frames = self._toplevel_frames.get(self.winfo_toplevel())
+            if frames is not None:
+                frames.discard(self)
 
     def _create_main_content(self, trial_number, trials_in_block):
         """Must be called during initialization to create the main content of the Frame."""
@@ -163,10 +206,11 @@ class EvokedSensationsFrame(tk.Frame):
         header_frame = tk.Frame(self.main_frame)
         header_frame.columnconfigure(0, weight=1)
         title = ttk.Label(header_frame, text=_('Evoked Sensations'), style='Heading1.TLabel')
-        trial_number_label = ttk.Label(header_frame, text=_('Trial {} of {}').format(trial_number, trials_in_block),
-                                       style='Bold.TLabel')
+        self.trial_number_label = ttk.Label(header_frame, text=_('Trial {} of {}').format(trial_number,
+                                                                                           trials_in_block),
+                                            style='Bold.TLabel')
         title.grid(row=0, column=0, sticky="w")
-        trial_number_label.grid(row=0, column=1, sticky="e")
+        self.trial_number_label.grid(row=0, column=1, sticky="e")
 
         # Frame for all evoked sensations
         self.sensations_container = tk.Frame(self.main_frame)
@@ -176,6 +220,8 @@ class EvokedSensationsFrame(tk.Frame):
                                              style='Bold.TLabel')
         self.no_sensations_label.pack(padx=5, pady=5)
         self.sensations_frames = []
+        # Removed sensation frames, which are reused when a sensation is added
+        self._spare_sensation_frames: list[_SingleSensationFrame] = []
 
         # Add sensation button
         self.add_sensation_button = ttk.Button(self.sensations_container, text=_('+ Add Sensation'), padding=20,
@@ -196,6 +242,10 @@ class EvokedSensationsFrame(tk.Frame):
     def _on_mousewheel_mac(self, event):
         self.canvas.yview_scroll(-1 * int(event.delta), "units")
 
+    def _on_mousewheel_x11(self, event):
+        if event.num in (4, 5):
+            self.canvas.yview_scroll(-1 if event.num == 4 else 1, "units")
+
     def _on_canvas_resize(self, event):
         """Handle the canvas resize events by re-centering the frame inside.
         This generally happens when the window is resized."""
@@ -207,13 +257,26 @@ class EvokedSensationsFrame(tk.Frame):
         self.canvas.itemconfig(self.window_id, width=self.canvas.winfo_width())
         self.canvas.configure(scrollregion=self.canvas.bbox("all"))
 
+    def reset(self, trial_number: int, trials_in_block: int):
+        """Clear the sensations, so the frame can be reused for another trial.
+        :param trial_number: The current trial number.
+        :param trials_in_block: The number of trials in the current block."""
+        self.trial_number_label.config(text=_('Trial {} of {}').format(trial_number, trials_in_block))
+        for sensation_frame in list(self.sensations_frames):
+            self.remove_sensation(sensation_frame)
+        self.canvas.yview_moveto(0)
+
     def add_sensation(self):
         # Remove no_sensations_label if it was there before
         if len(self.sensations_frames) == 0:
             self.no_sensations_label.pack_forget()
 
-        new_sensation = _SingleSensationFrame(self.sensations_container, len(self.sensations_frames) + 1,
-                                              self.remove_sensation, self.check_complete_inputs)
+        if self._spare_sensation_frames:
+            new_sensation = self._spare_sensation_frames.pop()
+            new_sensation.reset(len(self.sensations_frames) + 1)
+        else:
+            new_sensation = _SingleSensationFrame(self.sensations_container, len(self.sensations_frames) + 1,
+                                                  self.remove_sensation, form=self.form)
         self.sensations_frames.append(new_sensation)
         self.add_sensation_button.pack_forget()
         new_sensation.pack(padx=10, pady=10)
@@ -222,13 +285,12 @@ class EvokedSensationsFrame(tk.Frame):
         # Disabled continue button because you should only be able to continue when all inputs have been filled in
         self.continue_button.config(state='disabled')
 
-        # bind the mousewheel to the new widget
-        self._bind_mousewheel(new_sensation, self._on_mousewheel_windows)
-
     def remove_sensation(self, query_sensation_frame):
         self.sensations_frames.remove(query_sensation_frame)
+        self.form.remove(query_sensation_frame.entry)
         query_sensation_frame.pack_forget()
-        query_sensation_frame.destroy()
+        # Keep the frame to reuse it instead of building a new one
+        self._spare_sensation_frames.append(query_sensation_frame)
 
         # Update indexes of remaining sensations
         for i, sensation_frame in enumerate(self.sensations_frames):
@@ -239,20 +301,12 @@ class EvokedSensationsFrame(tk.Frame):
             self.no_sensations_label.pack(padx=5, pady=5)
 
         # check if continue button should be enabled or disabled now
-        self.check_complete_inputs(self)
+        self.check_complete_inputs()
 
     def check_complete_inputs(self, *_args):
         """Enable the continue button if all sensations have been filled in and disable if not.
-        Should be called every time an input is given."""
-        # Check if all inputs have been provided
-        for sensation in self.sensations_frames:
-            if not sensation.all_inputs_filled():
-                self.continue_button.config(state='disabled')
-                return
-        self.continue_button.config(state='normal')
+        The form tracks this while the inputs change, so it doesn't have to check them."""
+        self.continue_button.config(state='normal' if self.form.complete else 'disabled')
 
     def get_sensations_and_continue(self):
-        data = []
-        for sensation in self.sensations_frames:
-            data.append(sensation.get_sensation_data())
-        self.on_continue(data)
+        self.on_continue(self.form.data())
@@ -12,26 +12,45 @@ from styling.app_style import AppStyle
 from backend.participant_data import ParticipantData
 from backend.locale_manager import LocaleManager
 from widgets.participant_window import ParticipantWindow
+from widgets.location_inputter import LocationInputter
 from backend.settings import Settings
 from backend.stimulation_order import StimulationOrder
 from backend.stimulator import Stimulator, SerialPortError
+from backend.simulated_stimulator import SimulatedP24
+from backend.io_scheduler import IOScheduler, MainThreadDispatcher
+from backend.data_writer import DataWriter
 
 
 class ExperimenterWindow(tk.Tk):
-    def __init__(self):
+    def __init__(self, threaded_stimulation: bool = False, stop_thread: bool = False, stimulator_backend=None):
+        """The main window of the app.
+        :param threaded_stimulation: Whether the stimulation keepalive, error checks, and timed stop run on a dedicated
+        I/O thread instead of the Tk event loop.
+        :param stop_thread: Without threaded stimulation, whether the timed stop runs on a dedicated thread.
+        :param stimulator_backend: The backend of the Stimulator, e.g. a SimulatedP24 to run without a device.
+        Defaults to the ScienceMode wrapper."""
         super().__init__()
         # set up style
         self.style = AppStyle()
 
         self.participant_data = None
 
+        # Prepare the images of the sensation inputs while the experiment is set up
+        LocationInputter.warm_up_images(self)
+
         self.title("Experimenter View")
         # self.resizable(False, False)
         self.geometry("+0+0")
 
         self.participant_window = None
 
-        self.stimulator = Stimulator(self)
+        self.io_scheduler = IOScheduler() if threaded_stimulation else None
+        # Writes the participant data in the background. Its errors are shown in the experiment manager.
+        self._dispatcher = MainThreadDispatcher(self)
+        self.data_writer = DataWriter(
+            on_status=lambda error: self._dispatcher.call(self.experiment_manager.show_data_error, error))
+        self.stimulator = Stimulator(self, backend=stimulator_backend, io_scheduler=self.io_scheduler,
+                                     stop_thread=stop_thread)
 
         # Create widgets
         self.stimulation_buttons = _StimulationButtons(self, self.stimulator, self.on_start_stimulation,
@@ -47,6 +66,7 @@ class ExperimenterWindow(tk.Tk):
             frame.pack(padx=10, pady=10)
         self.experiment_manager.pack(padx=10, pady=10, fill='x', expand=True)
 
+        self.protocol('WM_DELETE_WINDOW', self.on_close)
         # noinspection PyTypeChecker
         self.after(100, self.set_minimum_size)
 
@@ -59,6 +79,15 @@ class ExperimenterWindow(tk.Tk):
         # Set the minimum size to the current dimensions
         self.wm_minsize(initial_width, initial_height)
 
+    def on_close(self):
+        """Close the app once the participant data has been written, unless the experimenter doesn't want to wait."""
+        if self.data_writer.is_idle() or messagebox.askyesno(
+                'Saving Data', 'Not all participant data has been saved yet. Quit anyway and lose it?\n\n'
+                               'Otherwise, the app closes as soon as the data has been saved.'):
+            self.destroy()
+        else:
+            self.data_writer.when_written(lambda: self._dispatcher.call(self.destroy))
+
     def on_port_opened(self):
         """What to do when the port is successfully opened."""
         self.stimulation_buttons.enable_start()
@@ -87,22 +116,75 @@ class ExperimenterWindow(tk.Tk):
         self.experiment_manager.enable_start()  # enable starting experiment
         self.on_stop_any()
 
-    def on_start_experiment(self, stim_order: StimulationOrder):
+    def on_start_experiment(self, stim_order: StimulationOrder, resume: bool) -> bool:
+        """Start the experiment.
+        :param resume: Whether to resume the session whose journal is in the participant folder.
+        :return: Whether the experiment was started."""
+        # The parameters can't be changed during the experiment, so the pulse fits for the whole session
+        if not self.stimulation_buttons.check_parameters():
+            return False
+        skip_calibration = False
+        if resume:
+            s = Settings()
+            try:
+                if ParticipantData.has_legacy_data(s.get_journal_path(), s.get_calibration_data_path(),
+                                                   s.get_sensation_data_path()):
+                    self.participant_data = ParticipantData.from_legacy_files(
+                        s.get_journal_path(), s.get_calibration_data_path(), s.get_sensation_data_path(),
+                        self.data_writer)
+                else:
+                    self.participant_data = ParticipantData.from_journal(s.get_journal_path(), self.data_writer)
+            except ValueError as e:
+                messagebox.showerror('Resume Error', f'The data of the previous session could not be read:\n\n{e}')
+                return False
+            trial_info = stim_order.resume(self.participant_data.sensation_data)
+            if trial_info is None:
+                self.participant_data.close()
+                messagebox.showinfo('Session Complete', 'All trials of this participant have already been recorded.')
+                return False
+            logging.info(f'Resuming the session at block {trial_info.block}, trial {trial_info.trial} '
+                         f'(overall trial {trial_info.overall_trial})')
+            calibrated_ma = self.participant_data.calibrated_amplitude_ma
+            if calibrated_ma is not None and messagebox.askyesno(
+                    'Skip Calibration', f'The participant was calibrated to {calibrated_ma} mA. '
+                                        f'Skip the calibration and continue with this amplitude?'):
+                Settings().amplitude.set(calibrated_ma)
+                skip_calibration = True
+        else:
+            self.participant_data = ParticipantData(writer=self.data_writer)
+
         self.stimulation_buttons.disable_buttons()  # disable starting stimulation
         self.on_start_any()
-        self.participant_data = ParticipantData()
+        self.stimulator.metrics.clear()  # The timing is recorded per session
+        self.stimulator.open_ml_session()  # Initialize once instead of for every stimulation
         # open the participant window
-        self.participant_window = ParticipantWindow(self, self.stimulator, stim_order, self.participant_data)
+        self.participant_window = ParticipantWindow(self, self.stimulator, stim_order, self.participant_data,
+                                                    skip_calibration)
+        return True
 
     def on_stop_experiment(self):
         self.stimulation_buttons.enable_start()  # enable starting stimulation
         self.on_stop_any()
-        self.stimulator.stop_stimulation()
+        self.stimulator.close_ml_session()  # Also stops any stimulation
+        # Writes the JSON files from the journal in the background. Failures are shown in the experiment manager.
+        self.participant_data.close(on_closed=lambda: logging.info('All participant data has been written'))
+        self._save_stimulator_timing()
         self.participant_window.destroy()  # close the participant window
         self.participant_window = None
 
+    def _save_stimulator_timing(self):
+        """Save the timing measurements of the stimulator during the session to the participant folder."""
+        path = Settings().get_stimulator_timing_path()
+        try:
+            self.stimulator.metrics.dump(path)
+            logging.info(f'Saved the stimulator timing to {path}')
+        except OSError as e:
+            logging.error(f'Error saving the stimulator timing to {path}: {e}')
+
 
 class _ComPortManager(ttk.Frame):
+    SIMULATED_PORT = 'Simulated'  # Offered when the stimulator has a simulated backend
+
     def __init__(self, master, stimulator: Stimulator, on_successful_init: callable, on_close_port: callable):
         """This class manages the COM port selection, opening, and closing.
         :param on_successful_init: A function to call if the COM port is successfully opened and mid-level stimulation was initialized"""
@@ -137,6 +219,8 @@ class _ComPortManager(ttk.Frame):
 
     def _update_available_com_ports(self):
         self.available_com_ports = sorted([port.device for port in list_ports.comports()])
+        if isinstance(self.stimulator.sm, SimulatedP24):
+            self.available_com_ports.append(self.SIMULATED_PORT)
         self.port_selector['values'] = self.available_com_ports
 
         if self.com_port.get() not in self.available_com_ports:
@@ -322,7 +406,21 @@ class _StimulationButtons(ttk.Frame):
         self.start_button['state'] = 'disabled'
         self.stop_button['state'] = 'disabled'
 
+    @staticmethod
+    def check_parameters() -> bool:
+        """Check that the device can stimulate the pulse of the parameters, and show an error if it can't.
+        :return: Whether it can."""
+        try:
+            Settings().get_stimulation_parameters().validate()
+        except ValueError as e:
+            messagebox.showerror('Invalid Parameters',
+                                 f'{e}\n\nReduce the phase duration, the interphase interval, or the frequency.')
+            return False
+        return True
+
     def _on_start(self):
+        if not self.check_parameters():
+            return
         s = Settings()
         # update the pulse configuration
         self.stimulator.rectangular_pulse(s.channel.get(), s.get_stimulation_parameters())
@@ -355,7 +453,7 @@ class _StimulationButtons(ttk.Frame):
 
 
 class _ExperimentManager(ttk.Frame):
-    def __init__(self, master, on_start_experiment: Callable[[StimulationOrder], None],
+    def __init__(self, master, on_start_experiment: Callable[[StimulationOrder, bool], bool],
                  on_stop_experiment_callback: Callable):
         super().__init__(master, borderwidth=2, relief="solid")
         self.on_start_experiment = on_start_experiment
@@ -396,6 +494,16 @@ class _ExperimentManager(ttk.Frame):
         self.stop_exp_button.grid(row=3, column=1, padx=5, pady=5, sticky='w')
         self.columnconfigure((0, 1), weight=1)
 
+        # Errors of saving the participant data. They're only shown here, so the participant isn't interrupted.
+        self.data_error_var = tk.StringVar(self)
+        self.data_error_label = ttk.Label(self, textvariable=self.data_error_var, style='ErrorText.TLabel',
+                                          wraplength=400)
+        self.data_error_label.grid(row=4, column=0, columnspan=2, padx=5, pady=5)
+
+    def show_data_error(self, error: Optional[str]):
+        """Show an error of saving the participant data, or remove it if it's None."""
+        self.data_error_var.set('' if error is None else f'⚠ {error}\nRetrying...')
+
     def enable_start(self):
         self.start_exp_button['state'] = 'normal'
 
@@ -404,16 +512,16 @@ class _ExperimentManager(ttk.Frame):
 
     def on_start(self):
         """Start the experiment."""
-        possible_stim_order = self.validate_participant_folder()
-        if possible_stim_order is not None:
+        validated = self.validate_participant_folder()
+        if validated is not None:
+            stim_order, resume = validated
             # Set the locale for the new window
             self.locale_manager.set_locale(self.language_var.get())
-            self.locale_selector['state'] = 'disabled'
 
-            # If we reach this possible_stim_order will contain a proper StimulationOrder
-            self.on_start_experiment(possible_stim_order)
-            self.start_exp_button['state'] = 'disabled'
-            self.stop_exp_button.config(state='normal', style='EnabledStopButton.TButton')
+            if self.on_start_experiment(stim_order, resume):
+                self.locale_selector['state'] = 'disabled'
+                self.start_exp_button['state'] = 'disabled'
+                self.stop_exp_button.config(state='normal', style='EnabledStopButton.TButton')
 
     def on_stop(self):
         self.on_stop_experiment_callback()
@@ -432,14 +540,15 @@ class _ExperimentManager(ttk.Frame):
         self.folder_entry.xview_moveto(1)  # Scroll so the end is visible
 
     @staticmethod
-    def validate_participant_folder() -> Optional[StimulationOrder]:
+    def validate_participant_folder() -> Optional[tuple[StimulationOrder, bool]]:
         """Check if the participant folder contains the necessary files (stimulation order and potentially calibration order).
-        :return: The StimulationOrder if it could be read. None otherwise."""
+        If it contains the data of a previous session, the experimenter is asked whether to resume it.
+        :return: The StimulationOrder if it could be read and whether to resume the previous session.
+        None otherwise or if the experimenter cancels."""
         s = Settings()
         # noinspection PyBroadException
         try:
             stim_order = StimulationOrder.from_file(s.get_stim_order_path())
-            return stim_order
         except FileNotFoundError:
             messagebox.showerror("File Not Found",
                                  f"The stimulation order file '{s.get_stim_order_path()}' was not found in the given directory.")
@@ -448,3 +557,32 @@ class _ExperimentManager(ttk.Frame):
             messagebox.showerror("File Error",
                                  f"There was an error regarding the stimulation order in the given directory:\n\n{traceback.format_exc()}")
             return None
+
+        resume = False
+        if ParticipantData.has_legacy_data(s.get_journal_path(), s.get_calibration_data_path(),
+                                           s.get_sensation_data_path()):
+            resume = messagebox.askyesnocancel(
+                "Resume Session",
+                "The participant folder contains the data of a previous session in the old format.\n\n"
+                "Yes: Convert it and resume the session at the first trial which hasn't been recorded.\n"
+                "No: Start a new session. The previous data is overwritten.")
+        elif ParticipantData.journal_exists(s.get_journal_path()):
+            try:
+                completed = ParticipantData.session_completed(s.get_journal_path())
+            except ValueError:
+                completed = False  # Reported when the session is resumed
+            if completed:
+                if not messagebox.askyesno(
+                        "Session Complete",
+                        "All trials of this participant have already been recorded.\n\n"
+                        "Start a new session? The previous data is overwritten."):
+                    return None
+            else:
+                resume = messagebox.askyesnocancel(
+                    "Resume Session",
+                    "The participant folder contains the data of a previous session.\n\n"
+                    "Yes: Resume the session at the first trial which hasn't been recorded.\n"
+                    "No: Start a new session. The previous data is overwritten.")
+        if resume is None:
+            return None
+        return stim_order, resume
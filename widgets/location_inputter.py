@@ -1,9 +1,11 @@
 import tkinter as tk
+import weakref
 from tkinter import ttk
-from PIL import Image, ImageTk
-from pathlib import Path
+from PIL import ImageTk
 from enum import Enum
 
+from backend.image_cache import ImageCache, image_cache
+
 
 class LocationType(Enum):
     FOOT = "foot"
@@ -35,50 +37,78 @@ class LocationInputter(tk.Canvas):
         "Calf": {"x_rel": 0.32, "y_rel": 0.6, 'background': '#DCDCDC'},
         "Shin": {"x_rel": 0.67, "y_rel": 0.6, 'background': '#DCDCDC'}
     }
-    IMAGES_DIR = Path(__file__).parent.parent / 'images'
+    IMAGE_WIDTH = 600  # The default width of the images in pixels at the ImageCache.REFERENCE_DPI
+
+    # The PhotoImages are shared by all inputters of a Tk root: {root: {(image name, width, scaling): PhotoImage}}
+    _photos: weakref.WeakKeyDictionary[tk.Misc, dict[tuple[str, int, float], ImageTk.PhotoImage]] = \
+        weakref.WeakKeyDictionary()
+    # The roots whose checkbutton styles have been configured
+    _styled_roots: weakref.WeakSet[tk.Misc] = weakref.WeakSet()
 
     def __init__(self, master, location_type: LocationType, location_vars: dict[str, tk.BooleanVar],
-                 image_width: int = 600):
+                 image_width: int = IMAGE_WIDTH):
         super().__init__(master)
         self.location_vars = location_vars
-        self.style = ttk.Style()
+        self._configure_styles()
 
         # Select correct values based on the type of inputter
         checkbox_params = self.FOOT_CHECKBOXES if location_type == LocationType.FOOT else self.LEG_CHECKBOXES
-        image_path = self.IMAGES_DIR / location_type.image_name
 
-        # Load, scale, and display the image
-        image = Image.open(image_path)
-        scaling = image_width / image.width
-        scaled_height = round(scaling * image.height)
-        image = image.resize((image_width, scaled_height), Image.Resampling.LANCZOS)
-
-        self.photo = ImageTk.PhotoImage(image)
+        # Display the scaled image
+        self.photo = self._photo_image(location_type.image_name, image_width)
         self.create_image(0, 0, image=self.photo, anchor="nw")
 
         # Set canvas size to match the image
-        self.config(width=image.width, height=image.height)
+        self.config(width=self.photo.width(), height=self.photo.height())
 
         # Add all the Checkbuttons
         for name, params in checkbox_params.items():
-            self.add_checkbutton(name, _(name), params['x_rel'], params['y_rel'], params['background'])
-
-    def add_checkbutton(self, button_id, display_name, relx: float, rely: float, color: str):
-        """Add a checkbutton at the specified coordinates
+            self.add_checkbutton(name, _(name), params['x_rel'], params['y_rel'])
+
+    @classmethod
+    def warm_up_images(cls, widget: tk.Misc, image_width: int = IMAGE_WIDTH):
+        """Decode and scale the images on a background thread, e.g. at startup, so the first inputters open fast.
+        :param widget: A widget on the screen of the inputters, whose scaling the images are loaded for."""
+        image_cache.warm_up([location_type.image_name for location_type in LocationType], image_width,
+                            ImageCache.screen_scaling(widget))
+
+    def _photo_image(self, image_name: str, width: int) -> ImageTk.PhotoImage:
+        """The PhotoImage of the scaled image. It's only created once per Tk root."""
+        photos = self._photos.setdefault(self._root(), {})
+        scaling = ImageCache.screen_scaling(self)
+        key = (image_name, width, scaling)
+        if key not in photos:
+            photos[key] = ImageTk.PhotoImage(image_cache.scaled_image(image_name, width, scaling), master=self)
+        return photos[key]
+
+    def _configure_styles(self):
+        """Configure the styles of all checkbuttons. It's only done once per Tk root."""
+        root = self._root()
+        if root in self._styled_roots:
+            return
+        style = ttk.Style(self)
+        for button_id, params in {**self.FOOT_CHECKBOXES, **self.LEG_CHECKBOXES}.items():
+            # indicatorbackground makes the box itself adjust to the background color
+            style.configure(self._style_name(button_id), background=params['background'], font=30,
+                            indicatorbackground=params['background'])
+        self._styled_roots.add(root)
+
+    @staticmethod
+    def _style_name(button_id: str) -> str:
+        return f'Custom.{button_id}.TCheckbutton'
+
+    def add_checkbutton(self, button_id, display_name, relx: float, rely: float):
+        """Add a checkbutton at the specified coordinates. Its style is configured by _configure_styles().
         :param button_id: The English name of the location (e.g. "Calf")
         :param display_name: The text that the checkbutton shows (e.g. "Calf" or "Schienbein")
         :param relx: The relative x position (0-1)
         :param rely: The relative y position (0-1)
-        :param color: The background color of the checkbutton
         """
         assert 0 <= relx <= 1
         assert 0 <= rely <= 1
 
-        style_name = f'Custom.{button_id}.TCheckbutton'
-        self.style.configure(style_name, background=color, font=30,
-                             indicatorbackground=color,  # make the box itself adjust to the background color
-                             )
-        cb = ttk.Checkbutton(self, variable=self.location_vars[button_id], text=display_name, style=style_name)
+        cb = ttk.Checkbutton(self, variable=self.location_vars[button_id], text=display_name,
+                             style=self._style_name(button_id))
         cb.place(relx=relx, rely=rely, anchor='center')
 
     def get_states(self):
@@ -5,18 +5,25 @@ from tkinter import messagebox
 from backend.participant_data import ParticipantData
 from backend.stimulation_order import StimulationOrder
 from backend.stimulator import Stimulator
-from .phases import CalibrationPhase, SensoryPhase
+from backend.settings import Settings
+from .phases import CalibrationPhase, RampCalibrationPhase, SensoryPhase
 
 
 class ParticipantWindow(tk.Toplevel):
     def __init__(self, master: tk.Tk, stimulator: Stimulator, stim_order: StimulationOrder,
-                 participant_data: ParticipantData):
+                 participant_data: ParticipantData, skip_calibration: bool = False):
+        """The window the participant sees.
+        :param skip_calibration: Whether to start with the sensory phase, e.g. when a session is resumed."""
         super().__init__(master)
         self.stimulator, self.stim_order, self.participant_data = stimulator, stim_order, participant_data
 
         self.title(_('Participant View'))
 
-        self.state('zoomed')  # Make the window fullscreen
+        # Make the window fullscreen
+        try:
+            self.state('zoomed')
+        except tk.TclError:
+            self.attributes('-zoomed', True)  # X11 doesn't support the zoomed state
         self.minsize(1200, 900)
 
         # disabled closing the window
@@ -24,15 +31,28 @@ class ParticipantWindow(tk.Toplevel):
                       lambda: messagebox.showinfo(_("Not closable"),
                                                   _("This window must be closed in the experimenter view")))
 
-        self.current_frame = CalibrationPhase(self, stimulator, self.participant_data, self.start_sense_phase, )
-        self.current_frame.grid(row=0, column=0, sticky='nsew')
-
         self.columnconfigure(0, weight=1)
         self.rowconfigure(0, weight=1)
 
+        self.current_frame = None
+        if skip_calibration:
+            self.start_sense_phase()
+        elif Settings.CALIBRATION_MODE == 'ramp':
+            self._show_phase(RampCalibrationPhase(self, stimulator, self.participant_data, self.start_sense_phase,
+                                                  self.start_manual_calibration))
+        else:
+            self.start_manual_calibration()
+
+    def start_manual_calibration(self):
+        """Calibrate with the intensities the participant reports, e.g. if they didn't feel the ramp."""
+        self._show_phase(CalibrationPhase(self, self.stimulator, self.participant_data, self.start_sense_phase))
 
     def start_sense_phase(self):
         logging.info('--- Sensory Phase ---')
-        self.current_frame.destroy()
-        self.current_frame = SensoryPhase(self, self.stimulator, self.participant_data, self.stim_order)
+        self._show_phase(SensoryPhase(self, self.stimulator, self.participant_data, self.stim_order))
+
+    def _show_phase(self, phase: tk.Frame):
+        if self.current_frame is not None:
+            self.current_frame.destroy()
+        self.current_frame = phase
         self.current_frame.grid(row=0, column=0, sticky='nsew')
@@ -57,6 +57,28 @@ class StimulationFrame(tk.Frame):
         title.pack(pady=(100, 0))
 
 
+class RampFrame(tk.Frame):
+    def __init__(self, master: tk.Widget, instructions: str, on_press: Callable[[], None]):
+        """The Frame to show during the ramp calibration. The participant presses the space bar (or the button) when
+        the sensation reaches what the instructions ask for."""
+        super().__init__(master)
+        self.on_press = on_press
+
+        ttk.Label(self, text=_('Stimulating...'), style='Heading2.TLabel').pack(pady=(100, 20))
+        self.instructions = ttk.Label(self, text=instructions, style='Bold.TLabel', anchor='center',
+                                      justify='center')
+        self.instructions.pack(pady=20)
+        ttk.Button(self, text=_('Press the space bar'), padding=(20, 20), command=self.on_press).pack(pady=20)
+
+        # The frame has the keyboard focus while it's shown, so the binding doesn't affect other widgets and is
+        # removed with the frame
+        self.bind('<KeyPress-space>', lambda _event: self.on_press())
+        self.bind('<Map>', lambda _event: self.focus_set())
+
+    def set_instructions(self, instructions: str):
+        self.instructions.config(text=instructions)
+
+
 class InputIntensityFrame(tk.Frame):
     # noinspection PyUnreachableCode
     if False:  # Just so gettext realizes that these strings need to be translated
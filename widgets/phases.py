@@ -1,12 +1,14 @@
 import logging
+import time
 from tkinter import messagebox
-from typing import Any, override, Dict
-
-import numpy as np
+from typing import Any, override, Dict, Optional
 
+from backend.amplitude_ramp import AmplitudeRamp
+from backend.latency_metrics import LatencyMetrics
 from backend.participant_data import ParticipantData
 from backend.stimulation_order import StimulationOrder
 from backend.stimulator import Stimulator
+from backend.threshold_estimation import ThresholdEstimator, StaircaseEstimator, PsiEstimator
 from .evoked_sensations_frame import EvokedSensationsFrame
 from .phase_frames import *
 
@@ -17,16 +19,29 @@ class _BasePhase(tk.Frame):
         super().__init__(master)
         self.stimulator, self.participant_data = stimulator, participant_data
         self.frame = None  # Current frame
+        self._kept_frames: list[tk.Frame] = []  # Frames which are hidden instead of destroyed, so they can be reused
+        self._query_frame: Optional[tk.Frame] = None  # The query screen of the current trial, built in advance
+
+    def keep_frame(self, frame: tk.Frame) -> tk.Frame:
+        """Don't destroy the frame when another one is shown, so it can be shown again.
+        :return: The frame"""
+        self._kept_frames.append(frame)
+        return frame
 
     def show_frame(self, frame: tk.Frame):
-        if self.frame is not None:
-            self.frame.destroy()
+        if self.frame is not None and self.frame is not frame:
+            if self.frame in self._kept_frames:
+                self.frame.grid_forget()
+            else:
+                self.frame.destroy()
         self.frame = frame
         frame.grid(row=0, column=0, sticky='nsew')
         self.rowconfigure(0, weight=1)
         self.columnconfigure(0, weight=1)
 
     def start_countdown(self):
+        # Build the query screen during the countdown and stimulation, when the Tk loop is idle anyway
+        self.after_idle(self.prepare_query_frame)
         if Settings.COUNTDOWN_DURATION > 0:
             countdown_frame = CountdownFrame(self, Settings.COUNTDOWN_DURATION, self.stimulate)
             self.show_frame(countdown_frame)
@@ -45,8 +60,38 @@ class _BasePhase(tk.Frame):
             'The stimulator has encountered an error.\nPlease ask the experimenter to fix any issues.\nThen, the trial will be repeated.'),
                                            button_text='▶ ' + _('Continue Stimulation'), command=self.start_countdown))
 
+    def build_query_frame(self) -> Optional[tk.Frame]:
+        """Build the frame which asks the participant about the current trial, without showing it.
+        :return: The frame, or None if the phase doesn't query after stimulating."""
+        return None
+
+    def prepare_query_frame(self):
+        """Build the query screen of the current trial in advance, so it can be shown as soon as the stimulation
+        ends."""
+        if self._query_frame is None:
+            start_time = time.perf_counter()
+            self._query_frame = self.build_query_frame()
+            if self._query_frame is not None:
+                self.stimulator.metrics.record(LatencyMetrics.QUERY_BUILD, time.perf_counter() - start_time)
+
     def query_after_stimulation(self):
-        raise NotImplementedError
+        """Show the query screen (which has usually been prepared during the stimulation) and record how long after
+        the end of the stimulation it's interactive. Without a query screen, it continues with the next trial."""
+        # The stimulation ended when the stop was sent, which can be before this is called
+        if self.stimulator.start_time is not None and self.stimulator.last_stimulation_duration_s is not None:
+            end_time = self.stimulator.start_time + self.stimulator.last_stimulation_duration_s
+        else:
+            end_time = time.perf_counter()
+        self.prepare_query_frame()
+        query_frame, self._query_frame = self._query_frame, None
+        if query_frame is None:
+            # Nothing to ask, so there's no query latency either
+            self.on_continue_after_querying()
+            return
+        self.show_frame(query_frame)
+        # Idle callbacks run in order, so this runs after the screen has been laid out and drawn
+        self.after_idle(lambda: self.stimulator.metrics.record(LatencyMetrics.QUERY_LATENCY,
+                                                                time.perf_counter() - end_time))
 
     def on_continue_after_querying(self, *args, **kwargs):
         raise NotImplementedError
@@ -67,10 +112,20 @@ class CalibrationPhase(_BasePhase):
         'Painful': -1.0
     }
 
-    def __init__(self, master, stimulator: Stimulator, participant_data: ParticipantData, on_phase_over: Callable):
-        """The Frame for the calibration phase where the participant can adjust the amplitude of the stimulation."""
+    # The intensity whose amplitude is estimated in the adaptive (psi) calibration
+    TARGET_INTENSITY = 'Very strong'
+
+    def __init__(self, master, stimulator: Stimulator, participant_data: ParticipantData, on_phase_over: Callable,
+                 estimator: Optional[ThresholdEstimator] = None):
+        """The Frame for the calibration phase where the participant can adjust the amplitude of the stimulation.
+        :param estimator: Chooses the amplitudes from the reported intensities. Defaults to the one of
+        ``Settings.CALIBRATION_MODE``, starting at the current amplitude."""
         super().__init__(master, stimulator, participant_data)
         self.on_end_of_phase = on_phase_over
+        if estimator is None:
+            estimator = self.create_estimator(Settings.CALIBRATION_MODE, Settings().amplitude.get())
+        self.estimator = estimator
+        Settings().amplitude.set(self.estimator.next_amplitude())
         self.show_frame(
             TextAndButtonFrame(self,
                                title_text=_('Calibration Phase'),
@@ -81,6 +136,14 @@ class CalibrationPhase(_BasePhase):
                                button_text='▶ ' + _('Start Stimulation'),
                                command=self.start_countdown, ))
 
+    @classmethod
+    def create_estimator(cls, mode: str, start_ma: float) -> ThresholdEstimator:
+        """The estimator of a calibration mode: 'psi' for the adaptive estimation, otherwise the fixed staircase."""
+        minimum, maximum = Settings.PARAMETER_OPTIONS['amplitude']['range']
+        if mode == 'psi':
+            return PsiEstimator(InputIntensityFrame.INTENSITY_OPTIONS, cls.TARGET_INTENSITY, start_ma, minimum, maximum)
+        return StaircaseEstimator(cls.INTENSITY_INCREMENT_MAP, start_ma, minimum, maximum)
+
     @override
     def stimulate(self):
         s = Settings()
@@ -90,46 +153,129 @@ class CalibrationPhase(_BasePhase):
         self.show_frame(StimulationFrame(self))
 
     @override
-    def query_after_stimulation(self):
-        self.show_frame(InputIntensityFrame(self, on_continue=self.on_continue_after_querying))
+    def build_query_frame(self) -> tk.Frame:
+        return InputIntensityFrame(self, on_continue=self.on_continue_after_querying)
 
     def on_continue_after_querying(self, intensity: str):
-        """Save the stimulation amplitude and reported intensity and adjust the amplitude based on the intensity selected by the participant.
+        """Save the stimulation amplitude and reported intensity and let the estimator choose the next amplitude.
         :param intensity: The intensity selected by the participant."""
         # Save stimulation parameters
-        self.participant_data.update_calibration_data(Settings().amplitude.get(), intensity)
-
-        # Get intensity increment
-        try:
-            increment_ma = self.INTENSITY_INCREMENT_MAP[intensity]
-        except KeyError:
-            raise ValueError(
-                f"intensity should be in {list(self.INTENSITY_INCREMENT_MAP.keys())} but is '{intensity}'.")
-
-        # adjust amplitude
-        if increment_ma != 0.0:
-            new_amplitude = Settings().amplitude.get() + increment_ma
-            # make sure it's in range
-            minimum, maximum = Settings().PARAMETER_OPTIONS['amplitude']['range']
-            new_amplitude = float(np.clip(new_amplitude, minimum, maximum))
-            if new_amplitude in [minimum, maximum]:
-                logging.info(
-                    f'Amplitude has reached its {"minimum" if new_amplitude == minimum else "maximum"} of {new_amplitude} mA.')
-            else:
-                logging.info(f'Increasing amplitude by {increment_ma} mA to {new_amplitude} mA')
-            Settings().amplitude.set(new_amplitude)
+        amplitude = Settings().amplitude.get()
+        self.participant_data.update_calibration_data(amplitude, intensity)
+
+        self.estimator.update(amplitude, intensity)
+        Settings().amplitude.set(self.estimator.next_amplitude())
+        if not self.estimator.finished:
             self.start_countdown()
         else:
             # We've reached our target intensity and the calibration phase is over.
+            logging.info(f'Calibrated amplitude: {Settings().amplitude.get()} mA')
+            self.participant_data.update_calibrated_amplitude(Settings().amplitude.get())
+            self.participant_data.compact()
             self.show_frame(TextAndButtonFrame(self, _('Calibration Phase Completed!'),
                                                _('Continue to sensory response phase'), self.on_end_of_phase))
 
 
+class RampCalibrationPhase(_BasePhase):
+    # The intensities recorded in the calibration data
+    DETECTION = 'Detection'
+    DISCOMFORT = 'Discomfort'
+    MAXIMUM_REACHED = 'Maximum reached'
+    NOT_DETECTED = 'Not detected'  # The maximum was reached without a detection press
+
+    def __init__(self, master, stimulator: Stimulator, participant_data: ParticipantData, on_phase_over: Callable,
+                 on_manual_calibration: Callable):
+        """The Frame for the calibration phase where the amplitude rises continuously and the participant presses a
+        key when they first feel the stimulation and when it becomes uncomfortable.
+        :param on_manual_calibration: Called to continue with the manual calibration instead, if the participant
+        didn't feel the ramp and the experimenter doesn't repeat it."""
+        super().__init__(master, stimulator, participant_data)
+        self.on_end_of_phase = on_phase_over
+        self.on_manual_calibration = on_manual_calibration
+        self.ramp = None
+        self.detection = None  # The mark of the detection press of the current ramp
+        self.show_instructions()
+
+    def show_instructions(self):
+        self.show_frame(
+            TextAndButtonFrame(self,
+                               title_text=_('Calibration Phase'),
+                               body_text=_(
+                                   'The stimulation intensity calibration will now begin.\n'
+                                   'The stimulation will start weak and become stronger.\n'
+                                   'Press the space bar as soon as you feel it, '
+                                   'and press it again as soon as it becomes uncomfortable.\n'
+                                   'Begin when you are ready.'),
+                               button_text='▶ ' + _('Start Stimulation'),
+                               command=self.start_countdown, ))
+
+    @override
+    def stimulate(self):
+        s = Settings()
+        self.detection = None
+        self.ramp = AmplitudeRamp(self, self.stimulator, s.channel.get(), s.get_stimulation_parameters(),
+                                  s.CALIBRATION_RAMP_RATE_MA_PER_S, s.PARAMETER_OPTIONS['amplitude']['range'][1])
+        self.show_frame(RampFrame(self, _('Press the space bar as soon as you feel the stimulation.'), self.on_press))
+        self.ramp.start(self.on_maximum_reached, self.on_stimulation_error)
+
+    def on_press(self):
+        """The first press marks the detection and the second one the discomfort, which ends the calibration."""
+        if self.ramp is None or not self.ramp.running:
+            return
+        if self.detection is None:
+            self.detection = self.ramp.mark()
+            self._save(self.detection, self.DETECTION)
+            self.frame.set_instructions(_('Press the space bar as soon as the stimulation becomes uncomfortable.'))
+        else:
+            discomfort = self.ramp.stop()
+            self._save(discomfort, self.DISCOMFORT)
+            self._finish(AmplitudeRamp.comfortable_amplitude(self.detection['amplitude_ma'],
+                                                             discomfort['amplitude_ma'], self.ramp.maximum_ma))
+
+    def on_maximum_reached(self):
+        maximum_ma = self.ramp.maximum_ma
+        if self.detection is not None:
+            self._save(self.ramp.mark(), self.MAXIMUM_REACHED)
+            logging.info(f'Amplitude has reached its maximum of {maximum_ma} mA.')
+            self._finish(AmplitudeRamp.comfortable_amplitude(self.detection['amplitude_ma'], None, maximum_ma))
+            return
+        # Not a threshold, so the calibrated amplitude isn't saved
+        self._save(self.ramp.mark(), self.NOT_DETECTED)
+        logging.warning(f'The stimulation was not detected up to the maximum of {maximum_ma} mA.')
+        self.ramp = None
+        if messagebox.askyesno('Not Detected', f'The participant did not report feeling the stimulation up to the '
+                                               f'maximum of {maximum_ma} mA.\n\nRepeat the ramp? '
+                                               f'Otherwise, the calibration continues manually.'):
+            self.show_instructions()
+        else:
+            self.on_manual_calibration()
+
+    def _save(self, mark: dict, intensity: str):
+        logging.info(f"{intensity} at {mark['amplitude_ma']} mA after {mark['ramp_time_s']:.3f} s")
+        self.participant_data.update_calibration_data(mark['amplitude_ma'], intensity, ramp_time_s=mark['ramp_time_s'],
+                                                      timestamp=mark['timestamp'])
+
+    def _finish(self, amplitude_ma: float):
+        Settings().amplitude.set(amplitude_ma)
+        self.participant_data.update_calibrated_amplitude(amplitude_ma)
+        self.participant_data.compact()
+        self.ramp = None
+        self.show_frame(TextAndButtonFrame(self, _('Calibration Phase Completed!'),
+                                           _('Continue to sensory response phase'), self.on_end_of_phase))
+
+    @override
+    def on_stimulation_error(self, channel: int):
+        self.ramp = None
+        super().on_stimulation_error(channel)
+
+
 class SensoryPhase(_BasePhase):
     def __init__(self, master, stimulator: Stimulator, participant_data: ParticipantData, stim_order: StimulationOrder):
         """The Frame for the sensory phase"""
         super().__init__(master, stimulator, participant_data)
         self.stim_order = stim_order
+        # Reused for every trial
+        self.evoked_sensations_frame: Optional[EvokedSensationsFrame] = None
         self.show_frame(TextAndButtonFrame(self, title_text=_('Sensory Response Phase'),
                                            body_text=_(
                                                'The stimulation will now continue\n'
@@ -149,10 +295,16 @@ class SensoryPhase(_BasePhase):
         self.show_frame(StimulationFrame(self))
 
     @override
-    def query_after_stimulation(self):
-        self.show_frame(EvokedSensationsFrame(self, on_continue=self.on_continue_after_querying,
-                                              trial_number=self.stim_order.current_trial().trial,
-                                              trials_in_block=self.stim_order.n_trials_in_current_block()))
+    def build_query_frame(self) -> tk.Frame:
+        trial_number = self.stim_order.current_trial().trial
+        trials_in_block = self.stim_order.n_trials_in_current_block()
+        if self.evoked_sensations_frame is None:
+            self.evoked_sensations_frame = self.keep_frame(
+                EvokedSensationsFrame(self, on_continue=self.on_continue_after_querying, trial_number=trial_number,
+                                      trials_in_block=trials_in_block))
+        else:
+            self.evoked_sensations_frame.reset(trial_number, trials_in_block)
+        return self.evoked_sensations_frame
 
     @override
     def on_continue_after_querying(self, sensations: list[dict[str, Any]]):
@@ -160,7 +312,8 @@ class SensoryPhase(_BasePhase):
         :param sensations: A dict of the sensations the participant entered."""
         # Save sensation data
         old_trial_info = self.stim_order.current_trial()
-        self.participant_data.update_sensation_data(old_trial_info, sensations)
+        self.participant_data.update_sensation_data(old_trial_info, sensations,
+                                                    self.stimulator.last_stimulation_duration_s)
 
         # Continue
         new_trial_info = self.stim_order.next_trial()
@@ -176,8 +329,14 @@ class SensoryPhase(_BasePhase):
             self.start_countdown()
 
     def on_end_of_block(self, completed_block_number: int, n_blocks: int):
+        self.participant_data.compact()
+        # Written in the background during the break. Failures are shown to the experimenter.
+        self.participant_data.when_written(
+            lambda: logging.info(f'The data of block {completed_block_number} has been written'))
         self.show_frame(EndOfBlockFrame(self, completed_block_number, n_blocks, self.start_countdown))
 
     @override
     def on_end_of_phase(self):
+        self.participant_data.mark_completed()
+        self.participant_data.compact()
         self.show_frame(ExperimentCompletedFrame(self))